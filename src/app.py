@@ -8,95 +8,132 @@ Python Version: 3.8
 This file is the entry point for our dash app.
 """
 
+import io
+import logging
+import os
+import threading
+
 import dash
 import dash_html_components as html
 import dash_core_components as dcc
 from dash.dependencies import Input, Output
-import pandas as pd
+from flask import abort, jsonify, request
 
+from figure_payload import compact_figure, payload_stats
+from http_cache import register_http_cache, response_cache
+from memory_report import memory_report, register_memory_logger
+from single_flight import flights
+import persistent_cache
+from background import HIDDEN, VISIBLE, create_background_manager, report_progress
 from speechiness_line_chart import get_speechiness_line_chart_content
-from waffle_content import get_waffle_content
+from waffle_content import get_waffle_content, register_waffle_callbacks
 from audio_listener_tab import get_audio_listener_content, register_callbacks
-from temporal_pattern_tab import get_temporal_pattern_content
+from temporal_pattern_tab import get_temporal_pattern_content, highlight_positions
+from track_search import (
+    get_track_search_content,
+    register_highlight,
+    register_track_search_callbacks,
+)
 from genre_trends_tab import get_genre_trends_content, register_genre_trends_callbacks
 from main_visualization import get_main_visualization_content, register_main_visualization_callbacks
-from preprocess import load_and_clean_data, calculate_custom_jitter
+from dataset import (
+    append_tracks,
+    DEFAULT_DATASET,
+    available_datasets,
+    get_tracks,
+    get_version,
+    load_dataset,
+    pool,
+    register_snapshot_hooks,
+    reload_dataset,
+)
 
-app = dash.Dash(__name__)
+app = dash.Dash(__name__, background_callback_manager=create_background_manager())
 app.title = "Project | INF8808"
+register_snapshot_hooks(app.server)
+register_http_cache(app)
+register_memory_logger(app.server)
 
-dataframe = pd.read_csv("./assets/data/spotify_songs.csv")
-df = load_and_clean_data()
+def serve_layout():
+    """Build the page on every load so it reflects appended tracks"""
+    return html.Div(
+        className="content",
+        children=[
+            html.Header(
+                children=[
+                    html.H1(
+                        "Spotify Songs Analysis",
+                        style={
+                            "textAlign": "center",
+                            "color": "#1DB954",
+                            "marginBottom": "10px",
+                            "fontFamily": "Arial, sans-serif",
+                        },
+                    ),
+                    html.H2(
+                        "Music Trends & Market Intelligence",
+                        style={
+                            "textAlign": "center",
+                            "color": "#666",
+                            "fontWeight": "normal",
+                            "fontSize": "18px",
+                            "marginBottom": "30px",
+                        },
+                    ),
+                ],
+                style={
+                    "backgroundColor": "#191414",
+                    "padding": "30px 20px",
+                    "marginBottom": "30px",
+                },
+            ),
+            html.Div(
+                className="main-viz-section",
+                children=[get_main_visualization_content()],
+                style={
+                    "backgroundColor": "white",
+                    "padding": "20px",
+                    "marginBottom": "20px",
+                    "borderRadius": "10px",
+                    "boxShadow": "0 2px 10px rgba(0,0,0,0.1)",
+                },
+            ),
+            get_track_search_content(),
+            dcc.Tabs(
+                id="theme-tabs",
+                value="tab-1",
+                children=[
+                    dcc.Tab(label="Genre Trends and Market Evolution", value="tab-1"),
+                    dcc.Tab(label="Lyrics and Thematic Analysis", value="tab-2"),
+                    dcc.Tab(label="Audio & Listener Behavior", value="tab-3"),
+                    dcc.Tab(label="Temporal Pattern", value="tab-4"),
+                ],
+                style={"marginTop": "40px"},
+                colors={"border": "#1DB954", "primary": "#1DB954", "background": "#f8f9fa"},
+            ),
+            html.Div(id="tab-content", style={"marginTop": "20px"}),
+        ],
+        style={
+            "backgroundColor": "#f5f5f5",
+            "minHeight": "100vh",
+            "fontFamily": "Arial, sans-serif",
+        },
+    )
+
+
+app.layout = serve_layout
 
-app.layout = html.Div(
-    className="content",
-    children=[
-        html.Header(
-            children=[
-                html.H1(
-                    "Spotify Songs Analysis",
-                    style={
-                        "textAlign": "center",
-                        "color": "#1DB954",
-                        "marginBottom": "10px",
-                        "fontFamily": "Arial, sans-serif",
-                    },
-                ),
-                html.H2(
-                    "Music Trends & Market Intelligence",
-                    style={
-                        "textAlign": "center",
-                        "color": "#666",
-                        "fontWeight": "normal",
-                        "fontSize": "18px",
-                        "marginBottom": "30px",
-                    },
-                ),
-            ],
-            style={
-                "backgroundColor": "#191414",
-                "padding": "30px 20px",
-                "marginBottom": "30px",
-            },
-        ),
-        html.Div(
-            className="main-viz-section",
-            children=[get_main_visualization_content()],
-            style={
-                "backgroundColor": "white",
-                "padding": "20px",
-                "marginBottom": "20px",
-                "borderRadius": "10px",
-                "boxShadow": "0 2px 10px rgba(0,0,0,0.1)",
-            },
-        ),
-        dcc.Tabs(
-            id="theme-tabs",
-            value="tab-1",
-            children=[
-                dcc.Tab(label="Genre Trends and Market Evolution", value="tab-1"),
-                dcc.Tab(label="Lyrics and Thematic Analysis", value="tab-2"),
-                dcc.Tab(label="Audio & Listener Behavior", value="tab-3"),
-                dcc.Tab(label="Temporal Pattern", value="tab-4"),
-            ],
-            style={"marginTop": "40px"},
-            colors={"border": "#1DB954", "primary": "#1DB954", "background": "#f8f9fa"},
-        ),
-        html.Div(id="tab-content", style={"marginTop": "20px"}),
-    ],
-    style={
-        "backgroundColor": "#f5f5f5",
-        "minHeight": "100vh",
-        "fontFamily": "Arial, sans-serif",
-    },
-)
 
-jittered_df = calculate_custom_jitter(df)
-tab_4_fig = get_temporal_pattern_content(jittered_df)
+# Load the data and warm the figures at import so gunicorn --preload shares them
+load_dataset()
 
 
-@app.callback(Output("tab-content", "children"), [Input("theme-tabs", "value")])
-def render_content(tab):
+# Waits on the overview's load (see get_main_visualization_content)
+@app.callback(
+    Output("tab-content", "children"),
+    [Input("theme-tabs", "value"), Input("overview-loaded", "data")],
+)
+def render_content(tab, _):
     if tab == "tab-1":
         return get_genre_trends_content()
     elif tab == "tab-2":
@@ -120,23 +157,24 @@ def render_content(tab):
                 html.P(
                     "These side-by-side waffle charts illustrate how speechiness levels "
                     "are distributed among songs with different popularity levels. Each chart "
-                    "represents 100% of songs using 100 squares."
+                    "represents 100% of songs using 100 squares. The sliders below adjust "
+                    "the speechiness band thresholds and the popularity split."
                 ),
                 html.Ul(
                     [
-                        html.Li(" Low (0.0-0.2): Mostly melodic or instrumental"),
-                        html.Li(
-                            " Medium (0.2-0.5): Balanced between singing and speaking"
-                        ),
-                        html.Li(" High (0.5-1.0): Strong spoken-word characteristics"),
+                        html.Li(" Low: Mostly melodic or instrumental"),
+                        html.Li(" Medium: Balanced between singing and speaking"),
+                        html.Li(" High: Strong spoken-word characteristics"),
                     ]
                 ),
                 html.P(
-                    "In popular songs (popularity > 60), high speechiness is often dominant, "
-                    "while less popular songs tend to have lower or medium speechiness levels."
+                    "Each chart's legend shows the band thresholds and its title the "
+                    "popularity split currently selected. In popular songs, high "
+                    "speechiness is often dominant, while less popular songs tend to "
+                    "have lower or medium speechiness levels."
                 ),
                 get_waffle_content(),
-                get_speechiness_line_chart_content(dataframe),
+                get_speechiness_line_chart_content(),
             ],
             style={
                 "backgroundColor": "white",
@@ -159,9 +197,9 @@ def render_content(tab):
         return html.Div(
             [
                 html.H3("Temporal Pattern of Song Popularity"),
+                html.Progress(id="temporal-pattern-progress", value="0", style=HIDDEN),
                 dcc.Graph(
                     id="temporal-pattern-graph",
-                    figure=tab_4_fig,
                     config={"responsive": True},
                     style={
                         "height": "800px",
@@ -178,14 +216,36 @@ def render_content(tab):
         )
 
 
+@app.callback(
+    Output("temporal-pattern-graph", "figure"),
+    [Input("temporal-pattern-graph", "id")],
+    background=True,
+    running=[(Output("temporal-pattern-progress", "style"), VISIBLE, HIDDEN)],
+    progress=[
+        Output("temporal-pattern-progress", "value"),
+        Output("temporal-pattern-progress", "max"),
+    ],
+    cancel=[Input("theme-tabs", "value")],
+)
+def render_temporal_pattern(set_progress, _):
+    """Build the scatter once the tab is shown, off the request worker"""
+    return compact_figure(
+        get_temporal_pattern_content(
+            get_tracks(), on_progress=report_progress(set_progress)
+        )
+    )
+
+
+register_highlight("temporal-pattern-graph", highlight_positions)
+
+
 register_callbacks(app)
 register_genre_trends_callbacks(app)
+register_waffle_callbacks(app)
 # Enregistre les callbacks de cross-filtering sur le graphique principal
 register_main_visualization_callbacks(app)
-
-
-if __name__ == "__main__":
-    app.run_server(debug=True)
+# After every register_highlight
+register_track_search_callbacks(app)
 
 
 @app.server.route("/health")
@@ -198,5 +258,102 @@ def health_check():
     return "OK"
 
 
+def check_admin_token():
+    """Rejects the request unless X-Admin-Token matches the ADMIN_TOKEN env variable."""
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if not admin_token or request.headers.get("X-Admin-Token") != admin_token:
+        abort(403)
+
+
+def admin_dataset_name():
+    """Dataset named by the ?dataset= query of an admin request, 404 if unknown."""
+    name = request.args.get("dataset", DEFAULT_DATASET)
+    if name not in available_datasets():
+        abort(404)
+    return name
+
+
+@app.server.route("/admin/append", methods=["POST"])
+def append_endpoint():
+    """
+    Appends the CSV rows posted in the request body to the in-memory dataset
+    picked by ?dataset= (the default dataset otherwise).
+    Returns:
+        JSON with the number of rows appended and the new dataset version.
+    """
+    check_admin_token()
+    name = admin_dataset_name()
+    appended = append_tracks(io.BytesIO(request.get_data()), name)
+    return jsonify({"appended": appended, "version": pool.peek(name).version})
+
+
+@app.server.route("/admin/reload", methods=["POST"])
+def reload_endpoint():
+    """
+    Rebuilds the snapshot of the dataset picked by ?dataset= from its CSV in
+    a background thread. The other workers pick up the new file through
+    their own watcher.
+    Returns:
+        JSON with the version serving this request, with status 202.
+    """
+    check_admin_token()
+    name = admin_dataset_name()
+    threading.Thread(
+        target=reload_dataset, args=(name,), kwargs={"force": True}, daemon=True
+    ).start()
+    return jsonify({"version": get_version()}), 202
+
+
+@app.server.route("/admin/datasets")
+def datasets_endpoint():
+    """
+    Lists the available datasets and the pool's memory use.
+    Returns:
+        JSON with the budget, per-dataset load, hit and eviction counts and
+        the persistent cache's counters.
+    """
+    check_admin_token()
+    stats = pool.stats()
+    stats["available"] = sorted(available_datasets())
+    stats["persistent_cache"] = dict(
+        persistent_cache.stats, code_version=persistent_cache.CODE_VERSION
+    )
+    return jsonify(stats)
+
+
+@app.server.route("/admin/figures")
+def figures_endpoint():
+    """
+    Reports how much the figure compaction saved in this worker.
+    Returns:
+        JSON with the number of figures and their sizes before and after.
+    """
+    check_admin_token()
+    return jsonify(payload_stats)
+
+
+@app.server.route("/admin/http-cache")
+def http_cache_endpoint():
+    """
+    Reports this worker's response cache and request coalescing.
+    Returns:
+        JSON with cache size, hits and misses, and coalesced request counts.
+    """
+    check_admin_token()
+    return jsonify({"responses": response_cache.stats(), "single_flight": flights.stats()})
+
+
+@app.server.route("/admin/memory")
+def memory_endpoint():
+    """
+    Reports the deep memory use of this worker's datasets and caches.
+    Returns:
+        JSON with per-dataset frames and caches, process RSS and malloc stats.
+    """
+    check_admin_token()
+    return jsonify(memory_report())
+
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     app.run_server(debug=True)
@@ -1,134 +1,361 @@
-import pandas as pd
-import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-
-import dash_core_components as dcc
-import dash_html_components as html
-from dash.dependencies import Input, Output
-
-df = pd.read_csv("./assets/data/spotify_songs.csv")
-df["year"] = pd.to_datetime(df["track_album_release_date"], errors="coerce").dt.year
-df["duration_min"] = df["duration_ms"] / 60000
-
-df_q9 = df.dropna(subset=["year", "duration_min", "track_popularity"])
-df_q9 = df_q9[df_q9["track_popularity"] >= 60]
-df_q9 = df_q9[df_q9["year"] >= 2000]
-avg_by_year = df_q9.groupby("year")["duration_min"].mean().reset_index()
-fig_q9 = go.Figure()
-if not avg_by_year.empty:
-    fig_q9.add_trace(
-        go.Scatter(
-            x=avg_by_year["year"],
-            y=avg_by_year["duration_min"],
-            mode="lines+markers",
-            line=dict(color="blue"),
-            name="Average Duration",
-        )
-    )
-fig_q9.update_layout(
-    title="9 – Evolution of Average Duration of Popular Songs over 20 years (2000–2020)",
-    xaxis_title="Year",
-    yaxis_title="Average Duration (min)",
-    autosize=True,
-    height=600,
-)
-
-df_q10 = df.dropna(
-    subset=["danceability", "tempo", "track_popularity", "playlist_genre"]
-)
-fig_q10 = px.scatter(
-    df_q10,
-    x="danceability",
-    y="tempo",
-    size="track_popularity",
-    color="playlist_genre",
-    size_max=12,
-    opacity=0.6,
-    hover_data=["track_name", "track_popularity", "playlist_genre"],
-    labels={
-        "danceability": "Danceability",
-        "tempo": "Tempo (BPM)",
-        "track_popularity": "Popularity",
-        "playlist_genre": "Genre",
-    },
-    title="10 & 11 – How does Danceability and Tempo influence Popularity by Genre",
-)
-fig_q10.update_layout(autosize=True, height=600)
-
-df_q12 = df.dropna(subset=["energy", "track_popularity", "playlist_genre"])
-genres = sorted(df_q12["playlist_genre"].unique())
-
-
-def generate_energy_distribution(selected_genres):
-    fig = go.Figure()
-
-    for genre in selected_genres:
-        subset = df_q12[df_q12["playlist_genre"] == genre]
-        if len(subset) > 10:
-            x = subset["energy"].values
-            w = subset["track_popularity"].values
-
-            hist, bin_edges = np.histogram(
-                x, bins=50, range=(0, 1), weights=w, density=True
-            )
-            bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
-
-            smoothed = np.convolve(hist, np.ones(5) / 5, mode="same")
-
-            fig.add_trace(
-                go.Scatter(
-                    x=bin_centers,
-                    y=smoothed,
-                    mode="lines",
-                    fill="tozeroy",
-                    name=genre,
-                    opacity=0.5,
-                )
-            )
-
-    fig.update_layout(
-        title="Q12 – Energy influence over Popularity across Genres",
-        xaxis_title="Energy",
-        yaxis_title="Popularity-weighted density",
-        height=600,
-    )
-    return fig
-
-
-def get_audio_listener_content():
-    return html.Div(
-        [
-            html.H3("Duration of Popular Songs (2000–2020)"),
-            dcc.Graph(
-                figure=fig_q9, config={"responsive": True}, style={"height": "600px"}
-            ),
-            html.H3("Danceability and Tempo vs Popularity"),
-            dcc.Graph(
-                figure=fig_q10, config={"responsive": True}, style={"height": "600px"}
-            ),
-            html.H3("Energy KDE-style by Genre"),
-            dcc.Dropdown(
-                id="genre-dropdown",
-                options=[{"label": genre, "value": genre} for genre in genres],
-                value=genres,
-                multi=True,
-                style={"width": "60%", "margin": "auto"},
-            ),
-            dcc.Graph(
-                id="energy-distribution-graph",
-                style={"height": "600px", "marginTop": "20px"},
-            ),
-        ]
-    )
-
-
-def register_callbacks(app):
-    @app.callback(
-        Output("energy-distribution-graph", "figure"),
-        [Input("genre-dropdown", "value")],
-    )
-    def update_energy_distribution(selected_genres):
-        if not selected_genres:
-            return go.Figure()
-        return generate_energy_distribution(selected_genres)
+import os
+
+import dash
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+import dash_core_components as dcc
+import dash_html_components as html
+from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
+
+from background import HIDDEN, VISIBLE, report_progress
+from dataset import get_tracks, run_query, versioned_cache
+from fast_figure import figure, layout, trace
+from figure_payload import compact_figure
+from row_index import column_values
+from track_search import highlight_trace, register_highlight
+
+# Cells per axis of the danceability x tempo grid, whatever the zoom level
+DANCEABILITY_TEMPO_BINS = int(os.environ.get("DANCEABILITY_TEMPO_BINS", "40"))
+DANCEABILITY_TEMPO_MODES = [
+    {"label": "Grid of cells", "value": "grid"},
+    {"label": "Every track", "value": "points"},
+]
+DANCEABILITY_TEMPO_COLUMNS = ["danceability", "tempo", "track_popularity", "playlist_genre"]
+GRID_MARKER_MAX = 18
+GRID_MIN_OPACITY = 0.25
+DANCEABILITY_TEMPO_TITLE = (
+    "10 & 11 – How does Danceability and Tempo influence Popularity by Genre"
+)
+
+
+def generate_duration_chart(duration_stats):
+    avg_by_year = duration_stats[duration_stats["year"] >= 2000]
+    fig_q9 = go.Figure()
+    if not avg_by_year.empty:
+        fig_q9.add_trace(
+            go.Scatter(
+                x=avg_by_year["year"],
+                y=avg_by_year["mean"],
+                mode="lines+markers",
+                line=dict(color="blue"),
+                name="Average Duration",
+            )
+        )
+    fig_q9.update_layout(
+        title="9 – Evolution of Average Duration of Popular Songs over 20 years (2000–2020)",
+        xaxis_title="Year",
+        yaxis_title="Average Duration (min)",
+        autosize=True,
+        height=600,
+    )
+    return fig_q9
+
+
+def generate_danceability_tempo_chart(df):
+    df_q10 = df.dropna(
+        subset=["danceability", "tempo", "track_popularity", "playlist_genre"]
+    )
+    fig_q10 = px.scatter(
+        df_q10,
+        x="danceability",
+        y="tempo",
+        size="track_popularity",
+        color="playlist_genre",
+        size_max=12,
+        opacity=0.6,
+        hover_data=["track_name", "track_popularity", "playlist_genre"],
+        labels={
+            "danceability": "Danceability",
+            "tempo": "Tempo (BPM)",
+            "track_popularity": "Popularity",
+            "playlist_genre": "Genre",
+        },
+        title=DANCEABILITY_TEMPO_TITLE,
+    )
+    fig_q10.add_trace(highlight_trace())
+    fig_q10.update_layout(autosize=True, height=600)
+    return fig_q10
+
+
+def bin_danceability_tempo(df, x_range=None, y_range=None, bins=DANCEABILITY_TEMPO_BINS):
+    """Track count, mean popularity and centroid per genre and grid cell.
+
+    The ranges default to the full extent of the data; tracks outside them
+    are left out, so a zoomed range gets bins x bins cells of its own.
+    """
+    df = df.dropna(subset=DANCEABILITY_TEMPO_COLUMNS)
+    x = df["danceability"].to_numpy(dtype=float)
+    y = df["tempo"].to_numpy(dtype=float)
+    genre_codes, genres = pd.factorize(df["playlist_genre"], sort=True)
+    if x_range is None:
+        x_range = (x.min(), x.max()) if len(x) else (0.0, 1.0)
+    if y_range is None:
+        y_range = (y.min(), y.max()) if len(y) else (0.0, 1.0)
+
+    inside = (
+        (x >= x_range[0]) & (x <= x_range[1]) & (y >= y_range[0]) & (y <= y_range[1])
+    )
+    x, y, genre_codes = x[inside], y[inside], genre_codes[inside]
+    popularity = df["track_popularity"].to_numpy(dtype=float)[inside]
+
+    def cell_of(values, value_range):
+        width = (value_range[1] - value_range[0]) / bins or 1.0
+        return np.clip(((values - value_range[0]) / width).astype(int), 0, bins - 1)
+
+    # One flat (genre, x cell, y cell) index, so each sum is a single bincount
+    cells = (genre_codes * bins + cell_of(x, x_range)) * bins + cell_of(y, y_range)
+    size = len(genres) * bins * bins
+    counts = np.bincount(cells, minlength=size)
+    occupied = np.flatnonzero(counts)
+    counts = counts[occupied]
+
+    def cell_mean(weights):
+        return np.bincount(cells, weights=weights, minlength=size)[occupied] / counts
+
+    return pd.DataFrame(
+        {
+            "playlist_genre": genres[occupied // (bins * bins)],
+            "danceability": cell_mean(x),
+            "tempo": cell_mean(y),
+            "count": counts,
+            "mean_popularity": cell_mean(popularity),
+        }
+    )
+
+
+def generate_danceability_tempo_grid(df, x_range=None, y_range=None):
+    """Danceability x tempo cells per genre: size by track count, opacity by popularity"""
+    cells = bin_danceability_tempo(df, x_range, y_range)
+    genres = sorted(df["playlist_genre"].dropna().unique())
+    colors = px.colors.qualitative.Plotly
+    sizeref = 2.0 * cells["count"].max() / GRID_MARKER_MAX**2 if len(cells) else 1
+
+    fig = go.Figure()
+    for i, genre in enumerate(genres):
+        genre_cells = cells[cells["playlist_genre"] == genre]
+        opacity = GRID_MIN_OPACITY + (1 - GRID_MIN_OPACITY) * (
+            genre_cells["mean_popularity"].to_numpy() / 100
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=genre_cells["danceability"],
+                y=genre_cells["tempo"],
+                mode="markers",
+                name=genre,
+                marker=dict(
+                    symbol="square",
+                    size=genre_cells["count"],
+                    sizemode="area",
+                    sizeref=sizeref,
+                    sizemin=2,
+                    color=colors[i % len(colors)],
+                    opacity=opacity,
+                ),
+                # customdata is sent as is, so only the digits shown on hover
+                customdata=genre_cells[["mean_popularity"]].round(1).to_numpy(),
+                hovertemplate=(
+                    f"Genre: {genre}<br>Tracks: %{{marker.size}}"
+                    "<br>Mean popularity: %{customdata[0]:.1f}"
+                    "<br>Danceability: %{x:.3f}<br>Tempo: %{y:.1f} BPM"
+                    "<extra></extra>"
+                ),
+            )
+        )
+    fig.add_trace(highlight_trace())
+
+    fig.update_layout(
+        title=DANCEABILITY_TEMPO_TITLE,
+        xaxis_title="Danceability",
+        yaxis_title="Tempo (BPM)",
+        legend_title_text="Genre",
+        autosize=True,
+        height=600,
+        # Keeps the user's zoom while the cells are re-binned
+        uirevision="danceability-tempo",
+    )
+    if x_range is not None:
+        fig.update_xaxes(range=list(x_range))
+    if y_range is not None:
+        fig.update_yaxes(range=list(y_range))
+    return fig
+
+
+def zoom_ranges(relayout_data):
+    """(x range, y range) zoomed to in relayoutData, None for autorange or unset"""
+    relayout_data = relayout_data or {}
+    ranges = []
+    for axis in ("xaxis", "yaxis"):
+        if f"{axis}.range" in relayout_data:
+            ranges.append(tuple(relayout_data[f"{axis}.range"]))
+        elif f"{axis}.range[0]" in relayout_data:
+            ranges.append(
+                (relayout_data[f"{axis}.range[0]"], relayout_data[f"{axis}.range[1]"])
+            )
+        else:
+            ranges.append(None)
+    return tuple(ranges)
+
+
+def changes_zoom(relayout_data):
+    return any(
+        key.startswith(("xaxis.range", "yaxis.range", "xaxis.autorange", "yaxis.autorange"))
+        for key in relayout_data or {}
+    )
+
+
+def generate_energy_distribution(selected_genres, on_progress=None):
+    """Figure dict from the fast builder, rebuilt on every genre selection"""
+    # Cleaned tracks already have energy, popularity and genre set
+    traces = []
+
+    for done, genre in enumerate(selected_genres, start=1):
+        x = column_values("energy", genre=genre)
+        if len(x) > 10:
+            w = column_values("track_popularity", genre=genre)
+
+            hist, bin_edges = np.histogram(
+                x, bins=50, range=(0, 1), weights=w, density=True
+            )
+            bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+
+            smoothed = np.convolve(hist, np.ones(5) / 5, mode="same")
+
+            traces.append(
+                trace(
+                    "scatter",
+                    x=bin_centers,
+                    y=smoothed,
+                    mode="lines",
+                    fill="tozeroy",
+                    name=genre,
+                    opacity=0.5,
+                )
+            )
+        if on_progress is not None:
+            on_progress(done, len(selected_genres))
+
+    return figure(
+        traces,
+        layout(
+            title="Q12 – Energy influence over Popularity across Genres",
+            xaxis=dict(title="Energy"),
+            yaxis=dict(title="Popularity-weighted density"),
+            height=600,
+        ),
+    )
+
+
+def danceability_tempo_highlight(rows):
+    tracks = get_tracks()
+    return (
+        tracks["danceability"].to_numpy()[rows],
+        tracks["tempo"].to_numpy()[rows],
+    )
+
+
+register_highlight("danceability-tempo-graph", danceability_tempo_highlight)
+
+
+@versioned_cache
+def danceability_tempo_points():
+    return compact_figure(generate_danceability_tempo_chart(get_tracks()))
+
+
+@versioned_cache
+def get_audio_listener_content():
+    df = get_tracks()
+    genres = sorted(df["playlist_genre"].unique())
+
+    return html.Div(
+        [
+            html.H3("Duration of Popular Songs (2000–2020)"),
+            dcc.Graph(
+                figure=compact_figure(
+                    generate_duration_chart(
+                        run_query("popular_yearly_stats", "duration_min", 60)
+                    )
+                ),
+                config={"responsive": True},
+                style={"height": "600px"},
+            ),
+            html.H3("Danceability and Tempo vs Popularity"),
+            dcc.RadioItems(
+                id="danceability-tempo-mode",
+                options=DANCEABILITY_TEMPO_MODES,
+                value="grid",
+                inline=True,
+            ),
+            dcc.Graph(
+                id="danceability-tempo-graph",
+                figure=compact_figure(generate_danceability_tempo_grid(df)),
+                config={"responsive": True},
+                style={"height": "600px"},
+            ),
+            html.H3("Energy KDE-style by Genre"),
+            dcc.Dropdown(
+                id="genre-dropdown",
+                options=[{"label": genre, "value": genre} for genre in genres],
+                value=genres,
+                multi=True,
+                style={"width": "60%", "margin": "auto"},
+            ),
+            html.Progress(
+                id="energy-distribution-progress",
+                value="0",
+                style=HIDDEN,
+            ),
+            dcc.Graph(
+                id="energy-distribution-graph",
+                style={"height": "600px", "marginTop": "20px"},
+            ),
+        ]
+    )
+
+
+def register_callbacks(app):
+    @app.callback(
+        Output("energy-distribution-graph", "figure"),
+        [Input("genre-dropdown", "value")],
+        background=True,
+        running=[
+            (Output("energy-distribution-progress", "style"), VISIBLE, HIDDEN),
+        ],
+        progress=[
+            Output("energy-distribution-progress", "value"),
+            Output("energy-distribution-progress", "max"),
+        ],
+        cancel=[Input("theme-tabs", "value")],
+    )
+    def update_energy_distribution(set_progress, selected_genres):
+        if not selected_genres:
+            return figure([], layout())
+        return compact_figure(
+            generate_energy_distribution(
+                selected_genres, on_progress=report_progress(set_progress)
+            )
+        )
+
+    @app.callback(
+        Output("danceability-tempo-graph", "figure"),
+        [
+            Input("danceability-tempo-mode", "value"),
+            Input("danceability-tempo-graph", "relayoutData"),
+        ],
+        prevent_initial_call=True,
+    )
+    def update_danceability_tempo(mode, relayout_data):
+        if dash.ctx.triggered_id == "danceability-tempo-graph" and (
+            mode != "grid" or not changes_zoom(relayout_data)
+        ):
+            # Plotly zooms the every-track view in the browser on its own
+            raise PreventUpdate
+        if mode == "points":
+            return danceability_tempo_points()
+        x_range, y_range = zoom_ranges(relayout_data)
+        return compact_figure(
+            generate_danceability_tempo_grid(get_tracks(), x_range, y_range)
+        )
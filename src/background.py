@@ -0,0 +1,71 @@
+"""
+Background callbacks for the dashboard's heavy figures.
+
+Callbacks declared with ``background=True`` run in a child process managed
+by Dash's DiskcacheManager instead of the gunicorn worker that received the
+request, so a slow figure never holds a worker until its --timeout. The
+browser polls the job, shows its progress, and a job is cancelled when its
+inputs change again or when one of its ``cancel`` inputs fires.
+
+Results are cached on disk in BACKGROUND_CACHE_DIR, keyed by the callback,
+its arguments and the dataset version, so every worker reuses a figure any
+of them computed for the same version.
+"""
+
+import os
+
+from dash import DiskcacheManager
+
+from dataset import get_version
+
+BACKGROUND_CACHE_DIR = os.environ.get(
+    "BACKGROUND_CACHE_DIR", "./.cache/background-callbacks"
+)
+# Seconds a cached result is kept; versions change on every reload or append
+BACKGROUND_CACHE_EXPIRE = int(os.environ.get("BACKGROUND_CACHE_EXPIRE", "3600"))
+BACKGROUND_CACHE_SIZE_LIMIT = int(
+    float(os.environ.get("BACKGROUND_CACHE_SIZE_MB", "512")) * 2**20
+)
+
+HIDDEN = {"visibility": "hidden"}
+VISIBLE = {"visibility": "visible"}
+
+
+class BackgroundManager(DiskcacheManager):
+    """DiskcacheManager that tolerates jobs exiting while being terminated"""
+
+    def terminate_job(self, job):
+        import psutil  # pylint: disable=import-outside-toplevel
+
+        try:
+            super().terminate_job(job)
+        except psutil.NoSuchProcess:
+            # Threads of a worker can both collect the same finished job
+            pass
+
+
+def create_background_manager():
+    """Disk-cache backed manager shared by every worker of the host"""
+    try:
+        import diskcache  # pylint: disable=import-outside-toplevel
+    except ImportError as error:
+        raise ImportError(
+            "Background callbacks need the diskcache, multiprocess and psutil "
+            "packages: pip install dash[diskcache]"
+        ) from error
+
+    cache = diskcache.Cache(
+        BACKGROUND_CACHE_DIR, size_limit=BACKGROUND_CACHE_SIZE_LIMIT
+    )
+    return BackgroundManager(
+        cache, cache_by=[get_version], expire=BACKGROUND_CACHE_EXPIRE
+    )
+
+
+def report_progress(set_progress):
+    """Adapt Dash's set_progress to the (done, total) hook of the figure builders"""
+
+    def on_progress(done, total):
+        set_progress((str(done), str(total)))
+
+    return on_progress
@@ -0,0 +1,69 @@
+"""
+Fixtures shared by the tests: a snapshot built from a small generated CSV.
+"""
+
+import pandas as pd
+import pytest
+
+import dataset
+import persistent_cache
+import query_backend
+from query_backend import StreamingBackend
+
+GENRES = ["pop", "rock", "rap"]
+SUBGENRES = ["dance pop", "album rock", None]
+RELEASE_DATES = [
+    "1999-03-14",
+    "2001-07-02",
+    "2001",
+    "2019-11-30",
+    "2019-12",
+    "1965-01-20",
+]
+
+
+def track_rows(count=60):
+    rows = []
+    for i in range(count):
+        rows.append(
+            {
+                "track_id": f"t{i}",
+                "track_name": f"Song {i}",
+                "track_artist": f"Artist {i % 7}",
+                "track_popularity": (i * 37) % 101,
+                "track_album_release_date": RELEASE_DATES[i % len(RELEASE_DATES)],
+                "playlist_genre": GENRES[i % len(GENRES)],
+                "playlist_subgenre": SUBGENRES[i % len(SUBGENRES)],
+                "danceability": (i % 10) / 10,
+                # A few rows without energy are dropped by every backend
+                "energy": None if i % 13 == 0 else (i % 9) / 9,
+                "valence": (i % 4) / 4,
+                "acousticness": (i % 5) / 5,
+                "speechiness": (i % 11) / 11,
+                "instrumentalness": (i % 3) / 3,
+                "tempo": 90 + i,
+                "duration_ms": 180000 + 1000 * (i % 6),
+            }
+        )
+    return rows
+
+
+@pytest.fixture(scope="module")
+def snapshot(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp("data")
+    pd.DataFrame(track_rows()).to_csv(data_dir / "tracks.csv", index=False)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(dataset, "DATA_DIR", str(data_dir))
+        patch.setattr(dataset, "STREAM_CHUNK_ROWS", 16)
+        patch.setattr(persistent_cache, "PERSISTENT_CACHE_DIR", "")
+        # Full folds, so one snapshot can answer through every backend
+        patch.setattr(query_backend, "_backend", StreamingBackend())
+        yield dataset._build_snapshot("tracks")  # pylint: disable=protected-access
+
+
+@pytest.fixture
+def pinned(snapshot, monkeypatch):
+    """The snapshot, in use as if a request had pinned it"""
+    # pylint: disable-next=protected-access
+    monkeypatch.setattr(dataset._local, "snapshot", snapshot, raising=False)
+    return snapshot
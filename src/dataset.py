@@ -0,0 +1,718 @@
+"""
+Shared track datasets, served as immutable versioned snapshots.
+
+Every CSV file in DATA_DIR is a dataset named after the file, e.g. a
+regional or monthly export. A dataset is loaded and cleaned once. Next to
+the cleaned rows we keep additive aggregates (track counts and column sums
+per year and genre, track counts per season and popularity for the jitter
+density map), so appending a batch of new tracks only costs the size of the
+batch.
+
+A snapshot is never modified once published. Reloads and appends build a
+new snapshot and its caches off the request path, then swap the reference
+held by the pool. Every Flask request is pinned to the snapshot that was
+current when it started, so in-flight callbacks finish on the version they
+began with. Each gunicorn worker runs a watcher that reloads a dataset when
+its CSV file changes; since versions are derived from the file's size and
+modification time, all workers converge on the same version.
+
+Loaded datasets live in a pool bounded by a memory budget: when it is
+exceeded, the least recently used datasets are evicted.
+
+Files are streamed in chunks of STREAM_CHUNK_ROWS rows and every
+aggregate is folded chunk by chunk, in a single pass. Unless the query
+backend needs every row, SAMPLE_ROWS > 0 keeps only a uniform random
+sample of the rows for the point-level charts, so a load's memory is
+bounded by the sample and one chunk rather than by the file size. Unless
+the backend needs every column, only TRACK_COLUMNS are kept.
+"""
+
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+import persistent_cache
+from preprocess import (
+    STREAM_CHUNK_ROWS,
+    calculate_custom_jitter,
+    clean_tracks,
+    count_popularity_density,
+    density_map_from_counts,
+    iter_clean_chunks,
+)
+from query_backend import (
+    SUM_COLUMNS,
+    fold_aggregates,
+    get_backend,
+    merge_folds,
+)
+
+DATA_DIR = os.environ.get("DATASET_DIR", "./assets/data")
+DEFAULT_DATASET = os.environ.get("DEFAULT_DATASET", "spotify_songs")
+MEMORY_BUDGET_BYTES = int(
+    float(os.environ.get("DATASET_MEMORY_BUDGET_MB", "2048")) * 2**20
+)
+RELOAD_POLL_SECONDS = float(os.environ.get("DATASET_RELOAD_INTERVAL", "30"))
+# Rows kept in memory per dataset, 0 for all of them
+SAMPLE_ROWS = int(os.environ.get("SAMPLE_ROWS", "0"))
+SAMPLE_SEED = int(os.environ.get("SAMPLE_SEED", "0"))
+# Cleaned columns the point-level charts, the track search and the derived
+# columns read; unless the query backend needs them all, only these are kept
+TRACK_COLUMNS = [
+    "track_id",
+    "track_name",
+    "track_artist",
+    "track_popularity",
+    "track_album_release_date",
+    "playlist_id",
+    "playlist_genre",
+    "playlist_subgenre",
+    "danceability",
+    "energy",
+    "speechiness",
+    "tempo",
+    "duration_ms",
+    "year",
+    "release_month",
+    "season",
+]
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_watcher_pid = None
+_watcher_lock = threading.Lock()
+_derived_builders = {}
+_column_builders = {}
+_snapshot_warmers = []
+# Cache entry kinds whose builders freeze their results
+FROZEN_ENTRY_KINDS = {"derived", "column", "query"}
+
+
+class DatasetSnapshot:
+    """Cleaned tracks and their aggregates at one dataset version.
+
+    Attributes are never reassigned after the snapshot is published and
+    the buffers of its frames are read-only, so any number of threads can
+    share it; ``caches`` only ever gains entries computed from the snapshot
+    itself, each built once through memoize().
+    ``appended`` holds the rows appended since ``path`` was loaded, for
+    backends that query the file rather than ``tracks``. ``folded`` holds
+    the aggregates folded while streaming the file and the appends (see
+    query_backend.fold_aggregates); ``tracks`` may be a sample of the rows.
+    ``content_hash`` identifies the file's content for the persistent cache,
+    None when the snapshot has rows that are not in the file.
+    """
+
+    def __init__(
+        self,
+        name,
+        path,
+        tracks,
+        appended,
+        density_counts,
+        density_map,
+        signature,
+        version,
+        folded,
+        content_hash=None,
+    ):
+        self.name = name
+        self.path = path
+        self.tracks = tracks
+        self.appended = appended
+        self.folded = folded
+        self.year_genre = folded["year_genre"]
+        self.density_counts = density_counts
+        self.density_map = density_map
+        self.signature = signature
+        self.version = version
+        self.content_hash = content_hash
+        self.caches = {}
+        self._key_locks = {}
+        self._locks_lock = threading.Lock()
+        for frame in [tracks, appended, density_counts, *folded.values()]:
+            freeze(frame)
+        self.base_nbytes = estimate_nbytes(
+            [tracks, appended, folded, density_counts]
+        ) + sys.getsizeof(density_map)
+
+    def nbytes(self):
+        """Frames plus caches; figures and other objects are counted shallowly"""
+        return self.base_nbytes + estimate_nbytes(list(self.caches.values()))
+
+    def memoize(self, key, build):
+        """caches[key], calling build() once even when threads race for it.
+
+        Entries persisted by an earlier process for the same content and
+        code are read back instead of being built.
+        """
+        try:
+            return self.caches[key]
+        except KeyError:
+            pass
+        with self._locks_lock:
+            lock = self._key_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self.caches:
+                value = persistent_cache.load(self, key)
+                if value is persistent_cache.MISSING:
+                    value = build()
+                    persistent_cache.save(self, key, value)
+                elif key[0] in FROZEN_ENTRY_KINDS:
+                    freeze(value)
+                self.caches[key] = value
+        return self.caches[key]
+
+
+def freeze_result(value):
+    freeze(value)
+    return value
+
+
+def freeze(value):
+    """Make the numpy buffers behind a frame, series or array read-only.
+
+    In-place writes into snapshot data then raise instead of silently
+    changing what other threads read; derived data must be new objects.
+    """
+    if isinstance(value, pd.DataFrame):
+        # By position, so columns sharing a name are each frozen
+        for position in range(value.shape[1]):
+            freeze(value.iloc[:, position])
+    elif isinstance(value, pd.Series):
+        freeze(value.to_numpy(copy=False))
+    elif isinstance(value, dict):
+        for item in value.values():
+            freeze(item)
+    elif isinstance(value, np.ndarray) and value.dtype != object:
+        while isinstance(value.base, np.ndarray):
+            value = value.base
+        value.flags.writeable = False
+
+
+def estimate_nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class DatasetPool:
+    """Named snapshots kept under a memory budget with LRU eviction.
+
+    The most recently used dataset is never evicted, so a single dataset
+    larger than the budget still gets served.
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self._snapshots = OrderedDict()
+        self._stats = {}
+        self._lock = threading.RLock()
+        self._load_locks = {}
+
+    def _stat(self, name):
+        return self._stats.setdefault(
+            name,
+            {"loads": 0, "hits": 0, "evictions": 0, "last_load_seconds": None},
+        )
+
+    def load_lock(self, name):
+        """Serializes loads, reloads and appends of one dataset"""
+        with self._lock:
+            return self._load_locks.setdefault(name, threading.RLock())
+
+    def peek(self, name):
+        with self._lock:
+            return self._snapshots.get(name)
+
+    def get(self, name):
+        with self._lock:
+            snapshot = self._snapshots.get(name)
+            if snapshot is not None:
+                self._snapshots.move_to_end(name)
+                self._stat(name)["hits"] += 1
+                return snapshot
+
+        with self.load_lock(name):
+            snapshot = self.peek(name)
+            if snapshot is None:
+                start = time.perf_counter()
+                snapshot = _build_snapshot(name)
+                _warm(snapshot)
+                with self._lock:
+                    stat = self._stat(name)
+                    stat["loads"] += 1
+                    elapsed = time.perf_counter() - start
+                    stat["last_load_seconds"] = round(elapsed, 3)
+                self.publish(snapshot)
+        return snapshot
+
+    def publish(self, snapshot):
+        with self._lock:
+            self._snapshots[snapshot.name] = snapshot
+            self._snapshots.move_to_end(snapshot.name)
+            self._evict()
+        logger.info("Serving dataset %s version %s", snapshot.name, snapshot.version)
+
+    def _evict(self):
+        sizes = {name: s.nbytes() for name, s in self._snapshots.items()}
+        while len(self._snapshots) > 1 and sum(sizes.values()) > self.budget_bytes:
+            name, _ = self._snapshots.popitem(last=False)
+            del sizes[name]
+            self._stat(name)["evictions"] += 1
+            logger.info("Evicted dataset %s from the pool", name)
+
+    def loaded(self):
+        with self._lock:
+            return list(self._snapshots.values())
+
+    def stats(self):
+        with self._lock:
+            datasets = {}
+            for name in sorted(set(self._stats) | set(self._snapshots)):
+                stat = dict(self._stat(name))
+                snapshot = self._snapshots.get(name)
+                stat["loaded"] = snapshot is not None
+                stat["version"] = snapshot.version if snapshot else None
+                stat["nbytes"] = snapshot.nbytes() if snapshot else 0
+                datasets[name] = stat
+            return {
+                "budget_bytes": self.budget_bytes,
+                "used_bytes": sum(s["nbytes"] for s in datasets.values()),
+                "datasets": datasets,
+            }
+
+
+pool = DatasetPool(MEMORY_BUDGET_BYTES)
+
+
+def available_datasets():
+    """Dataset name to CSV path for every CSV in DATA_DIR"""
+    return {
+        os.path.splitext(filename)[0]: os.path.join(DATA_DIR, filename)
+        for filename in sorted(os.listdir(DATA_DIR))
+        if filename.endswith(".csv")
+    }
+
+
+def _dataset_path(name):
+    paths = available_datasets()
+    if name not in paths:
+        raise KeyError(f"Unknown dataset {name!r}")
+    return paths[name]
+
+
+def _file_signature(filepath):
+    stat = os.stat(filepath)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def _sample_rows():
+    """Rows to keep in memory, None for all of them"""
+    if SAMPLE_ROWS <= 0 or get_backend().needs_all_rows:
+        return None
+    return SAMPLE_ROWS
+
+
+def _build_snapshot(name):
+    """Stream a dataset's CSV once, folding aggregates chunk by chunk"""
+    filepath = _dataset_path(name)
+    signature = _file_signature(filepath)
+    content_hash = None
+    if persistent_cache.get_store() is not None:
+        content_hash = persistent_cache.file_digest(filepath)
+        persistent_cache.drop_other_contents(name, content_hash)
+    full_folds = get_backend().folds_at_load
+    all_columns = get_backend().needs_all_columns
+    sample_rows = _sample_rows()
+    rng = np.random.default_rng(SAMPLE_SEED)
+
+    folded = None
+    density_counts = None
+    kept = []
+    for chunk in iter_clean_chunks(filepath, STREAM_CHUNK_ROWS):
+        chunk_folds = fold_aggregates(chunk, full=full_folds)
+        chunk_density = count_popularity_density(chunk)
+        if folded is None:
+            folded, density_counts = chunk_folds, chunk_density
+        else:
+            folded = merge_folds(folded, chunk_folds)
+            density_counts = density_counts.add(chunk_density, fill_value=0)
+
+        if not all_columns:
+            chunk = chunk[chunk.columns.intersection(TRACK_COLUMNS, sort=False)]
+        if sample_rows is None:
+            kept.append(chunk)
+        else:
+            # Bottom-k of uniform random keys is a uniform sample of the
+            # rows seen so far, whatever the number of chunks
+            chunk = chunk.assign(_sample_key=rng.random(len(chunk)))
+            kept = [pd.concat(kept + [chunk]).nsmallest(sample_rows, "_sample_key")]
+
+    if folded is None:
+        raise ValueError(f"Dataset {name!r} has no usable rows")
+    tracks = pd.concat(kept)
+    if sample_rows is not None:
+        tracks = tracks.drop(columns="_sample_key").sort_index()
+    density_map = density_map_from_counts(density_counts)
+
+    return DatasetSnapshot(
+        name=name,
+        path=filepath,
+        tracks=calculate_custom_jitter(tracks, density_map),
+        appended=None,
+        density_counts=density_counts,
+        density_map=density_map,
+        signature=signature,
+        version=f"{name}@{signature}",
+        folded=folded,
+        content_hash=content_hash,
+    )
+
+
+def _warm(snapshot):
+    """Fill the caches of a snapshot that is not published yet"""
+    previous = getattr(_local, "snapshot", None)
+    _local.snapshot = snapshot
+    try:
+        for name in _derived_builders:
+            get_derived(name)
+        for warmer in _snapshot_warmers:
+            try:
+                warmer()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Could not warm %s", warmer.__name__)
+    finally:
+        _local.snapshot = previous
+
+
+def load_dataset(name=DEFAULT_DATASET):
+    """Current snapshot of a dataset, loading it into the pool if needed"""
+    return pool.get(name)
+
+
+def get_snapshot():
+    """Snapshot pinned to the running request, else the default dataset's"""
+    pinned = getattr(_local, "snapshot", None)
+    if pinned is not None:
+        return pinned
+    return load_dataset()
+
+
+def reload_dataset(name=DEFAULT_DATASET, force=False):
+    """Rebuild a dataset's snapshot if its CSV file changed.
+
+    Replace the CSV with an atomic rename so a reload never reads a
+    half-written file.
+
+    Returns:
+        True if a new snapshot was published.
+    """
+    with pool.load_lock(name):
+        current = pool.peek(name)
+        if current is None:
+            return False
+        if not force and _file_signature(_dataset_path(name)) == current.signature:
+            return False
+        snapshot = _build_snapshot(name)
+        _warm(snapshot)
+        pool.publish(snapshot)
+    return True
+
+
+def _watch_data_files(interval):
+    while True:
+        time.sleep(interval)
+        for snapshot in pool.loaded():
+            try:
+                reload_dataset(snapshot.name)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception(
+                    "Dataset reload failed, still serving %s", snapshot.version
+                )
+
+
+def start_reload_watcher(interval=RELOAD_POLL_SECONDS):
+    """Start the file watcher once per process (threads do not survive fork)"""
+    global _watcher_pid
+    if interval <= 0 or _watcher_pid == os.getpid():
+        return
+    with _watcher_lock:
+        if _watcher_pid == os.getpid():
+            return
+        _watcher_pid = os.getpid()
+        threading.Thread(
+            target=_watch_data_files,
+            args=(interval,),
+            name="dataset-reload-watcher",
+            daemon=True,
+        ).start()
+
+
+def requested_dataset_name(request):
+    """Dataset picked by the ?dataset= query of the page.
+
+    Page loads carry it in their own URL; Dash's layout and callback
+    requests carry the page URL in their Referer header.
+    """
+    name = request.args.get("dataset")
+    if name is None and request.referrer:
+        query = parse_qs(urlparse(request.referrer).query)
+        name = query.get("dataset", [None])[0]
+    if name is None or name not in available_datasets():
+        return DEFAULT_DATASET
+    return name
+
+
+def register_snapshot_hooks(server):
+    """Pin every request to one snapshot and run the watcher in each worker"""
+    from flask import request  # pylint: disable=import-outside-toplevel
+
+    @server.before_request
+    def pin_request_snapshot():
+        start_reload_watcher()
+        _local.snapshot = load_dataset(requested_dataset_name(request))
+
+    @server.teardown_request
+    def unpin_request_snapshot(exc=None):
+        _local.snapshot = None
+
+
+def get_version():
+    """Identifier of the snapshot in use; part of every cache key"""
+    return get_snapshot().version
+
+
+def get_tracks():
+    """Cleaned tracks, including the custom_y_jitter column"""
+    return get_snapshot().tracks
+
+
+def get_density_map():
+    return get_snapshot().density_map
+
+
+def get_year_genre_aggregates(min_year=None, max_year=None):
+    aggregates = get_snapshot().year_genre
+    years = aggregates.index.get_level_values("year")
+    mask = pd.Series(True, index=aggregates.index)
+    if min_year is not None:
+        mask &= years >= min_year
+    if max_year is not None:
+        mask &= years <= max_year
+    return aggregates[mask.values]
+
+
+def summarize_aggregates(aggregates, level):
+    """Collapse additive aggregates to a per-`level` count plus column means"""
+    totals = aggregates.groupby(level=level).sum()
+    means = totals[SUM_COLUMNS].div(totals["count"], axis=0)
+    means.insert(0, "count", totals["count"])
+    return means
+
+
+def get_yearly_stats(min_year=None):
+    """Songs per year, average popularity and number of genres per year"""
+    aggregates = get_year_genre_aggregates(min_year=min_year)
+    summary = summarize_aggregates(aggregates, "year")
+    genre_diversity = (aggregates["count"] > 0).groupby(level="year").sum()
+
+    return pd.DataFrame(
+        {
+            "year": summary.index,
+            "song_count": summary["count"].values,
+            "avg_popularity": summary["track_popularity"].values,
+            "genre_diversity": genre_diversity.reindex(summary.index).values,
+        }
+    )
+
+
+def get_genre_means(min_year=None, max_year=None):
+    """Per-genre track count and mean popularity/audio features"""
+    aggregates = get_year_genre_aggregates(min_year=min_year, max_year=max_year)
+    return summarize_aggregates(aggregates, "playlist_genre")
+
+
+def get_overall_means(min_year=None, max_year=None):
+    """Catalog-wide mean popularity/audio features over a year range"""
+    aggregates = get_year_genre_aggregates(min_year=min_year, max_year=max_year)
+    totals = aggregates.sum()
+    return totals[SUM_COLUMNS] / totals["count"]
+
+
+def run_query(name, *args):
+    """Run a query backend aggregate on the snapshot in use, once per snapshot"""
+    snapshot = get_snapshot()
+    backend = get_backend()
+    key = ("query", backend.name, name) + args
+    return snapshot.memoize(
+        key, lambda: freeze_result(getattr(backend, name)(snapshot, *args))
+    )
+
+
+def register_derived(name, build, merge=None):
+    """Declare a per-snapshot structure built from the tracks.
+
+    build(tracks) computes it from scratch. merge(previous, new_tracks), if
+    given, lets an append extend the previous snapshot's value instead.
+    """
+    _derived_builders[name] = (build, merge)
+
+
+def get_derived(name):
+    snapshot = get_snapshot()
+    build, _ = _derived_builders[name]
+    return snapshot.memoize(
+        ("derived", name), lambda: freeze_result(build(snapshot.tracks))
+    )
+
+
+def register_column(name, build):
+    """Declare a derived per-track column.
+
+    build(tracks) returns one value per row, computed from that row only,
+    vectorized over the frame. Unlike derived structures, columns are not
+    warmed: each is built on first use. Columns the cleaning already adds
+    to the tracks are served from them.
+    """
+    _column_builders[name] = build
+
+
+def get_column(name):
+    """Derived column of the snapshot's tracks, built once per snapshot"""
+    snapshot = get_snapshot()
+    if name in snapshot.tracks.columns:
+        return snapshot.tracks[name]
+    return snapshot.memoize(
+        ("column", name), lambda: freeze_result(build_column(name, snapshot.tracks))
+    )
+
+
+def build_column(name, tracks):
+    """Derived column of any frame with the source columns, e.g. a batch"""
+    if name in tracks.columns:
+        return tracks[name]
+    values = _column_builders[name](tracks)
+    return pd.Series(values, index=tracks.index, name=name)
+
+
+def get_tracks_with(*names):
+    """New frame of the tracks plus derived columns; the snapshot is left as is"""
+    return get_tracks().assign(**{name: get_column(name) for name in names})
+
+
+def append_tracks(source, name=DEFAULT_DATASET):
+    """Clean a delta CSV (path or file object) and publish it as a new version.
+
+    Only the new rows go through the cleaning, aggregation and jitter steps;
+    the previous aggregates are merged with the batch's partial ones. The
+    rows live in memory only: a reload from the CSV drops them. When the
+    tracks are a sample, the batch is sampled at the same rate. Nothing is
+    warmed: derived structures and columns are merged with the new rows,
+    and figures and other cache entries are built on first use.
+
+    Returns:
+        The number of rows appended after cleaning.
+    """
+    delta = clean_tracks(pd.read_csv(source))
+    if delta.empty:
+        return 0
+
+    with pool.load_lock(name):
+        previous = load_dataset(name)
+        tracks = previous.tracks
+
+        delta_density = count_popularity_density(delta)
+        density_counts = previous.density_counts.add(delta_density, fill_value=0)
+        density_map = dict(previous.density_map)
+        density_map.update(
+            density_map_from_counts(density_counts[delta_density.index])
+        )
+
+        delta = calculate_custom_jitter(delta, density_map)
+        # Labels follow the appended rows too, some of which a sample skips
+        last_labels = [
+            frame.index.max()
+            for frame in [tracks, previous.appended]
+            if frame is not None and len(frame)
+        ]
+        next_label = max(last_labels) + 1 if last_labels else 0
+        delta.index = pd.RangeIndex(next_label, next_label + len(delta))
+        kept = _sample_delta(previous, delta)
+
+        snapshot = DatasetSnapshot(
+            name=name,
+            path=previous.path,
+            # The batch's columns are those the tracks were loaded with
+            tracks=pd.concat([tracks, kept.reindex(columns=tracks.columns)]),
+            appended=pd.concat([previous.appended, delta]),
+            density_counts=density_counts,
+            density_map=density_map,
+            signature=previous.signature,
+            version=f"{previous.version}+{len(delta)}",
+            folded=merge_folds(
+                previous.folded,
+                fold_aggregates(delta, full="yearly_values" in previous.folded),
+            ),
+        )
+        for derived_name, (_, merge) in _derived_builders.items():
+            key = ("derived", derived_name)
+            if merge is not None and key in previous.caches:
+                snapshot.caches[key] = freeze_result(merge(previous.caches[key], kept))
+        for column_name in _column_builders:
+            key = ("column", column_name)
+            if key in previous.caches:
+                snapshot.caches[key] = freeze_result(
+                    pd.concat([previous.caches[key], build_column(column_name, kept)])
+                )
+        pool.publish(snapshot)
+
+    return len(delta)
+
+
+def _sample_delta(previous, delta):
+    """Rows of an appended batch kept in the tracks, at the snapshot's sample rate"""
+    if _sample_rows() is None:
+        return delta
+    total_rows = int(previous.year_genre["count"].sum())
+    if len(previous.tracks) >= total_rows:
+        return delta
+    rng = np.random.default_rng([SAMPLE_SEED, total_rows])
+    return delta[rng.random(len(delta)) < len(previous.tracks) / total_rows]
+
+
+def versioned_cache(func):
+    """Memoize func per argument tuple on the snapshot in use.
+
+    Entries are keyed by the snapshot version and disappear with their
+    snapshot. Zero-argument builders are also computed ahead of time on
+    every snapshot loaded from a file, before it is swapped in; after an
+    append they are built on first use.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        snapshot = get_snapshot()
+        key = (func.__module__, func.__qualname__, snapshot.version) + args
+        return snapshot.memoize(key, lambda: func(*args))
+
+    if func.__code__.co_argcount == 0:
+        _snapshot_warmers.append(wrapper)
+    return wrapper
@@ -0,0 +1,64 @@
+"""
+Derived per-track features, declared once.
+
+Each feature is a vectorized function of source columns, usable on the
+tracks or on any frame with those columns (aggregates indexed by year, an
+appended batch). Registered as a snapshot column, a feature is computed on
+first use through dataset.get_column and kept on the snapshot; season and
+duration_min are added by the cleaning already, since the streamed
+aggregates need them.
+"""
+
+import numpy as np
+import pandas as pd
+
+from dataset import register_column
+from preprocess import duration_min_of, season_of_month
+
+PERIOD_BINS = [1999, 2004, 2008, 2012, 2016, 2021]
+PERIOD_LABELS = ["2000-2004", "2005-2008", "2009-2012", "2013-2016", "2017-2020"]
+# Default speechiness thresholds between the low, medium and high bands
+SPEECHINESS_LOW = 0.2
+SPEECHINESS_HIGH = 0.5
+SPEECHINESS_BANDS = ["Low", "Medium", "High"]
+# Popularity is an integer score: tiers are 0-40, 41-60 and 61-100
+POPULARITY_TIER_BINS = [-1, 40, 60, 100]
+POPULARITY_TIERS = ["Low", "Medium", "High"]
+
+
+def decade_of(years):
+    return np.asarray(years) // 10 * 10
+
+
+def period_of(years):
+    return pd.cut(years, bins=PERIOD_BINS, labels=PERIOD_LABELS)
+
+
+def speechiness_band_of(speechiness, low=SPEECHINESS_LOW, high=SPEECHINESS_HIGH):
+    return pd.cut(
+        speechiness,
+        bins=[-np.inf, low, high, np.inf],
+        labels=SPEECHINESS_BANDS,
+        right=False,
+    )
+
+
+def popularity_tier_of(popularity):
+    return pd.cut(popularity, bins=POPULARITY_TIER_BINS, labels=POPULARITY_TIERS)
+
+
+def tier_min_score(tier):
+    """Lowest popularity score in a tier"""
+    return POPULARITY_TIER_BINS[POPULARITY_TIERS.index(tier)] + 1
+
+
+register_column("decade", lambda tracks: decade_of(tracks["year"]))
+register_column("period", lambda tracks: period_of(tracks["year"]))
+register_column("season", lambda tracks: season_of_month(tracks["release_month"]))
+register_column("duration_min", lambda tracks: duration_min_of(tracks["duration_ms"]))
+register_column(
+    "speechiness_band", lambda tracks: speechiness_band_of(tracks["speechiness"])
+)
+register_column(
+    "popularity_tier", lambda tracks: popularity_tier_of(tracks["track_popularity"])
+)
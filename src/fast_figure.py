@@ -0,0 +1,174 @@
+"""
+Figure dicts built without plotly's property validation.
+
+go.Figure, make_subplots, add_trace and update_layout check and copy every
+property they are given, which is a large share of the time of callbacks
+that rebuild a figure on each interaction. The builders here emit the same
+dicts directly for the trace types the dashboard uses; attribute names
+are plotly's, nested attributes are given as dicts (marker=dict(color=...))
+rather than with magic underscores.
+
+With FAST_FIGURE_CHECK=1 every figure is passed through go.Figure and must
+come out unchanged, so an invalid or misspelled property raises instead of
+being silently ignored by plotly.js. Run the static export or the load test
+with it to check every hot figure.
+"""
+
+import json
+import math
+import os
+
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.io.json import to_json_plotly
+
+from figure_payload import decode_typed_arrays
+
+FAST_FIGURE_CHECK = os.environ.get("FAST_FIGURE_CHECK", "0") == "1"
+
+TRACE_TYPES = {"bar", "scatter", "histogram", "heatmap", "scatterpolar"}
+SUBPLOT_TITLE_FONT_SIZE = 16
+
+_templates = {}
+
+
+def template(name=None):
+    """Layout template dict as go.Figure adds it, plotly's default if no name.
+
+    The dict is shared between figures: it must not be modified, only
+    replaced, as compact_figure does.
+    """
+    name = name or pio.templates.default
+    if name not in _templates:
+        _templates[name] = pio.templates[name].to_plotly_json()
+    return dict(_templates[name])
+
+
+def trace(trace_type, **attributes):
+    if trace_type not in TRACE_TYPES:
+        raise ValueError(f"No fast builder for {trace_type!r} traces")
+    return {"type": trace_type, **attributes}
+
+
+def title(text):
+    return {"text": text}
+
+
+def layout(template_name=None, **attributes):
+    """Layout dict; title strings are wrapped as plotly does"""
+    for value in attributes.values():
+        if isinstance(value, dict) and isinstance(value.get("title"), str):
+            value["title"] = title(value["title"])
+    if isinstance(attributes.get("title"), str):
+        attributes["title"] = title(attributes["title"])
+    return {**attributes, "template": template(template_name)}
+
+
+def subplot_suffix(row, col, cols):
+    """Axis number suffix of a 1-based subplot cell, "" for the first"""
+    number = (row - 1) * cols + col
+    return "" if number == 1 else str(number)
+
+
+def in_subplot(trace_dict, row, col, cols):
+    suffix = subplot_suffix(row, col, cols)
+    trace_dict["xaxis"] = f"x{suffix}"
+    trace_dict["yaxis"] = f"y{suffix}"
+    return trace_dict
+
+
+def subplot_axes(figure_layout, row, col, cols):
+    """(xaxis, yaxis) dicts of a subplot cell in a subplot_grid layout"""
+    suffix = subplot_suffix(row, col, cols)
+    return figure_layout[f"xaxis{suffix}"], figure_layout[f"yaxis{suffix}"]
+
+
+def subplot_grid(rows, cols, titles=(), horizontal_spacing=None, vertical_spacing=None):
+    """Axes and title annotations of a grid of xy subplots, as make_subplots"""
+    if horizontal_spacing is None:
+        horizontal_spacing = 0.2 / cols
+    if vertical_spacing is None:
+        vertical_spacing = 0.3 / rows
+    width = (1 - horizontal_spacing * (cols - 1)) / cols
+    height = (1 - vertical_spacing * (rows - 1)) / rows
+
+    grid = {}
+    annotations = []
+    for row in range(1, rows + 1):
+        for col in range(1, cols + 1):
+            suffix = subplot_suffix(row, col, cols)
+            x0 = (col - 1) * (width + horizontal_spacing)
+            y0 = (rows - row) * (height + vertical_spacing)
+            grid[f"xaxis{suffix}"] = {
+                "anchor": f"y{suffix}",
+                "domain": [x0, x0 + width],
+            }
+            grid[f"yaxis{suffix}"] = {
+                "anchor": f"x{suffix}",
+                "domain": [y0, y0 + height],
+            }
+            index = (row - 1) * cols + col - 1
+            if index < len(titles) and titles[index]:
+                annotations.append(
+                    {
+                        "font": {"size": SUBPLOT_TITLE_FONT_SIZE},
+                        "showarrow": False,
+                        "text": titles[index],
+                        "x": x0 + width / 2,
+                        "xanchor": "center",
+                        "xref": "paper",
+                        "y": y0 + height,
+                        "yanchor": "bottom",
+                        "yref": "paper",
+                    }
+                )
+    if annotations:
+        grid["annotations"] = annotations
+    return grid
+
+
+def figure(data, figure_layout):
+    result = {"data": data, "layout": figure_layout}
+    if FAST_FIGURE_CHECK:
+        check_figure(result)
+    return result
+
+
+def first_difference(built, validated, path="figure"):
+    """Path of the first value that differs between two JSON trees, or None"""
+    if isinstance(built, dict) and isinstance(validated, dict):
+        for key in sorted(set(built) | set(validated)):
+            if key not in built or key not in validated:
+                return f"{path}.{key}"
+            difference = first_difference(built[key], validated[key], f"{path}.{key}")
+            if difference:
+                return difference
+        return None
+    if isinstance(built, list) and isinstance(validated, list):
+        if len(built) != len(validated):
+            return path
+        for i, (left, right) in enumerate(zip(built, validated)):
+            difference = first_difference(left, right, f"{path}[{i}]")
+            if difference:
+                return difference
+        return None
+    if (
+        (isinstance(built, float) or isinstance(validated, float))
+        and isinstance(built, (int, float))
+        and isinstance(validated, (int, float))
+    ):
+        return None if math.isclose(built, validated, rel_tol=1e-9) else path
+    return None if built == validated else path
+
+
+def check_figure(built):
+    """Raise ValueError unless plotly's validation leaves the figure unchanged"""
+    validated = go.Figure(built).to_dict()
+    # Validation turns numeric arrays into plotly's typed binary form
+    for attributes in validated["data"] + [validated["layout"]]:
+        decode_typed_arrays(attributes)
+    difference = first_difference(
+        json.loads(to_json_plotly(built)), json.loads(to_json_plotly(validated))
+    )
+    if difference:
+        raise ValueError(f"Fast figure differs from plotly's at {difference}")
@@ -0,0 +1,285 @@
+"""
+Compaction of figures before they are sent to the browser.
+
+Figure JSON dominates page weight, so every figure leaving the server goes
+through compact_figure:
+
+- customdata columns that are constant within a trace, or that repeat one
+  of its x/y/marker.size arrays, are dropped and their hovertemplate
+  references point at the literal value or at that array instead;
+- float arrays are rounded to FIGURE_SIGNIFICANT_DIGITS significant digits
+  (relative to the largest value of the array) and integer-valued ones are
+  sent as the smallest integer type that holds them;
+- style arrays holding a single repeated value become that value;
+- timestamps at midnight in customdata are sent as plain dates;
+- the template keeps only the trace defaults of trace types in the figure.
+
+With plotly >= 6, numeric arrays are sent as typed binary arrays, so
+rounded floats also drop to float32 when the digits allow it.
+"""
+
+import base64
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+import plotly
+from plotly.io.json import to_json_plotly
+
+FIGURE_SIGNIFICANT_DIGITS = int(os.environ.get("FIGURE_SIGNIFICANT_DIGITS", "4"))
+# Measuring serializes every figure twice; off saves that CPU
+FIGURE_PAYLOAD_REPORT = os.environ.get("FIGURE_PAYLOAD_REPORT", "1") == "1"
+TYPED_ARRAYS = int(plotly.__version__.split(".")[0]) >= 6
+
+# Data arrays whose values must survive as sent
+EXACT_KEYS = {"ids", "selectedpoints", "customdata", "text", "hovertext"}
+# Per-point style arrays that plotly.js also accepts as a single value
+STYLE_KEYS = {"color", "size", "opacity", "width", "symbol"}
+FLOAT32_MAX_DIGITS = 6
+INT_TYPES = [np.int8, np.uint8, np.int16, np.uint16, np.int32]
+
+CUSTOMDATA_REFERENCE = re.compile(r"%\{customdata\[(\d+)\]([^}]*)\}")
+# Arrays a customdata column may duplicate, by hovertemplate variable name
+REFERENCE_ARRAYS = [("x", ("x",)), ("y", ("y",)), ("marker.size", ("marker", "size"))]
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+payload_stats = {"figures": 0, "bytes_before": 0, "bytes_after": 0}
+
+
+def decode_typed_arrays(attributes):
+    """Turn plotly >= 6 {"dtype", "bdata"} arrays back into numpy arrays"""
+    for key, value in attributes.items():
+        if not isinstance(value, dict):
+            continue
+        if "bdata" in value and "dtype" in value:
+            array = np.frombuffer(base64.b64decode(value["bdata"]), value["dtype"])
+            if "shape" in value:
+                shape = [int(n) for n in str(value["shape"]).split(",")]
+                array = array.reshape(shape)
+            attributes[key] = array
+        else:
+            decode_typed_arrays(value)
+
+
+def encode_typed_array(values):
+    """plotly >= 6 binary form of a numeric array; plotly.js decodes it"""
+    encoded = {
+        "dtype": values.dtype.str[1:],
+        "bdata": base64.b64encode(np.ascontiguousarray(values)).decode("ascii"),
+    }
+    if values.ndim > 1:
+        encoded["shape"] = ",".join(str(n) for n in values.shape)
+    return encoded
+
+
+def nested_value(attributes, path):
+    for key in path:
+        if not isinstance(attributes, dict):
+            return None
+        attributes = attributes.get(key)
+    return attributes
+
+
+def same_values(column, values):
+    if not isinstance(values, np.ndarray) or values.shape != column.shape:
+        return False
+    try:
+        return np.array_equal(column.astype(float), values.astype(float))
+    except (TypeError, ValueError):
+        return False
+
+
+def dedupe_customdata(trace):
+    """Drop customdata columns the hovertemplate can get elsewhere"""
+    customdata = trace.get("customdata")
+    template = trace.get("hovertemplate")
+    if (
+        not isinstance(customdata, np.ndarray)
+        or customdata.ndim != 2
+        or len(customdata) == 0
+        or not isinstance(template, str)
+        # Whole-row or other references are left alone
+        or "customdata" in CUSTOMDATA_REFERENCE.sub("", template)
+        or "customdata" in str(trace.get("texttemplate", ""))
+    ):
+        return
+
+    replacements = {}
+    for column in range(customdata.shape[1]):
+        values = customdata[:, column]
+        first = values[0]
+        if isinstance(first, str) and "%{" not in first and (values == first).all():
+            replacements[column] = first
+            continue
+        for name, path in REFERENCE_ARRAYS:
+            if same_values(values, nested_value(trace, path)):
+                replacements[column] = f"%{{{name}}}"
+                break
+
+    references = [
+        (int(match.group(1)), match.group(2))
+        for match in CUSTOMDATA_REFERENCE.finditer(template)
+    ]
+    for column, suffix in references:
+        # A d3 format suffix needs a variable, not a literal
+        if suffix and not replacements.get(column, "%{").startswith("%{"):
+            del replacements[column]
+    kept = sorted({column for column, _ in references} - set(replacements))
+    new_index = {column: i for i, column in enumerate(kept)}
+
+    def rewrite(match):
+        column, suffix = int(match.group(1)), match.group(2)
+        if column in new_index:
+            return f"%{{customdata[{new_index[column]}]{suffix}}}"
+        replacement = replacements[column]
+        if replacement.startswith("%{"):
+            return replacement[:-1] + suffix + "}"
+        return replacement
+
+    trace["hovertemplate"] = CUSTOMDATA_REFERENCE.sub(rewrite, template)
+    if kept:
+        trace["customdata"] = customdata[:, kept]
+    else:
+        del trace["customdata"]
+
+
+def round_significant(values, digits=FIGURE_SIGNIFICANT_DIGITS):
+    """Round to digits significant digits of the array's largest magnitude"""
+    finite = np.abs(values[np.isfinite(values)])
+    if finite.size == 0 or finite.max() == 0:
+        return values
+    decimals = digits - 1 - int(np.floor(np.log10(finite.max())))
+    return np.round(values, decimals)
+
+
+def compact_array(values, digits=FIGURE_SIGNIFICANT_DIGITS):
+    """Smallest faithful numeric encoding of a data array, or None to keep it"""
+    if isinstance(values, (list, tuple)):
+        if not values or not all(
+            isinstance(v, (int, float)) and not isinstance(v, bool) for v in values
+        ):
+            return None
+        values = np.asarray(values, dtype=float)
+    if not isinstance(values, np.ndarray) or values.dtype.kind not in "iuf":
+        return None
+
+    if values.dtype.kind == "f":
+        if not np.isfinite(values).all():
+            return round_significant(values, digits)
+        if not np.array_equal(values, np.round(values)):
+            values = round_significant(values, digits)
+            if TYPED_ARRAYS and digits <= FLOAT32_MAX_DIGITS:
+                values = values.astype(np.float32)
+            return values
+
+    if values.size == 0:
+        return values
+    low, high = values.min(), values.max()
+    for int_type in INT_TYPES:
+        info = np.iinfo(int_type)
+        if info.min <= low and high <= info.max:
+            return values.astype(int_type)
+    return values
+
+
+def collapse_constant(values):
+    """The single value of a style array that repeats one value, else None"""
+    if isinstance(values, np.ndarray) and values.dtype.kind in "iufUO":
+        values = values.tolist()
+    if not isinstance(values, list) or not values:
+        return None
+    first = values[0]
+    if isinstance(first, (list, dict)) or any(v != first for v in values):
+        return None
+    return first
+
+
+def compact_customdata(values):
+    """Send midnight timestamps in customdata columns as plain dates"""
+    if not isinstance(values, np.ndarray) or values.dtype != object or values.ndim != 2:
+        return values
+    values = values.copy()
+    for column in range(values.shape[1]):
+        if not isinstance(values[0, column], pd.Timestamp):
+            continue
+        dates = pd.to_datetime(values[:, column])
+        if (dates == dates.normalize()).all():
+            values[:, column] = dates.strftime("%Y-%m-%d").to_numpy()
+    return values
+
+
+def compact_attributes(attributes, digits):
+    for key, value in list(attributes.items()):
+        if isinstance(value, dict):
+            compact_attributes(value, digits)
+            continue
+        if key == "customdata":
+            attributes[key] = compact_customdata(value)
+            continue
+        if key in EXACT_KEYS:
+            continue
+        if key in STYLE_KEYS:
+            constant = collapse_constant(value)
+            if constant is not None:
+                attributes[key] = constant
+                continue
+        compacted = compact_array(value, digits)
+        if compacted is None:
+            continue
+        if TYPED_ARRAYS and compacted.dtype.kind in "iuf":
+            compacted = encode_typed_array(compacted)
+        attributes[key] = compacted
+
+
+def strip_template(layout, trace_types):
+    template = layout.get("template")
+    if not isinstance(template, dict) or "data" not in template:
+        return
+    template["data"] = {
+        trace_type: defaults
+        for trace_type, defaults in template["data"].items()
+        if trace_type in trace_types
+    }
+
+
+def figure_name(figure):
+    title = figure.get("layout", {}).get("title", {})
+    if isinstance(title, dict):
+        return title.get("text") or "untitled"
+    return title or "untitled"
+
+
+def compact_figure(fig, digits=FIGURE_SIGNIFICANT_DIGITS):
+    """Compacted figure dict of a go.Figure (or figure dict), ready for dcc.Graph"""
+    figure = fig.to_dict() if hasattr(fig, "to_dict") else dict(fig)
+    before = len(to_json_plotly(figure)) if FIGURE_PAYLOAD_REPORT else 0
+
+    data = figure.get("data", [])
+    for trace in data:
+        decode_typed_arrays(trace)
+        dedupe_customdata(trace)
+        compact_attributes(trace, digits)
+    strip_template(
+        figure.setdefault("layout", {}),
+        {trace.get("type", "scatter") for trace in data},
+    )
+
+    if FIGURE_PAYLOAD_REPORT:
+        after = len(to_json_plotly(figure))
+        with _stats_lock:
+            payload_stats["figures"] += 1
+            payload_stats["bytes_before"] += before
+            payload_stats["bytes_after"] += after
+        logger.info(
+            "Figure %r compacted from %d to %d bytes (%d saved)",
+            figure_name(figure),
+            before,
+            after,
+            before - after,
+        )
+    return figure
@@ -5,29 +5,29 @@ import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output
 
-
-def load_data():
-    """Load and preprocess data for genre trends analysis"""
-    df = pd.read_csv("./assets/data/spotify_songs.csv")
-    df["track_album_release_date"] = pd.to_datetime(
-        df["track_album_release_date"], errors="coerce"
-    )
-    df["year"] = df["track_album_release_date"].dt.year
-
-    df = df.dropna(
-        subset=["year", "track_popularity",
-                "playlist_genre", "playlist_subgenre"]
-    )
-    df = df[df["year"] >= 2000]
-
-    return df
-
-
-def generate_genre_evolution_chart(df):
+# Registers the derived columns read through build_column
+import derived_columns  # noqa: F401  pylint: disable=unused-import
+from dataset import (
+    build_column,
+    get_genre_means,
+    get_overall_means,
+    get_year_genre_aggregates,
+    run_query,
+    versioned_cache,
+)
+from figure_payload import compact_figure
+
+MIN_YEAR = 2000
+# Years at each end of a range compared by the growth analysis
+GROWTH_WINDOW_YEARS = 3
+
+
+def generate_genre_evolution_chart(year_genre_aggregates):
     """Generate line chart showing genre popularity evolution over time"""
     genre_evolution = (
-        df.groupby(["year", "playlist_genre"])[
-            "track_popularity"].mean().reset_index()
+        (year_genre_aggregates["track_popularity"] / year_genre_aggregates["count"])
+        .rename("track_popularity")
+        .reset_index()
     )
 
     fig = go.Figure()
@@ -78,18 +78,17 @@ def generate_genre_evolution_chart(df):
     return fig
 
 
-def generate_subgenre_heatmap(df):
+def generate_subgenre_heatmap(year_subgenre_aggregates):
     """Generate heatmap showing subgenre performance across time periods"""
-    df["period"] = pd.cut(
-        df["year"],
-        bins=[1999, 2004, 2008, 2012, 2016, 2021],
-        labels=["2000-2004", "2005-2008",
-                "2009-2012", "2013-2016", "2017-2020"],
-    )
+    aggregates = year_subgenre_aggregates.reset_index()
+    aggregates["period"] = build_column("period", aggregates)
 
+    period_totals = aggregates.groupby(
+        ["playlist_subgenre", "period"], observed=False
+    )[["count", "track_popularity"]].sum()
     subgenre_heatmap_data = (
-        df.groupby(["playlist_subgenre", "period"])["track_popularity"]
-        .mean()
+        (period_totals["track_popularity"] / period_totals["count"])
+        .rename("track_popularity")
         .reset_index()
     )
 
@@ -97,7 +96,8 @@ def generate_subgenre_heatmap(df):
         index="playlist_subgenre", columns="period", values="track_popularity"
     )
 
-    heatmap_pivot = heatmap_pivot.fillna(0)
+    # Periods outside the year range have no tracks at all
+    heatmap_pivot = heatmap_pivot.dropna(axis=1, how="all").fillna(0)
     heatmap_pivot["avg"] = heatmap_pivot.mean(axis=1)
     heatmap_pivot = heatmap_pivot.sort_values("avg", ascending=False).drop(
         "avg", axis=1
@@ -130,7 +130,7 @@ def generate_subgenre_heatmap(df):
     return fig
 
 
-def generate_audio_features_radar(df, selected_genre="pop"):
+def generate_audio_features_radar(genre_means, overall_means, selected_genre="pop"):
     """Generate radar chart showing audio features for selected genre"""
     features = [
         "danceability",
@@ -141,22 +141,30 @@ def generate_audio_features_radar(df, selected_genre="pop"):
         "speechiness",
     ]
 
-    genre_features = df[df["playlist_genre"]
-                        == selected_genre][features].mean()
-
-    overall_features = df[features].mean()
+    overall_features = overall_means[features]
 
     fig = go.Figure()
 
-    fig.add_trace(
-        go.Scatterpolar(
-            r=genre_features.values,
-            theta=features,
-            fill="toself",
-            name=f"{selected_genre.upper()} Average",
-            line_color="#ff7f0e",
+    # No genre picked, or none of its tracks in the years: the overall
+    # profile is shown alone
+    if selected_genre is None:
+        title = "Audio Features Profile: Overall Average"
+    elif selected_genre not in genre_means.index:
+        title = (
+            f"Audio Features Profile: no {selected_genre.upper()} tracks "
+            "in the selected years, Overall Average"
         )
-    )
+    else:
+        fig.add_trace(
+            go.Scatterpolar(
+                r=genre_means.loc[selected_genre, features].values,
+                theta=features,
+                fill="toself",
+                name=f"{selected_genre.upper()} Average",
+                line_color="#ff7f0e",
+            )
+        )
+        title = f"Audio Features Profile: {selected_genre.upper()} vs Overall Average"
 
     fig.add_trace(
         go.Scatterpolar(
@@ -172,40 +180,28 @@ def generate_audio_features_radar(df, selected_genre="pop"):
     fig.update_layout(
         polar=dict(radialaxis=dict(visible=True, range=[0, 1])),
         showlegend=True,
-        title=f"Audio Features Profile: {selected_genre.upper()} vs Overall Average",
+        title=title,
         height=500,
     )
 
     return fig
 
 
-def generate_growth_analysis(df):
+def generate_growth_analysis(
+    early_period, late_period, early_label="2000-2002", late_label="2018-2020"
+):
     """Analyze genre growth rates over time"""
-    early_period = (
-        df[df["year"].between(2000, 2002)]
-        .groupby("playlist_genre")["track_popularity"]
-        .mean()
-    )
-    late_period = (
-        df[df["year"].between(2018, 2020)]
-        .groupby("playlist_genre")["track_popularity"]
-        .mean()
-    )
-
+    early_column = f"Early Period ({early_label})"
+    late_column = f"Late Period ({late_label})"
     growth_df = pd.DataFrame(
         {
-            "Early Period (2000-2002)": early_period,
-            "Late Period (2018-2020)": late_period,
+            early_column: early_period,
+            late_column: late_period,
         }
     ).fillna(0)
 
-    growth_df["Growth"] = (
-        growth_df["Late Period (2018-2020)"] -
-        growth_df["Early Period (2000-2002)"]
-    )
-    growth_df["Growth %"] = (
-        growth_df["Growth"] / growth_df["Early Period (2000-2002)"]
-    ) * 100
+    growth_df["Growth"] = growth_df[late_column] - growth_df[early_column]
+    growth_df["Growth %"] = (growth_df["Growth"] / growth_df[early_column]) * 100
     growth_df = growth_df.sort_values("Growth", ascending=True)
 
     fig = go.Figure()
@@ -225,7 +221,7 @@ def generate_growth_analysis(df):
     )
 
     fig.update_layout(
-        title="Genre Popularity Growth: 2018-2020 vs 2000-2002",
+        title=f"Genre Popularity Growth: {late_label} vs {early_label}",
         xaxis_title="Popularity Change (points)",
         yaxis_title="Genre",
         template="plotly_white",
@@ -235,9 +231,74 @@ def generate_growth_analysis(df):
     return fig
 
 
+def year_label(first, last):
+    return str(first) if first == last else f"{first}-{last}"
+
+
+def year_range():
+    """First and last year the tab covers when nothing is selected"""
+    years = get_year_genre_aggregates(MIN_YEAR).index.get_level_values("year")
+    return MIN_YEAR, int(years.max())
+
+
+def selected_years(selected_data):
+    """(first, last) year of the points selected on the evolution chart, or None"""
+    points = (selected_data or {}).get("points", [])
+    years = [point["x"] for point in points if "x" in point]
+    if not years:
+        return None
+    return int(min(years)), int(max(years))
+
+
+def growth_windows(first, last):
+    """(first, last) years of the early and late ends of a year range"""
+    window = max(1, min(GROWTH_WINDOW_YEARS, (last - first + 1) // 2))
+    return (first, first + window - 1), (last - window + 1, last)
+
+
+def growth_periods_text(first, last):
+    early, late = growth_windows(first, last)
+    return (
+        f"Compare early period ({year_label(*early)}) vs recent period "
+        f"({year_label(*late)}) to identify growth trends."
+    )
+
+
+@versioned_cache
+def growth_analysis_figure(first, last):
+    """Growth between the first and last GROWTH_WINDOW_YEARS of a year range"""
+    early, late = growth_windows(first, last)
+    return compact_figure(
+        generate_growth_analysis(
+            get_genre_means(*early)["track_popularity"],
+            get_genre_means(*late)["track_popularity"],
+            year_label(*early),
+            year_label(*late),
+        )
+    )
+
+
+@versioned_cache
+def subgenre_heatmap_figure(first, last):
+    aggregates = run_query("year_subgenre_aggregates")
+    years = aggregates.index.get_level_values("year")
+    return compact_figure(
+        generate_subgenre_heatmap(aggregates[(years >= first) & (years <= last)])
+    )
+
+
+@versioned_cache
+def audio_features_radar_figure(genre, first, last):
+    return compact_figure(
+        generate_audio_features_radar(
+            get_genre_means(first, last), get_overall_means(first, last), genre
+        )
+    )
+
+
+@versioned_cache
 def get_genre_trends_content():
     """Main function to return the content for Genre Trends tab"""
-    df = load_data()
 
     return html.Div(
         [
@@ -272,11 +333,16 @@ def get_genre_trends_content():
                 [
                     html.H4("Genre Popularity Evolution Over Time"),
                     html.P(
-                        "Track how the average popularity of major music genres has evolved over the past two decades."
+                        "Track how the average popularity of major music genres has evolved over the past two decades. "
+                        "Select a range of years to focus the growth analysis, the subgenre heatmap and the audio features profile on it."
                     ),
                     dcc.Graph(
                         id="genre-evolution-chart",
-                        figure=generate_genre_evolution_chart(df),
+                        figure=compact_figure(
+                            generate_genre_evolution_chart(
+                                get_year_genre_aggregates(MIN_YEAR)
+                            )
+                        ),
                         config={"responsive": True},
                     ),
                 ],
@@ -286,11 +352,11 @@ def get_genre_trends_content():
                 [
                     html.H4("Genre Growth Analysis"),
                     html.P(
-                        "Compare early period (2000-2002) vs recent period (2018-2020) to identify growth trends."
+                        growth_periods_text(*year_range()), id="growth-analysis-periods"
                     ),
                     dcc.Graph(
                         id="growth-analysis-chart",
-                        figure=generate_growth_analysis(df),
+                        figure=growth_analysis_figure(*year_range()),
                         config={"responsive": True},
                     ),
                 ],
@@ -304,7 +370,7 @@ def get_genre_trends_content():
                     ),
                     dcc.Graph(
                         id="subgenre-heatmap",
-                        figure=generate_subgenre_heatmap(df),
+                        figure=subgenre_heatmap_figure(*year_range()),
                         config={"responsive": True},
                     ),
                 ],
@@ -323,7 +389,7 @@ def get_genre_trends_content():
                                 id="genre-selector",
                                 options=[
                                     {"label": genre.upper(), "value": genre}
-                                    for genre in sorted(df["playlist_genre"].unique())
+                                    for genre in sorted(get_genre_means(MIN_YEAR).index)
                                 ],
                                 value="pop",
                                 style={"width": "200px", "margin": "10px 0"},
@@ -342,9 +408,29 @@ def register_genre_trends_callbacks(app):
     """Register callbacks for interactive components"""
 
     @app.callback(
-        Output("audio-features-radar",
-               "figure"), [Input("genre-selector", "value")]
+        [
+            Output("growth-analysis-chart", "figure"),
+            Output("growth-analysis-periods", "children"),
+            Output("subgenre-heatmap", "figure"),
+        ],
+        [Input("genre-evolution-chart", "selectedData")],
+        prevent_initial_call=True,
+    )
+    def filter_by_selected_years(selected_data):
+        years = selected_years(selected_data) or year_range()
+        return (
+            growth_analysis_figure(*years),
+            growth_periods_text(*years),
+            subgenre_heatmap_figure(*years),
+        )
+
+    @app.callback(
+        Output("audio-features-radar", "figure"),
+        [
+            Input("genre-selector", "value"),
+            Input("genre-evolution-chart", "selectedData"),
+        ],
     )
-    def update_radar_chart(selected_genre):
-        df = load_data()
-        return generate_audio_features_radar(df, selected_genre)
+    def update_radar_chart(selected_genre, selected_data):
+        years = selected_years(selected_data) or year_range()
+        return audio_features_radar_figure(selected_genre, *years)
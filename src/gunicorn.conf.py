@@ -0,0 +1,45 @@
+"""
+Gunicorn settings: a few threaded workers sharing the preloaded datasets.
+
+Dataset snapshots are immutable and their frames read-only, so the threads
+of a worker share one copy of the data and of the snapshot caches.
+
+The Procfile and the image pass it with --config. Command line options
+win over it; the worker counts can also be set through GUNICORN_WORKERS
+and GUNICORN_THREADS.
+"""
+
+import os
+
+worker_class = "gthread"
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+# Load the data once in the master; forked workers share its pages
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+# Background callback jobs are forked from the worker and inherit its open
+# client sockets, so a kept-alive connection the worker let go could hang
+# until the job exits; close every connection after its response instead
+keepalive = 0
+# The app's own INFO lines (dataset swaps, memory reports) go to the
+# error log with gunicorn's; the access log stays off as by default, and
+# so do the per-figure compaction lines, whose totals are /admin/figures.
+# Merged over gunicorn's defaults, which provide the handlers used here
+logconfig_dict = {
+    "root": {"level": "INFO", "handlers": ["error_console"]},
+    "loggers": {
+        "gunicorn.error": {
+            "level": "INFO",
+            "handlers": ["error_console"],
+            "propagate": False,
+            "qualname": "gunicorn.error",
+        },
+        "gunicorn.access": {
+            "level": "WARNING",
+            "handlers": ["console"],
+            "propagate": False,
+            "qualname": "gunicorn.access",
+        },
+        "figure_payload": {"level": "WARNING"},
+    },
+}
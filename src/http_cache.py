@@ -0,0 +1,241 @@
+"""
+HTTP caching of Dash layout and callback responses.
+
+For a given dataset version, the layout and every callback response only
+depend on the request itself, so the ETag is a hash of the version, the
+path and the request body. A request whose If-None-Match matches gets a
+304 before any callback runs, and a request seen before is answered from
+a per-worker LRU of response bodies, kept already compressed with brotli
+or gzip so compression is paid once per distinct response. Identical
+requests that arrive while the first is still running are coalesced by
+single_flight: they wait for it and are answered from that cache.
+
+Background callbacks are left alone: their responses carry job ids and
+progress, which are not a function of the request.
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from dataset import get_version
+from single_flight import flights
+
+HTTP_CACHE_MAX_BYTES = int(float(os.environ.get("HTTP_CACHE_MAX_MB", "256")) * 2**20)
+# Smaller bodies are cheaper to send as is than to compress
+HTTP_CACHE_MIN_COMPRESS_BYTES = int(
+    os.environ.get("HTTP_CACHE_MIN_COMPRESS_BYTES", "1024")
+)
+# 0 makes clients revalidate every time, which is cheap with ETags
+HTTP_CACHE_MAX_AGE = int(os.environ.get("HTTP_CACHE_MAX_AGE", "0"))
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class ResponseCache:
+    """Compressed bodies keyed by (ETag, encoding), bounded by total size"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag, encoding):
+        with self._lock:
+            entry = self._entries.get((etag, encoding))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((etag, encoding))
+            self.hits += 1
+            return entry
+
+    def put(self, etag, encoding, mimetype, body):
+        with self._lock:
+            key = (etag, encoding)
+            if key in self._entries or len(body) > self.max_bytes:
+                return
+            self._entries[key] = (mimetype, body)
+            self.nbytes += len(body)
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+response_cache = ResponseCache(HTTP_CACHE_MAX_BYTES)
+
+
+def compute_etag(path, body):
+    digest = hashlib.sha1(get_version().encode())
+    digest.update(path.encode())
+    digest.update(b"\0")
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def pick_encoding(accept_encoding):
+    """Best encoding we can produce among those the client accepts"""
+    if brotli is not None and "br" in accept_encoding:
+        return "br"
+    if "gzip" in accept_encoding:
+        return "gzip"
+    return "identity"
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def decompress(body, encoding):
+    if encoding == "br":
+        return brotli.decompress(body)
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    return body
+
+
+def lookup_response(etag, encoding):
+    """(entry, encoding) of a cached body, from this worker or a published one.
+
+    A body only cached in another encoding is returned decompressed, as
+    identity, and gets recompressed for this client on the way out.
+    """
+    encodings = [encoding] if encoding == "identity" else [encoding, "identity"]
+    for candidate in encodings:
+        entry = response_cache.get(etag, candidate)
+        if entry is None:
+            entry = flights.lookup((etag, candidate))
+            if entry is not None:
+                response_cache.put(etag, candidate, *entry)
+        if entry is not None:
+            return entry, candidate
+    for other in ("br", "gzip"):
+        if other in encodings or (other == "br" and brotli is None):
+            continue
+        entry = response_cache.get(etag, other) or flights.lookup((etag, other))
+        if entry is not None:
+            mimetype, body = entry
+            return (mimetype, decompress(body, other)), "identity"
+    return None, encoding
+
+
+def cache_control():
+    if HTTP_CACHE_MAX_AGE > 0:
+        return f"private, max-age={HTTP_CACHE_MAX_AGE}"
+    return "no-cache"
+
+
+def register_http_cache(app):
+    """Serve the app's layout and callback responses with ETags and cached bodies.
+
+    Must run after register_snapshot_hooks so the ETag uses the pinned version.
+    """
+    from flask import g, request  # pylint: disable=import-outside-toplevel
+
+    server = app.server
+    prefix = app.config.routes_pathname_prefix
+    cached_paths = {
+        prefix + "_dash-layout",
+        prefix + "_dash-dependencies",
+        prefix + "_dash-update-component",
+    }
+
+    def is_cacheable():
+        if request.path not in cached_paths or request.args:
+            return False
+        if request.path.endswith("_dash-update-component"):
+            body = request.get_json(silent=True) or {}
+            callback = app.callback_map.get(body.get("output"), {})
+            return not callback.get("long")
+        return True
+
+    @server.before_request
+    def answer_from_http_cache():
+        g.etag = None
+        g.leader = False
+        if not is_cacheable():
+            return None
+
+        g.etag = compute_etag(request.path, request.get_data())
+        if g.etag in request.if_none_match:
+            return not_modified(g.etag)
+
+        requested = pick_encoding(request.headers.get("Accept-Encoding", ""))
+        entry, encoding = lookup_response(g.etag, requested)
+        if entry is None:
+            g.leader, waited = flights.join(g.etag)
+            if waited:
+                entry, encoding = lookup_response(g.etag, requested)
+            if entry is not None and g.leader:
+                # Another worker computed it while we held the local lead
+                flights.done(g.etag)
+                g.leader = False
+        if entry is None:
+            return None
+        mimetype, body = entry
+        response = server.response_class(body, mimetype=mimetype)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+    def not_modified(etag):
+        response = server.response_class(status=304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = cache_control()
+        return response
+
+    @server.after_request
+    def store_in_http_cache(response):
+        etag = getattr(g, "etag", None)
+        if etag is None or response.status_code not in (200, 304):
+            return response
+
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = cache_control()
+        response.vary.add("Accept-Encoding")
+        if response.status_code == 304 or "Content-Encoding" in response.headers:
+            return response
+
+        body = response.get_data()
+        encoding = pick_encoding(request.headers.get("Accept-Encoding", ""))
+        if len(body) < HTTP_CACHE_MIN_COMPRESS_BYTES:
+            encoding = "identity"
+        if encoding != "identity":
+            body = compress(body, encoding)
+            response.set_data(body)
+            response.headers["Content-Encoding"] = encoding
+        response_cache.put(etag, encoding, response.mimetype, body)
+        if g.leader:
+            flights.publish((etag, encoding), (response.mimetype, body))
+        return response
+
+    @server.teardown_request
+    def end_single_flight(_error):
+        # Runs on errors too, so followers never wait on a failed leader
+        if getattr(g, "leader", False):
+            flights.done(g.etag)
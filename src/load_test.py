@@ -0,0 +1,411 @@
+"""
+Load test of the dashboard with simulated user sessions.
+
+Usage (from src/):
+
+    python load_test.py --configs 1x1,2x4 [--users 20] [--duration 60]
+    python load_test.py --url http://localhost:8050 [--users 20] [--duration 60]
+
+Each simulated user opens the page like the browser does (the index, the
+layout, the dependencies and the callbacks fired on load), then repeats
+random actions with a think time between them: switching tabs through
+``theme-tabs`` (with the callbacks of the tab's new components), selecting
+genre and decade bars on the overview, selecting years on the genre
+evolution chart, picking a genre for the radar or a
+set of genres for the energy chart, moving the waffle sliders, zooming
+into the danceability and tempo grid and searching for a track to
+highlight. Background callbacks are polled until
+they finish and count as one request with their total latency.
+
+With --configs a gunicorn server is started for each WORKERSxTHREADS
+configuration in turn; with --url the sessions run against a server that
+is already up. Latency percentiles, requests per second and error rate are
+reported per callback and per configuration.
+"""
+
+import argparse
+import http.client
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import numpy as np
+
+from dataset import DEFAULT_DATASET, load_dataset
+from static_export import OVERVIEW_OUTPUT, TAB_VALUES, callback_body, callback_inputs
+
+REQUEST_TIMEOUT = 300
+BACKGROUND_POLL_SECONDS = 0.2
+SERVER_START_TIMEOUT = 300
+PERCENTILES = [50, 95, 99]
+
+# Callbacks the renderer fires once a tab's content is on the page
+TAB_LOAD_OUTPUTS = {
+    "tab-1": ["audio-features-radar.figure"],
+    "tab-3": ["energy-distribution-graph.figure"],
+    "tab-4": ["temporal-pattern-graph.figure"],
+}
+# Interactions available on each tab; the overview and search are above them
+TAB_ACTIONS = {
+    "tab-1": ["audio-features-radar.figure", "year-selection"],
+    "tab-2": ["waffle"],
+    "tab-3": ["energy-distribution-graph.figure", "danceability-tempo-zoom"],
+    "tab-4": [],
+}
+WAFFLE_OUTPUT = "..waffle-popular.figure...waffle-less-popular.figure.."
+YEAR_SELECTION_OUTPUT = (
+    "..growth-analysis-chart.figure...growth-analysis-periods.children"
+    "...subgenre-heatmap.figure.."
+)
+
+
+def action_pools(snapshot):
+    """Realistic callback inputs per output, from the dataset being served"""
+    pools = defaultdict(list)
+    for output, inputs, _, _ in callback_inputs(snapshot):
+        pools[output].append(inputs)
+
+    # Box selections over several genres and decades at once
+    points = [
+        inputs[0][2]["points"][0]
+        for inputs in pools[OVERVIEW_OUTPUT]
+        if inputs[0][2] and len(inputs[0][2]["points"]) == 1
+    ]
+    for _ in range(50):
+        selected = random.sample(points, random.randint(2, min(6, len(points))))
+        pools[OVERVIEW_OUTPUT].append(
+            [("main-overview-charts", "selectedData", {"points": selected})]
+        )
+
+    thresholds = np.round(np.arange(0, 1.0001, 0.05), 2).tolist()
+    for _ in range(50):
+        low, high = sorted(random.sample(thresholds, 2))
+        pools["waffle"].append(
+            [
+                ("speechiness-threshold-slider", "value", [low, high]),
+                ("popularity-split-slider", "value", random.randint(20, 80)),
+            ]
+        )
+
+    for _ in range(50):
+        x0, y0 = random.uniform(0, 0.8), random.uniform(60, 180)
+        zoom = {
+            "xaxis.range[0]": x0,
+            "xaxis.range[1]": x0 + random.uniform(0.05, 0.2),
+            "yaxis.range[0]": y0,
+            "yaxis.range[1]": y0 + random.uniform(10, 40),
+        }
+        pools["danceability-tempo-zoom"].append(
+            [
+                ("danceability-tempo-mode", "value", "grid"),
+                ("danceability-tempo-graph", "relayoutData", zoom),
+            ]
+        )
+    tracks = snapshot.tracks.sample(min(50, len(snapshot.tracks)))
+    for name, track_id in zip(tracks["track_name"].fillna(""), tracks["track_id"]):
+        # A prefix as typed, or a word from inside the title
+        start = random.choice([0, random.randint(0, max(len(name) - 3, 0))])
+        query = name[start : start + random.randint(2, 8)]
+        pools["track-search"].append(
+            [
+                ("track-search", "search_value", query),
+                ("track-search", "value", None),
+            ]
+        )
+        pools["track-highlight"].append([("track-search", "value", track_id)])
+
+    for _ in range(50):
+        first = random.randint(2000, 2019)
+        years = range(first, random.randint(first + 1, 2020) + 1)
+        selection = {"points": [{"curveNumber": 0, "x": year} for year in years]}
+        pools["year-selection"].append(
+            [("genre-evolution-chart", "selectedData", selection)]
+        )
+    return dict(pools)
+
+
+class Recorder:
+    """Latencies and errors per request name, shared by the session threads"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, ok):
+        with self._lock:
+            self.latencies[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+
+    def report(self, elapsed):
+        rows = []
+        for name in sorted(self.latencies):
+            latencies = np.array(self.latencies[name]) * 1000
+            row = {
+                "name": name,
+                "requests": len(latencies),
+                "rps": len(latencies) / elapsed,
+                "error_rate": self.errors[name] / len(latencies),
+            }
+            for percentile, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+                row[f"p{percentile}_ms"] = value
+            rows.append(row)
+        return rows
+
+
+class Session:
+    """One simulated user on its own keep-alive connection"""
+
+    def __init__(self, url, dataset, pools, recorder, rng, think):
+        parsed = urlparse(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.prefix = parsed.path.rstrip("/")
+        self.headers = {
+            "Content-Type": "application/json",
+            "Accept-Encoding": "br, gzip",
+            "Referer": f"{url}/?dataset={dataset}",
+        }
+        self.pools = pools
+        self.recorder = recorder
+        self.rng = rng
+        self.think = think
+        self.tab = "tab-1"
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        """(status, decoded JSON or None); reconnects once on a dropped connection"""
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout=REQUEST_TIMEOUT
+                )
+            try:
+                self.connection.request(method, self.prefix + path, body, self.headers)
+                response = self.connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+                continue
+            if response.status != 200 or response.getheader("Content-Encoding"):
+                # Compressed bodies are only timed, never needed decoded
+                return response.status, None
+            try:
+                return response.status, json.loads(data)
+            except ValueError:
+                return response.status, None
+        return None, None
+
+    def timed(self, name, method, path, body=None):
+        start = time.perf_counter()
+        try:
+            status, data = self.request(method, path, body)
+        except (http.client.HTTPException, OSError):
+            status, data = None, None
+        self.recorder.add(name, time.perf_counter() - start, status in (200, 204, 304))
+        return status, data
+
+    def fire(self, output, inputs, name=None, initial=False):
+        """POST a callback, polling it to completion if it runs in the background"""
+        name = name or output.strip(".").split(".")[0]
+        body = json.dumps(callback_body(output, inputs, initial))
+        path = "/_dash-update-component"
+        start = time.perf_counter()
+        ok = True
+        try:
+            while True:
+                status, data = self.request("POST", path, body)
+                if status not in (200, 204):
+                    ok = False
+                    break
+                if not data or "response" in data or "cacheKey" not in data:
+                    break
+                path = (
+                    "/_dash-update-component"
+                    f"?cacheKey={data['cacheKey']}&job={data['job']}"
+                )
+                time.sleep(BACKGROUND_POLL_SECONDS)
+        except (http.client.HTTPException, OSError):
+            ok = False
+        self.recorder.add(name, time.perf_counter() - start, ok)
+
+    def pick(self, output):
+        return self.rng.choice(self.pools[output])
+
+    def open_page(self):
+        self.timed("index", "GET", "/")
+        self.timed("_dash-layout", "GET", "/_dash-layout")
+        self.timed("_dash-dependencies", "GET", "/_dash-dependencies")
+        self.fire(OVERVIEW_OUTPUT, self.pools[OVERVIEW_OUTPUT][0], initial=True)
+        # The renderer holds these back until the overview has set the store
+        self.fire("timeline-overview.figure", [("overview-loaded", "data", True)])
+        self.switch_tab("tab-1")
+
+    def switch_tab(self, tab):
+        self.tab = tab
+        self.fire(
+            "tab-content.children",
+            [("theme-tabs", "value", tab), ("overview-loaded", "data", True)],
+        )
+        for output in TAB_LOAD_OUTPUTS.get(tab, []):
+            self.fire(output, self.pick(output))
+
+    def act(self):
+        choices = ["tab", "overview", "search"] + TAB_ACTIONS[self.tab]
+        action = self.rng.choice(choices)
+        if action == "tab":
+            self.switch_tab(self.rng.choice(TAB_VALUES))
+        elif action == "overview":
+            self.fire(OVERVIEW_OUTPUT, self.pick(OVERVIEW_OUTPUT))
+        elif action == "search":
+            self.fire("track-search.options", self.pick("track-search"))
+            self.fire("track-highlight.data", self.pick("track-highlight"))
+        elif action == "waffle":
+            self.fire(WAFFLE_OUTPUT, self.pick("waffle"), name="waffle")
+        elif action == "year-selection":
+            selection = self.pick(action)
+            self.fire(YEAR_SELECTION_OUTPUT, selection, name=action)
+            genre = self.pick("audio-features-radar.figure")[:1]
+            self.fire("audio-features-radar.figure", genre + selection)
+        elif action == "danceability-tempo-zoom":
+            self.fire("danceability-tempo-graph.figure", self.pick(action))
+        else:
+            self.fire(action, self.pick(action))
+
+    def run(self, deadline):
+        self.open_page()
+        while time.monotonic() < deadline:
+            time.sleep(self.rng.expovariate(1 / self.think) if self.think else 0)
+            self.act()
+        if self.connection is not None:
+            self.connection.close()
+
+
+def run_sessions(url, dataset, pools, users, duration, think, seed):
+    """Run users concurrent sessions for duration seconds; returns report rows"""
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(
+            target=Session(
+                url, dataset, pools, recorder, random.Random(seed + user), think
+            ).run,
+            args=(deadline,),
+            daemon=True,
+        )
+        for user in range(users)
+    ]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.report(time.monotonic() - start)
+
+
+def wait_until_up(url, process):
+    parsed = urlparse(url)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=5)
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(1)
+    raise RuntimeError(f"Server not up after {SERVER_START_TIMEOUT}s")
+
+
+def start_server(workers, threads, port):
+    """gunicorn serving server:server on localhost, like the Procfile"""
+    command = [
+        sys.executable, "-m", "gunicorn", "server:server",
+        "--bind", f"127.0.0.1:{port}",
+        "--workers", str(workers),
+        "--threads", str(threads),
+        "--timeout", "120",
+    ]
+    process = subprocess.Popen(command)
+    try:
+        wait_until_up(f"http://127.0.0.1:{port}", process)
+    except RuntimeError:
+        process.terminate()
+        raise
+    return process
+
+
+def parse_config(config):
+    workers, _, threads = config.partition("x")
+    return int(workers), int(threads or 1)
+
+
+def print_report(label, rows):
+    print(f"\n== {label}")
+    header = f"{'request':<36}{'count':>7}{'req/s':>8}{'errors':>8}"
+    header += "".join(f"{f'p{p} ms':>10}" for p in PERCENTILES)
+    print(header)
+    for row in rows:
+        line = f"{row['name']:<36}{row['requests']:>7}{row['rps']:>8.2f}"
+        line += f"{row['error_rate']:>8.1%}"
+        line += "".join(f"{row[f'p{p}_ms']:>10.1f}" for p in PERCENTILES)
+        print(line)
+    total = sum(row["requests"] for row in rows)
+    print(f"{'total':<36}{total:>7}{sum(row['rps'] for row in rows):>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a running server")
+    target.add_argument(
+        "--configs", help="comma-separated WORKERSxTHREADS gunicorn configurations"
+    )
+    parser.add_argument("--users", type=int, default=20, help="concurrent sessions")
+    parser.add_argument("--duration", type=float, default=60, help="seconds per run")
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds between actions")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the reports to this file")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    pools = action_pools(load_dataset(args.dataset))
+    reports = {}
+    runs = [(args.url, None)] if args.url else [
+        (f"http://127.0.0.1:{args.port}", parse_config(c)) for c in args.configs.split(",")
+    ]
+    for url, config in runs:
+        label = url if config is None else f"{config[0]} workers x {config[1]} threads"
+        process = start_server(*config, args.port) if config else None
+        try:
+            rows = run_sessions(
+                url.rstrip("/"), args.dataset, pools, args.users, args.duration,
+                args.think, args.seed,
+            )
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+        reports[label] = rows
+        print_report(label, rows)
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(reports, file, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
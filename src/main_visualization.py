@@ -1,4 +1,5 @@
-import pandas as pd
+import dash
+import numpy as np
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
@@ -6,38 +7,162 @@ import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output
 
+from dataset import (
+    get_year_genre_aggregates,
+    get_yearly_stats,
+    run_query,
+    versioned_cache,
+)
+from derived_columns import decade_of
+from fast_figure import (
+    figure,
+    in_subplot,
+    layout,
+    subplot_axes,
+    subplot_grid,
+    title,
+    trace,
+)
+from figure_payload import compact_figure
+from query_backend import AUDIO_FEATURES
+from row_index import build_bitsets, selection_mask
+
+MIN_YEAR = 1960
+MAX_POPULARITY = 100
+POPULARITY_BIN_SIZE = 5
+# 20 bins of 5 points; a score of 100 falls in the last one
+POPULARITY_BIN_COUNT = MAX_POPULARITY // POPULARITY_BIN_SIZE
+UNSELECTED_OPACITY = 0.3
+# Box and lasso selection only; the overview has nothing to zoom or pan
+OVERVIEW_GRAPH_CONFIG = {
+    "responsive": True,
+    "displaylogo": False,
+    "modeBarButtonsToRemove": [
+        "zoom2d",
+        "pan2d",
+        "zoomIn2d",
+        "zoomOut2d",
+        "autoScale2d",
+        "resetScale2d",
+        "toImage",
+    ],
+}
+OVERVIEW_HEIGHT = 700
+TIMELINE_HEIGHT = 500
+
+
+def cell_dimensions(index):
+    """Genre and decade of each cell of a year and genre indexed aggregate"""
+    years = index.get_level_values("year").to_numpy()
+    return {
+        "genre": index.get_level_values("playlist_genre").to_numpy(),
+        "decade": decade_of(years).astype(int),
+    }
+
+
+@versioned_cache
+def feature_cells():
+    """Track counts and feature sums per (year, genre) cell, with their bitsets"""
+    aggregates = get_year_genre_aggregates(MIN_YEAR)
+    return {
+        "counts": aggregates["count"].to_numpy(dtype=float),
+        "sums": aggregates[AUDIO_FEATURES].to_numpy(dtype=float),
+        "bitsets": build_bitsets(cell_dimensions(aggregates.index)),
+    }
+
+
+@versioned_cache
+def popularity_cells():
+    """Track counts per (year, genre, popularity score) cell, with their bitsets.
+
+    Built from the query backend's counts of the whole catalog rather than
+    the rows in memory, which are only a sample when SAMPLE_ROWS is set.
+    """
+    counts = run_query("popularity_counts")
+    years = counts.index.get_level_values("year")
+    counts = counts[(counts > 0) & (years >= MIN_YEAR)]
+    return {
+        "counts": counts.to_numpy(dtype=float),
+        "bins": popularity_bins(
+            counts.index.get_level_values("track_popularity").to_numpy()
+        ),
+        "bitsets": build_bitsets(cell_dimensions(counts.index)),
+    }
 
 
-def load_main_data():
-    """Load and preprocess data for main visualization"""
-    df = pd.read_csv("./assets/data/spotify_songs.csv")
-    df["track_album_release_date"] = pd.to_datetime(
-        df["track_album_release_date"], errors="coerce"
+def cell_selections(genres, decades):
+    """selection_mask arguments; a dimension with nothing selected is left out"""
+    selections = {}
+    if genres:
+        selections["genre"] = list(genres)
+    if decades:
+        selections["decade"] = list(decades)
+    return selections
+
+
+def popularity_histogram(genres=None, decades=None):
+    """Counts per popularity bin from MIN_YEAR on.
+
+    Only the tracks of the given genres and decades are counted, all of a
+    dimension when none of its values is given.
+    """
+    cells = popularity_cells()
+    mask = selection_mask(cells["bitsets"], **cell_selections(genres, decades))
+    counts = np.bincount(
+        cells["bins"][mask],
+        weights=cells["counts"][mask],
+        minlength=POPULARITY_BIN_COUNT,
     )
-    df["year"] = df["track_album_release_date"].dt.year
+    return counts.astype(int)
+
+
+def popularity_bins(popularity):
+    """Popularity bin of each score; a score of 100 falls in the last bin"""
+    return np.minimum(
+        np.clip(popularity, 0, MAX_POPULARITY) // POPULARITY_BIN_SIZE,
+        POPULARITY_BIN_COUNT - 1,
+    ).astype(int)
 
-    df = df.dropna(subset=["year", "track_popularity", "playlist_genre"])
-    df = df[df["year"] >= 1960]
 
-    return df
+def parse_selection(selected_data):
+    """Sorted (genres, decades) of the genre and decade bars in a selection"""
+    genres, decades = set(), set()
+    for point in (selected_data or {}).get("points", []):
+        curve = point.get("curveNumber")
+        if curve == 0 and "y" in point:
+            genres.add(point["y"])
+        elif curve == 1 and "x" in point:
+            decades.add(int(str(point["x"])[:-1]))
+    return sorted(genres), sorted(decades)
 
 
-def calculate_kpis(df):
-    """Calculate key performance indicators"""
-    total_songs = len(df)
-    total_artists = df["track_artist"].nunique()
-    total_genres = df["playlist_genre"].nunique()
-    total_subgenres = df["playlist_subgenre"].nunique()
-    year_range = f"{int(df['year'].min())}-{int(df['year'].max())}"
-    avg_popularity = df["track_popularity"].mean()
+def selection_aggregates(genres, decades):
+    """Audio feature means and popularity histogram of the selected tracks.
+
+    The tracks are those of any selected genre and any selected decade (all
+    of a dimension when none of its values is selected). Both come from the
+    catalog's aggregate cells, filtered through their per-value bitsets.
+    """
+    cells = feature_cells()
+    mask = selection_mask(cells["bitsets"], **cell_selections(genres, decades))
+    count = cells["counts"][mask].sum()
+    if not count:
+        return np.zeros(len(AUDIO_FEATURES)), np.zeros(POPULARITY_BIN_COUNT, dtype=int)
+    means = cells["sums"][mask].sum(axis=0) / count
+    return means, popularity_histogram(genres, decades)
+
+
+def calculate_kpis(summary):
+    """Calculate key performance indicators from the backend's catalog summary"""
+    year_range = f"{int(summary['min_year'])}-{int(summary['max_year'])}"
 
     return {
-        "total_songs": total_songs,
-        "total_artists": total_artists,
-        "total_genres": total_genres,
-        "total_subgenres": total_subgenres,
+        "total_songs": int(summary["total_songs"]),
+        "total_artists": int(summary["total_artists"]),
+        "total_genres": int(summary["total_genres"]),
+        "total_subgenres": int(summary["total_subgenres"]),
         "year_range": year_range,
-        "avg_popularity": avg_popularity,
+        "avg_popularity": summary["avg_popularity"],
     }
 
 
@@ -168,136 +293,128 @@ def create_kpi_cards(kpis):
     )
 
 
-def generate_main_overview_charts(df):
-    """Generate the main overview charts with improved genre visualization"""
-    fig = make_subplots(
+def generate_main_overview_charts(year_genre_aggregates, popularity_counts):
+    """Generate the main overview charts with improved genre visualization.
+
+    Returns a figure dict from the fast builder: the crossfilter callback
+    rebuilds it on every selection.
+    """
+    figure_layout = subplot_grid(
         rows=2,
         cols=2,
-        subplot_titles=(
+        titles=(
             "Genre Distribution",
             "Songs by Decade",
             "Average Audio Features",
             "Popularity Distribution",
         ),
-        specs=[
-            [{"type": "bar"}, {"type": "bar"}],
-            [{"type": "bar"}, {"type": "histogram"}],
-        ],
         horizontal_spacing=0.1,
         vertical_spacing=0.15,
     )
 
-    genre_counts = df["playlist_genre"].value_counts()
-    genre_percentages = (genre_counts / len(df) * 100).round(1)
+    genre_counts = (
+        year_genre_aggregates["count"]
+        .groupby(level="playlist_genre")
+        .sum()
+        .astype(int)
+        .sort_values(ascending=False)
+    )
+    genre_percentages = (genre_counts / genre_counts.sum() * 100).round(1)
     colors_bar = ["#ff7f0e", "#d62728", "#2ca02c", "#9467bd", "#8c564b", "#e377c2"]
 
-    fig.add_trace(
-        go.Bar(
-            x=genre_percentages.values,
-            y=genre_percentages.index,
-            orientation="h",
-            marker_color=colors_bar[: len(genre_percentages)],
-            text=[f"{val}%" for val in genre_percentages.values],
-            textposition="inside",
-            textfont=dict(color="white", size=10, family="Arial Black"),
-            hovertemplate="<b>%{y}</b><br>Count: %{customdata:,}<br>Percentage: %{x}%<extra></extra>",
-            customdata=genre_counts.values,
-            showlegend=False,
-        ),
-        row=1,
-        col=1,
+    genre_bars = trace(
+        "bar",
+        x=genre_percentages.to_numpy(),
+        y=genre_percentages.index.to_numpy(),
+        orientation="h",
+        marker=dict(color=colors_bar[: len(genre_percentages)]),
+        text=[f"{val}%" for val in genre_percentages.values],
+        textposition="inside",
+        textfont=dict(color="white", size=10, family="Arial Black"),
+        hovertemplate="<b>%{y}</b><br>Count: %{customdata:,}<br>Percentage: %{x}%<extra></extra>",
+        customdata=genre_counts.to_numpy(),
+        showlegend=False,
     )
 
-    df["decade"] = (df["year"] // 10) * 10
-    decade_counts = df["decade"].value_counts().sort_index()
+    year_counts = year_genre_aggregates["count"].groupby(level="year").sum()
+    decade_counts = year_counts.groupby(decade_of(year_counts.index)).sum()
     decade_labels = [f"{int(d)}s" for d in decade_counts.index]
 
-    fig.add_trace(
-        go.Bar(
-            x=decade_labels,
-            y=decade_counts.values,
-            marker_color="#2E86AB",
-            hovertemplate="<b>%{x}</b><br>Songs: %{y:,}<extra></extra>",
-            showlegend=False,
-        ),
-        row=1,
-        col=2,
+    decade_bars = trace(
+        "bar",
+        x=decade_labels,
+        y=decade_counts.to_numpy(),
+        marker=dict(color="#2E86AB"),
+        hovertemplate="<b>%{x}</b><br>Songs: %{y:,}<extra></extra>",
+        showlegend=False,
     )
 
-    audio_features = [
-        "danceability",
-        "energy",
-        "valence",
-        "acousticness",
-        "speechiness",
-        "instrumentalness",
-    ]
-    feature_averages = df[audio_features].mean()
+    totals = year_genre_aggregates.sum()
+    feature_averages = totals[AUDIO_FEATURES] / totals["count"]
 
-    fig.add_trace(
-        go.Bar(
-            x=feature_averages.index,
-            y=feature_averages.values,
-            marker_color="#F18F01",
-            hovertemplate="<b>%{x}</b><br>Average: %{y:.3f}<extra></extra>",
-            showlegend=False,
-        ),
-        row=2,
-        col=1,
+    feature_bars = trace(
+        "bar",
+        x=feature_averages.index.to_numpy(),
+        y=feature_averages.to_numpy(),
+        marker=dict(color="#F18F01"),
+        hovertemplate="<b>%{x}</b><br>Average: %{y:.3f}<extra></extra>",
+        showlegend=False,
     )
 
-    fig.add_trace(
-        go.Histogram(
-            x=df["track_popularity"],
-            nbinsx=20,
-            marker_color="#A23B72",
-            hovertemplate="Popularity: %{x}<br>Count: %{y}<extra></extra>",
-            showlegend=False,
-        ),
-        row=2,
-        col=2,
+    bin_starts = np.arange(POPULARITY_BIN_COUNT) * POPULARITY_BIN_SIZE
+    bin_ends = bin_starts + POPULARITY_BIN_SIZE - 1
+    bin_ends[-1] = MAX_POPULARITY
+
+    popularity_bars = trace(
+        "bar",
+        x=bin_starts + POPULARITY_BIN_SIZE / 2,
+        y=popularity_counts,
+        width=POPULARITY_BIN_SIZE,
+        marker=dict(color="#A23B72"),
+        customdata=[f"{start}-{end}" for start, end in zip(bin_starts, bin_ends)],
+        hovertemplate="Popularity: %{customdata}<br>Count: %{y}<extra></extra>",
+        showlegend=False,
     )
 
-    fig.update_layout(
-        height=700,
+    figure_layout.update(
+        height=OVERVIEW_HEIGHT,
         showlegend=False,
-        title_text="Spotify Dataset Overview",
-        title_x=0.5,
-        title_font_size=20,
+        title=dict(text="Spotify Dataset Overview", x=0.5, font=dict(size=20)),
+        dragmode="select",
+        clickmode="event+select",
+        # Keep the selection box while the callback redraws the figure
+        uirevision="overview",
     )
 
-    fig.update_yaxes(automargin=True, row=1, col=1)
-    fig.update_xaxes(title_text="Percentage (%)", row=1, col=1)
-
-    fig.update_xaxes(tickangle=45, row=2, col=1)
-
-    fig.update_xaxes(title_text="Decade", row=1, col=2)
-    fig.update_yaxes(title_text="Number of Songs", row=1, col=2)
-
-    fig.update_xaxes(title_text="Popularity Score", row=2, col=2)
-    fig.update_yaxes(title_text="Count", row=2, col=2)
+    xaxis, yaxis = subplot_axes(figure_layout, 1, 1, cols=2)
+    yaxis["automargin"] = True
+    xaxis["title"] = title("Percentage (%)")
 
-    fig.update_yaxes(title_text="Average Score", row=2, col=1)
+    xaxis, yaxis = subplot_axes(figure_layout, 1, 2, cols=2)
+    xaxis["title"] = title("Decade")
+    yaxis["title"] = title("Number of Songs")
 
-    return fig
+    xaxis, yaxis = subplot_axes(figure_layout, 2, 1, cols=2)
+    xaxis["tickangle"] = 45
+    yaxis["title"] = title("Average Score")
 
+    xaxis, yaxis = subplot_axes(figure_layout, 2, 2, cols=2)
+    xaxis["title"] = title("Popularity Score")
+    yaxis["title"] = title("Count")
 
-def generate_timeline_overview(df):
-    """Generate a timeline showing data coverage and key metrics over time"""
-    yearly_stats = (
-        df.groupby("year")
-        .agg(
-            {
-                "track_id": "count",
-                "track_popularity": "mean",
-                "playlist_genre": lambda x: x.nunique(),
-            }
-        )
-        .reset_index()
+    return figure(
+        [
+            in_subplot(genre_bars, 1, 1, cols=2),
+            in_subplot(decade_bars, 1, 2, cols=2),
+            in_subplot(feature_bars, 2, 1, cols=2),
+            in_subplot(popularity_bars, 2, 2, cols=2),
+        ],
+        layout(**figure_layout),
     )
 
-    yearly_stats.columns = ["year", "song_count", "avg_popularity", "genre_diversity"]
 
+def generate_timeline_overview(yearly_stats):
+    """Generate a timeline showing data coverage and key metrics over time"""
     fig = make_subplots(
         rows=3,
         cols=1,
@@ -354,7 +471,7 @@ def generate_timeline_overview(df):
     )
 
     fig.update_layout(
-        height=500,
+        height=TIMELINE_HEIGHT,
         showlegend=False,
         title_text="Dataset Timeline Overview",
         title_x=0.5,
@@ -369,10 +486,49 @@ def generate_timeline_overview(df):
     return fig
 
 
+def skeleton_figure(height):
+    """Empty transparent figure holding a graph's place until it loads.
+
+    The graph's skeleton style shows through it while the graph's figure
+    is being computed, and the page does not shift when the figure lands.
+    """
+    hidden = {"visible": False}
+    return {
+        "data": [],
+        "layout": {
+            "height": height,
+            "xaxis": hidden,
+            "yaxis": hidden,
+            "paper_bgcolor": "rgba(0,0,0,0)",
+            "plot_bgcolor": "rgba(0,0,0,0)",
+        },
+    }
+
+
+@versioned_cache
+def overview_figure():
+    """Overview with nothing selected, the figure drawn on load"""
+    return compact_figure(
+        generate_main_overview_charts(
+            get_year_genre_aggregates(MIN_YEAR), popularity_histogram()
+        )
+    )
+
+
+@versioned_cache
+def timeline_figure():
+    return compact_figure(generate_timeline_overview(get_yearly_stats(MIN_YEAR)))
+
+
+@versioned_cache
 def get_main_visualization_content():
-    """Main function to return the main visualization content"""
-    df = load_main_data()
-    kpis = calculate_kpis(df)
+    """Main function to return the main visualization content.
+
+    This is the page shell: the text and KPI cards are in the layout, the
+    charts are skeletons filled in by callbacks once the page is drawn, the
+    overview first and the timeline after it.
+    """
+    kpis = calculate_kpis(run_query("catalog_summary", MIN_YEAR))
 
     return html.Div(
         [
@@ -411,9 +567,13 @@ def get_main_visualization_content():
                     ),
                     dcc.Graph(
                         id="main-overview-charts",
-                        figure=generate_main_overview_charts(df),
-                        config={"responsive": True, "displayModeBar": False},
+                        className="skeleton",
+                        figure=skeleton_figure(OVERVIEW_HEIGHT),
+                        config=OVERVIEW_GRAPH_CONFIG,
                     ),
+                    # Set once the overview is drawn on load: the timeline
+                    # and tab callbacks it feeds are held back until then
+                    dcc.Store(id="overview-loaded"),
                 ],
                 style={"marginBottom": "30px"},
             ),
@@ -425,7 +585,8 @@ def get_main_visualization_content():
                     ),
                     dcc.Graph(
                         id="timeline-overview",
-                        figure=generate_timeline_overview(df),
+                        className="skeleton",
+                        figure=skeleton_figure(TIMELINE_HEIGHT),
                         config={"responsive": True, "displayModeBar": False},
                     ),
                 ],
@@ -477,61 +638,57 @@ def get_main_visualization_content():
             ),
         ]
     )
+
+
 def register_main_visualization_callbacks(app):
-    """Link interactions: clicking on genre or decade filters other charts and highlights selection"""
+    """Link interactions: selecting genres and decades filters the other charts"""
+
+    @app.callback(
+        [Output("main-overview-charts", "figure"), Output("overview-loaded", "data")],
+        [Input("main-overview-charts", "selectedData")],
+    )
+    def crossfilter_and_highlight(selected_data):
+        """Filter the charts by the genre and decade bars selected.
+
+        Clicks (shift-click to add bars), box and lasso selections all come
+        in as selectedData; values are OR-ed within the genre and the decade
+        charts and the two charts AND-ed. Also draws the overview on load.
+        """
+        # Only the load call has no changed input; selections leave the
+        # timeline and tab content alone
+        loaded = dash.no_update if dash.callback_context.triggered else True
+        genres, decades = parse_selection(selected_data)
+        if not genres and not decades:
+            return overview_figure(), loaded
+
+        aggregates = get_year_genre_aggregates(MIN_YEAR)
+        fig = generate_main_overview_charts(aggregates, popularity_histogram())
+        genre_bars, decade_bars, feature_bars, popularity_bars = fig["data"]
+
+        if genres:
+            genre_bars["selectedpoints"] = [
+                i for i, genre in enumerate(genre_bars["y"]) if genre in genres
+            ]
+            # Songs by decade of the selected genres, from the aggregates
+            genre_levels = aggregates.index.get_level_values("playlist_genre")
+            genre_counts = aggregates["count"][genre_levels.isin(genres)]
+            year_counts = genre_counts.groupby(level="year").sum()
+            decade_counts = year_counts.groupby(decade_of(year_counts.index)).sum()
+            decade_bars["x"] = [f"{int(d)}s" for d in decade_counts.index]
+            decade_bars["y"] = decade_counts.to_numpy()
+        if decades:
+            labels = {f"{decade}s" for decade in decades}
+            decade_bars["selectedpoints"] = [
+                i for i, label in enumerate(decade_bars["x"]) if label in labels
+            ]
+        for bars in fig["data"]:
+            bars["unselected"] = dict(marker=dict(opacity=UNSELECTED_OPACITY))
+
+        feature_bars["y"], popularity_bars["y"] = selection_aggregates(genres, decades)
+        return compact_figure(fig), loaded
+
     @app.callback(
-        Output('main-overview-charts', 'figure'),
-        [Input('main-overview-charts', 'clickData')]
+        Output("timeline-overview", "figure"), [Input("overview-loaded", "data")]
     )
-    def crossfilter_and_highlight(clickData):
-        # Full dataset and base figure
-        df_full = load_main_data()
-        fig = generate_main_overview_charts(df_full)
-
-        # If a bar was clicked
-        if clickData and 'points' in clickData:
-            pt = clickData['points'][0]
-            curve = pt.get('curveNumber', 0)
-
-            # === Genre Distribution clicked ===
-            if curve == 0 and 'y' in pt:
-                selected_genre = pt['y']
-                df2 = df_full[df_full['playlist_genre'] == selected_genre]
-
-                # Highlight selected bar in trace 0
-                op0 = [1.0 if y == selected_genre else 0.3 for y in fig.data[0].y]
-                fig.data[0].marker.opacity = op0
-
-                # Update Songs by Decade (trace 1) with filtered data
-                decades = (df2['year']//10*10).value_counts().sort_index()
-                labels = [f"{int(d)}s" for d in decades.index]
-                fig.data[1].x = labels
-                fig.data[1].y = decades.values
-                fig.data[1].marker.opacity = [1.0]*len(labels)
-
-                # Update Audio Features bar (trace 2)
-                feats = ['danceability','energy','valence','acousticness','speechiness','instrumentalness']
-                av = df2[feats].mean()
-                fig.data[2].y = av.values
-
-                # Update Popularity Distribution (trace 3)
-                fig.data[3].x = df2['track_popularity']
-
-            # === Songs by Decade clicked ===
-            elif curve == 1 and 'x' in pt:
-                selected_decade = int(str(pt['x'])[:-1])
-                df2 = df_full[(df_full['year']//10*10) == selected_decade]
-
-                # Highlight selected bar in trace 1
-                op1 = [1.0 if lbl == pt['x'] else 0.3 for lbl in fig.data[1].x]
-                fig.data[1].marker.opacity = op1
-
-                # Update Audio Features bar (trace 2)
-                feats = ['danceability','energy','valence','acousticness','speechiness','instrumentalness']
-                av = df2[feats].mean()
-                fig.data[2].y = av.values
-
-                # Update Popularity Distribution (trace 3)
-                fig.data[3].x = df2['track_popularity']
-
-        return fig
+    def load_timeline(_):
+        return timeline_figure()
@@ -0,0 +1,245 @@
+"""
+Memory accounting of a worker.
+
+memory_report() lists what this process holds: each loaded dataset
+snapshot with its frames and the derived structures, query results and
+figures cached on it, the HTTP response cache, and the process RSS with
+allocator statistics. Sizes are deep. Every buffer is counted once, in the
+first place it is met: ``nbytes`` is an entry's full size and
+``unique_nbytes`` what it adds over the entries listed before it, so a gap
+between the two points at shared or duplicated data.
+
+Each worker also logs a one-line summary every MEMORY_REPORT_INTERVAL
+seconds.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset import pool
+from http_cache import response_cache
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Seconds between summary log lines, 0 to turn them off
+MEMORY_REPORT_INTERVAL = float(os.environ.get("MEMORY_REPORT_INTERVAL", "300"))
+
+logger = logging.getLogger(__name__)
+
+_logger_pid = None
+_logger_lock = threading.Lock()
+
+
+class _MallInfo2(ctypes.Structure):
+    _fields_ = [
+        (name, ctypes.c_size_t)
+        for name in (
+            "arena", "ordblks", "smblks", "hblks", "hblkhd", "usmblks",
+            "fsmblks", "uordblks", "fordblks", "keepcost",
+        )
+    ]
+
+
+class SizeCounter:
+    """Deep sizes that count each object and array buffer once"""
+
+    def __init__(self):
+        self._seen = set()
+
+    def _first_time(self, key):
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        return True
+
+    def array(self, values):
+        total = unique = 0
+        if values.dtype == object:
+            # The pointers, then the objects they point to
+            total = unique = values.nbytes
+            for item in values.ravel():
+                item_total, item_unique = self.measure(item)
+                total += item_total
+                unique += item_unique
+            return total, unique
+        key = (
+            "buffer",
+            values.__array_interface__["data"][0],
+            values.nbytes,
+        )
+        return values.nbytes, values.nbytes if self._first_time(key) else 0
+
+    def frame(self, frame):
+        # Indexes are small or shared by value, they are not deduplicated
+        total = unique = int(frame.index.memory_usage(deep=True))
+        columns = frame.items() if isinstance(frame, pd.DataFrame) else [(None, frame)]
+        for _, series in columns:
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                size = int(series.memory_usage(deep=True, index=False))
+                total, unique = total + size, unique + size
+                continue
+            column_total, column_unique = self.array(series.to_numpy(copy=False))
+            total, unique = total + column_total, unique + column_unique
+        return total, unique
+
+    def measure(self, value):
+        """(deep size, size not counted before) of value"""
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            return self.frame(value)
+        if isinstance(value, np.ndarray):
+            return self.array(value)
+        if hasattr(value, "to_plotly_json"):
+            # Dash components and plotly figures
+            value = value.to_plotly_json()
+
+        first = self._first_time(("object", id(value)))
+        own = sys.getsizeof(value)
+        total, unique = own, own if first else 0
+        if isinstance(value, dict):
+            children = list(value.keys()) + list(value.values())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            children = list(value)
+        else:
+            return total, unique
+        for child in children:
+            child_total, child_unique = self.measure(child)
+            total += child_total
+            unique += child_unique if first else 0
+        return total, unique
+
+
+def cache_entry_name(key):
+    """Group of a snapshot cache key: derived structure or column, query or builder"""
+    if key[0] in ("derived", "column"):
+        return f"{key[0]}:{key[1]}"
+    if key[0] == "query":
+        return f"query:{key[2]}"
+    return f"cached:{key[0]}.{key[1]}"
+
+
+def snapshot_report(snapshot, counter):
+    entries = {}
+
+    def add(name, value):
+        total, unique = counter.measure(value)
+        entry = entries.setdefault(name, {"nbytes": 0, "unique_nbytes": 0, "count": 0})
+        entry["nbytes"] += total
+        entry["unique_nbytes"] += unique
+        entry["count"] += 1
+
+    add("tracks", snapshot.tracks)
+    add("appended", snapshot.appended)
+    add("folded", snapshot.folded)
+    add("density_counts", snapshot.density_counts)
+    add("density_map", snapshot.density_map)
+    for key, value in list(snapshot.caches.items()):
+        add(cache_entry_name(key), value)
+    return {
+        "version": snapshot.version,
+        "rows": len(snapshot.tracks),
+        "nbytes": sum(e["nbytes"] for e in entries.values()),
+        "unique_nbytes": sum(e["unique_nbytes"] for e in entries.values()),
+        "entries": entries,
+    }
+
+
+def process_report():
+    report = {"pid": os.getpid(), "allocated_blocks": sys.getallocatedblocks()}
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        report["rss"], report["vms"] = info.rss, info.vms
+    else:
+        import resource  # pylint: disable=import-outside-toplevel
+
+        # Peak rather than current, in KiB on Linux
+        report["max_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    libc_name = ctypes.util.find_library("c")
+    libc = ctypes.CDLL(libc_name) if libc_name else None
+    if libc is not None and hasattr(libc, "mallinfo2"):
+        libc.mallinfo2.restype = _MallInfo2
+        info = libc.mallinfo2()
+        report["malloc"] = {
+            "arena": info.arena,
+            "mmap": info.hblkhd,
+            "in_use": info.uordblks,
+            "free": info.fordblks,
+            "releasable": info.keepcost,
+        }
+    return report
+
+
+def memory_report():
+    """Deep memory use of this worker's datasets and caches, plus process stats"""
+    counter = SizeCounter()
+    datasets = {
+        snapshot.name: snapshot_report(snapshot, counter) for snapshot in pool.loaded()
+    }
+    return {
+        "process": process_report(),
+        "datasets": datasets,
+        "caches": {"http_responses": response_cache.stats()},
+    }
+
+
+def summary_line(report):
+    process = report["process"]
+    rss = process.get("rss", process.get("max_rss", 0))
+    parts = [f"rss={rss / 2**20:.0f}MB"]
+    for name, dataset in report["datasets"].items():
+        parts.append(
+            f"{name}={dataset['unique_nbytes'] / 2**20:.0f}MB"
+            f"/{dataset['rows']}rows"
+        )
+    parts.append(
+        f"http_responses={report['caches']['http_responses']['nbytes'] / 2**20:.0f}MB"
+    )
+    if "malloc" in process:
+        malloc = process["malloc"]
+        parts.append(
+            f"malloc_in_use={malloc['in_use'] / 2**20:.0f}MB"
+            f" malloc_free={malloc['free'] / 2**20:.0f}MB"
+        )
+    return " ".join(parts)
+
+
+def _log_memory(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            logger.info("Memory of worker %d: %s", os.getpid(), summary_line(memory_report()))
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Memory report failed")
+
+
+def start_memory_logger(interval=MEMORY_REPORT_INTERVAL):
+    """Start the summary logger once per process (threads do not survive fork)"""
+    global _logger_pid
+    if interval <= 0 or _logger_pid == os.getpid():
+        return
+    with _logger_lock:
+        if _logger_pid == os.getpid():
+            return
+        _logger_pid = os.getpid()
+        threading.Thread(
+            target=_log_memory,
+            args=(interval,),
+            name="memory-report-logger",
+            daemon=True,
+        ).start()
+
+
+def register_memory_logger(server):
+    """Log the summary from every worker that serves requests"""
+    server.before_request(start_memory_logger)
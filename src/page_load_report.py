@@ -0,0 +1,258 @@
+"""
+Report of the initial page load: layout size and time to first paint.
+
+Usage (from src/):
+
+    python page_load_report.py [--dataset NAME] [--repeat 5] [--json]
+
+Replays a page load against the app in process, the way the browser does
+it: the index, then the layout and the dependencies, then the callbacks
+Dash fires on load, each once the layout or the callback responses that
+hold its inputs have arrived. Responses are requested with the encodings
+a browser accepts, so sizes are the bytes sent; the layout is also
+reported as uncompressed JSON, the size the browser parses.
+
+Times are server times along the critical path, as if the browser ran
+every callback that is ready in parallel:
+
+- first paint: the index, layout and dependencies are in, so the page
+  shell is drawn;
+- above the fold: the overview charts and KPI cards are drawn too;
+- complete: every callback fired on load has answered.
+
+Background callbacks are left out, as they answer with a job to poll. The
+first load runs with cold response caches, the repeats report medians
+with warm ones.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from dataset import DEFAULT_DATASET
+from http_cache import decompress
+
+ACCEPT_ENCODING = "br, gzip"
+# Components whose content is on screen when the page opens
+ABOVE_THE_FOLD = {"main-overview-charts"}
+
+
+def walk_components(node, found):
+    """Add {id: props} of every component with an id in a layout tree"""
+    if isinstance(node, list):
+        for child in node:
+            walk_components(child, found)
+        return
+    if not isinstance(node, dict) or "props" not in node:
+        return
+    props = node["props"]
+    if "id" in props:
+        found[props["id"]] = props
+    walk_components(props.get("children"), found)
+
+
+def decoded_body(response):
+    encoding = response.headers.get("Content-Encoding")
+    return decompress(response.data, encoding) if encoding else response.data
+
+
+def response_json(response):
+    return json.loads(decoded_body(response))
+
+
+def output_props(dependency):
+    """["id.property"] of a callback's outputs"""
+    return dependency["output"].strip(".").split("...")
+
+
+def has_figure(props):
+    figure = props.get("figure")
+    return bool(figure and figure.get("data"))
+
+
+class PageLoad:
+    """One replayed page load with the Flask test client"""
+
+    def __init__(self, client, dataset):
+        self.client = client
+        self.query = f"?dataset={dataset}"
+        self.headers = {
+            "Accept-Encoding": ACCEPT_ENCODING,
+            "Referer": f"http://localhost/{self.query}",
+        }
+        self.components = {}
+        # Time at which each component's props are known to the browser
+        self.ready_at = {}
+        # Time at which the callback setting each "id.property" answered
+        self.answered_at = {}
+        self.requests = []
+        self.shell_at = 0
+
+    def get(self, path):
+        start = time.perf_counter()
+        response = self.client.get(path, headers=self.headers)
+        elapsed = time.perf_counter() - start
+        self.requests.append((path, len(response.data), elapsed))
+        return response, elapsed
+
+    def run(self):
+        _, index_time = self.get("/" + self.query)
+        layout, layout_time = self.get("/_dash-layout")
+        dependencies, dependencies_time = self.get("/_dash-dependencies")
+        shell_at = index_time + max(layout_time, dependencies_time)
+
+        self.shell_at = shell_at
+        self.add_components(response_json(layout), shell_at)
+        pending = [
+            dependency
+            for dependency in response_json(dependencies)
+            if not dependency.get("prevent_initial_call")
+            and not dependency.get("long")
+        ]
+        complete_at = shell_at
+        while pending:
+            ready = [
+                dependency
+                for dependency in pending
+                if self.can_fire(dependency) and not self.blocked(dependency, pending)
+            ]
+            if not ready:
+                break
+            for dependency in ready:
+                pending.remove(dependency)
+                complete_at = max(complete_at, self.fire(dependency))
+
+        above_the_fold_at = max(
+            [self.ready_at.get(component, shell_at) for component in ABOVE_THE_FOLD]
+        )
+        return {
+            "layout_bytes": self.requests[1][1],
+            "layout_json_bytes": len(decoded_body(layout)),
+            "first_paint_ms": shell_at * 1000,
+            "above_the_fold_ms": above_the_fold_at * 1000,
+            "complete_ms": complete_at * 1000,
+            "requests": len(self.requests),
+            "bytes": sum(size for _, size, _ in self.requests),
+        }
+
+    def add_components(self, tree, at):
+        found = {}
+        walk_components(tree, found)
+        for component, props in found.items():
+            self.components[component] = props
+            if component in ABOVE_THE_FOLD and not has_figure(props):
+                continue
+            self.ready_at[component] = at
+
+    def can_fire(self, dependency):
+        return all(
+            isinstance(item["id"], str) and item["id"] in self.components
+            for item in dependency["inputs"]
+        )
+
+    def blocked(self, dependency, pending):
+        """Whether another pending callback outputs one of its inputs.
+
+        The renderer holds such callbacks back until the other one answers,
+        whether or not that sets the shared property.
+        """
+        inputs = {f"{item['id']}.{item['property']}" for item in dependency["inputs"]}
+        return any(
+            other is not dependency and inputs & set(output_props(other))
+            for other in pending
+        )
+
+    def fire(self, dependency):
+        """POST one callback; returns when its response reached the browser"""
+        outputs = [
+            dict(zip(("id", "property"), prop.rsplit(".", 1)))
+            for prop in output_props(dependency)
+        ]
+        body = {
+            "output": dependency["output"],
+            "outputs": outputs if len(outputs) > 1 else outputs[0],
+            "inputs": [
+                {**item, "value": self.components[item["id"]].get(item["property"])}
+                for item in dependency["inputs"]
+            ],
+            "state": [
+                {**item, "value": self.components.get(item["id"], {}).get(prop)}
+                for item in dependency["state"]
+                for prop in [item["property"]]
+            ],
+            "changedPropIds": [],
+        }
+        start_at = max(
+            [self.shell_at]
+            + [self.ready_at.get(item["id"], 0) for item in dependency["inputs"]]
+            + [
+                self.answered_at.get(f"{item['id']}.{item['property']}", 0)
+                for item in dependency["inputs"]
+            ]
+        )
+        started = time.perf_counter()
+        response = self.client.post(
+            "/_dash-update-component", json=body, headers=self.headers
+        )
+        elapsed = time.perf_counter() - started
+        self.requests.append((dependency["output"], len(response.data), elapsed))
+        done_at = start_at + elapsed
+        for prop in output_props(dependency):
+            self.answered_at[prop] = done_at
+        if response.status_code != 200:
+            return done_at
+
+        for component, props in response_json(response).get("response", {}).items():
+            self.components.setdefault(component, {}).update(props)
+            self.ready_at.setdefault(component, done_at)
+            if "children" in props:
+                self.add_components(props["children"], done_at)
+        return done_at
+
+
+def measure(dataset, repeat):
+    # pylint: disable=import-outside-toplevel
+    from app import app
+    from http_cache import response_cache
+
+    client = app.server.test_client()
+    cold = PageLoad(client, dataset).run()
+    warm_runs = [PageLoad(client, dataset).run() for _ in range(repeat)]
+    warm = {key: statistics.median(run[key] for run in warm_runs) for key in cold}
+    return {"cold": cold, "warm": warm, "response_cache_hits": response_cache.hits}
+
+
+def print_report(report):
+    print(
+        f"{'':<8}{'layout':>10}{'(json)':>11}{'first paint':>14}"
+        f"{'above fold':>13}{'complete':>11}"
+    )
+    for name in ("cold", "warm"):
+        row = report[name]
+        print(
+            f"{name:<8}{row['layout_bytes']:>8,.0f} B"
+            f"{row['layout_json_bytes']:>9,.0f} B"
+            f"{row['first_paint_ms']:>11.1f} ms{row['above_the_fold_ms']:>10.1f} ms"
+            f"{row['complete_ms']:>8.1f} ms"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dataset", default=DEFAULT_DATASET)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print the raw report")
+    args = parser.parse_args(argv)
+
+    report = measure(args.dataset, args.repeat)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Snapshot caches persisted on disk across restarts.
+
+Every entry a snapshot memoizes (query aggregates, derived structures,
+figures) is also written to a disk cache in PERSISTENT_CACHE_DIR, and a
+new snapshot looks its entries up there before computing them. Warming a
+snapshot at start then mostly reads from disk, so the first users after a
+deploy or a worker recycle get warm response times.
+
+Entries are keyed by the dataset's name, a hash of its file's content and
+CODE_VERSION: a hash of the application's sources, of the versions of the
+libraries and of the environment settings that shape the results. Loading
+a dataset drops its entries for any other content, and opening the store
+drops entries of any other code version. Snapshots with appended rows are
+not persisted, as their rows live in memory only.
+"""
+
+import glob
+import hashlib
+import logging
+import os
+import threading
+
+import dash
+import numpy as np
+import pandas as pd
+import plotly
+
+# Empty disables persistence
+PERSISTENT_CACHE_DIR = os.environ.get("PERSISTENT_CACHE_DIR", "./.cache/persistent")
+PERSISTENT_CACHE_SIZE_LIMIT = int(
+    float(os.environ.get("PERSISTENT_CACHE_SIZE_MB", "1024")) * 2**20
+)
+
+# Environment settings that change what a cached entry holds; add new
+# ones here
+RESULT_SETTINGS = [
+    "DANCEABILITY_TEMPO_BINS",
+    "FIGURE_SIGNIFICANT_DIGITS",
+    "QUERY_BACKEND",
+    "SAMPLE_ROWS",
+    "SAMPLE_SEED",
+]
+HASH_BLOCK_BYTES = 2**20
+# Stands for the snapshot version inside persisted keys
+VERSION_PLACEHOLDER = "<version>"
+MISSING = object()
+
+logger = logging.getLogger(__name__)
+
+_store = None
+_store_lock = threading.Lock()
+stats = {"restored": 0, "stored": 0, "errors": 0}
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def compute_code_version():
+    """Hash of the sources, library versions and result settings"""
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__), "*.py"))):
+        with open(path, "rb") as file:
+            digest.update(os.path.basename(path).encode() + b"\0" + file.read())
+    for module in (np, pd, plotly, dash):
+        digest.update(f"{module.__name__}={module.__version__}\0".encode())
+    for name in RESULT_SETTINGS:
+        digest.update(f"{name}={os.environ.get(name)}\0".encode())
+    return digest.hexdigest()[:16]
+
+
+CODE_VERSION = compute_code_version()
+
+
+def get_store():
+    """The disk cache, opened once per process; None when disabled"""
+    global _store
+    if not PERSISTENT_CACHE_DIR:
+        return None
+    with _store_lock:
+        if _store is None:
+            import diskcache  # pylint: disable=import-outside-toplevel
+
+            _store = diskcache.Cache(
+                PERSISTENT_CACHE_DIR, size_limit=PERSISTENT_CACHE_SIZE_LIMIT
+            )
+            _drop(_store, lambda key: key[2] != CODE_VERSION)
+    return _store
+
+
+def _drop(store, stale):
+    dropped = 0
+    for key in list(store.iterkeys()):
+        if stale(key) and store.delete(key):
+            dropped += 1
+    if dropped:
+        logger.info("Dropped %d stale persistent cache entries", dropped)
+
+
+def drop_other_contents(name, content_hash):
+    """Remove the entries of a dataset computed from other file contents"""
+    store = get_store()
+    if store is not None:
+        _drop(store, lambda key: key[0] == name and key[1] != content_hash)
+
+
+def store_key(snapshot, key):
+    if snapshot.content_hash is None:
+        return None
+    normalized = tuple(
+        VERSION_PLACEHOLDER if part == snapshot.version else part for part in key
+    )
+    return (snapshot.name, snapshot.content_hash, CODE_VERSION) + normalized
+
+
+def load(snapshot, key):
+    """A snapshot cache entry persisted by this or an earlier process, or MISSING"""
+    persisted_key = store_key(snapshot, key)
+    store = get_store() if persisted_key is not None else None
+    if store is None:
+        return MISSING
+    try:
+        value = store.get(persisted_key, MISSING)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Could not read persistent cache entry %s", key)
+        stats["errors"] += 1
+        return MISSING
+    if value is not MISSING:
+        stats["restored"] += 1
+    return value
+
+
+def save(snapshot, key, value):
+    persisted_key = store_key(snapshot, key)
+    store = get_store() if persisted_key is not None else None
+    if store is None:
+        return
+    try:
+        store.set(persisted_key, value)
+        stats["stored"] += 1
+    except Exception:  # pylint: disable=broad-except
+        # Unpicklable entries stay in memory only
+        logger.warning("Could not persist cache entry %s", key, exc_info=True)
+        stats["errors"] += 1
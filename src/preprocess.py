@@ -1,23 +1,49 @@
+from typing import Optional
+
 import pandas as pd
 import numpy as np
 
 SEASON_ORDER = ["Winter", "Spring", "Summer", "Fall"]
+# Season of each month number, 1 to 12; index 0 is unused
+SEASON_BY_MONTH = np.array(
+    [None] + ["Winter"] * 2 + ["Spring"] * 3 + ["Summer"] * 3 + ["Fall"] * 3 + ["Winter"],
+    dtype=object,
+)
 
 BIN_SIZE = 1
 JITTER_STEP_Y = 0.005
 MAX_JITTER_RANGE_Y = 0.45
 X_JITTER_MAGNITUDE = 0.95
-NP_RANDOM_SEED = 69
 MAX_SONG_TRESHOLD = 100
-np.random.seed(NP_RANDOM_SEED)
+# A track listed in several playlists is one row per playlist
+JITTER_KEY_COLUMNS = ["track_id", "playlist_id"]
+# 16-character keys of the hash behind each jitter axis
+JITTER_HASH_KEY_Y = "custom-y-jitter!"
+JITTER_HASH_KEY_X = "custom-x-jitter!"
+STREAM_CHUNK_ROWS = 100_000
+# Pinned so every chunk or batch parses alike; partial dates have no season
+RELEASE_DATE_FORMAT = "%Y-%m-%d"
 
 
 def load_and_clean_data(filepath="./assets/data/spotify_songs.csv"):
-    df = pd.read_csv(filepath)
+    return clean_tracks(pd.read_csv(filepath))
+
+
+def iter_clean_chunks(
+    filepath="./assets/data/spotify_songs.csv", chunksize=STREAM_CHUNK_ROWS
+):
+    """Yield the CSV as cleaned chunks so the whole file is never in memory"""
+    for chunk in pd.read_csv(filepath, chunksize=chunksize):
+        yield clean_tracks(chunk)
+
 
-    df["year"] = pd.to_datetime(df["track_album_release_date"], errors="coerce").dt.year
+def clean_tracks(df: pd.DataFrame) -> pd.DataFrame:
+    """Run the cleaning steps on raw rows, either a full catalog or a new batch"""
+    df["year"] = pd.to_datetime(
+        df["track_album_release_date"], format=RELEASE_DATE_FORMAT, errors="coerce"
+    ).dt.year
 
-    df["duration_min"] = df["duration_ms"] / 60000
+    df["duration_min"] = duration_min_of(df["duration_ms"])
     df = df.dropna(
         subset=["energy", "track_popularity", "playlist_genre", "speechiness"]
     )
@@ -28,47 +54,66 @@ def load_and_clean_data(filepath="./assets/data/spotify_songs.csv"):
 
 def _add_season_collumn(df):
     df["track_album_release_date"] = pd.to_datetime(
-        df["track_album_release_date"], errors="coerce"
+        df["track_album_release_date"], format=RELEASE_DATE_FORMAT, errors="coerce"
     )
     df.dropna(subset=["track_album_release_date"], inplace=True)
 
     df["release_month"] = df["track_album_release_date"].dt.month
 
-    df["season"] = df["release_month"].apply(
-        lambda month: "Winter"
-        if month in [12, 1, 2]
-        else "Spring"
-        if month in [3, 4, 5]
-        else "Summer"
-        if month in [6, 7, 8]
-        else "Fall"
-    )
+    df["season"] = season_of_month(df["release_month"])
     return df
 
 
+def duration_min_of(duration_ms):
+    return duration_ms / 60000
+
+
+def season_of_month(months):
+    """Season names of month numbers (1 to 12)"""
+    return SEASON_BY_MONTH[np.asarray(months, dtype=np.int64)]
+
+
+def count_popularity_density(df: pd.DataFrame) -> pd.Series:
+    return df.groupby(["season", "track_popularity"]).size()
+
+
+def density_map_from_counts(density_counts: pd.Series) -> dict:
+    densities = (density_counts / MAX_SONG_TRESHOLD).clip(upper=1.0)
+    return dict(zip(densities.index, densities.values))
+
+
 def create_popularity_density_map(df: pd.DataFrame) -> dict:
-    density_counts = (
-        df.groupby(["season", "track_popularity"]).size().reset_index(name="count")
-    )
+    return density_map_from_counts(count_popularity_density(df))
 
-    density_map = {}
-    for _, row in density_counts.iterrows():
-        season = row["season"]
-        popularity = row["track_popularity"]
-        count = row["count"]
 
-        density = min(count / MAX_SONG_TRESHOLD, 1.0)
-        density_map[(season, popularity)] = density
+def hash_uniform(df: pd.DataFrame, hash_key: str) -> np.ndarray:
+    """Uniform [0, 1) value per row, hashed from its JITTER_KEY_COLUMNS.
 
-    return density_map
+    The hash only depends on the row's own keys, so every process, restart
+    and append computes the same value for a track.
+    """
+    columns = [column for column in JITTER_KEY_COLUMNS if column in df.columns]
+    hashes = pd.util.hash_pandas_object(
+        df[columns], index=False, hash_key=hash_key
+    ).to_numpy()
+    return (hashes >> np.uint64(11)).astype(np.float64) / 2.0**53
 
 
-def calculate_custom_jitter(df: pd.DataFrame) -> pd.DataFrame:
+def calculate_custom_jitter(
+    df: pd.DataFrame, density_map: Optional[dict] = None
+) -> pd.DataFrame:
+    """Add custom_y_jitter to a copy of df.
+
+    An appended batch passes the catalog's updated density_map, so only the
+    new rows need to be jittered; the jitter never depends on other rows.
+    """
     df_with_jitter = df.copy()
 
-    density_map = create_popularity_density_map(df)
+    if density_map is None:
+        density_map = create_popularity_density_map(df)
 
-    jitter_factors = np.random.rand(len(df_with_jitter))
+    # Signed factor in [-1, 1)
+    jitter_factors = 2 * hash_uniform(df_with_jitter, JITTER_HASH_KEY_Y) - 1
 
     def get_density(season, popularity):
         return density_map.get((season, popularity), 0.0)
@@ -82,9 +127,7 @@ def calculate_custom_jitter(df: pd.DataFrame) -> pd.DataFrame:
         ]
     )
 
-    alternating_signs = np.where(np.arange(len(df_with_jitter)) % 2 == 0, 1, -1)
-
-    y_offsets = densities * jitter_factors * MAX_JITTER_RANGE_Y * alternating_signs
+    y_offsets = densities * jitter_factors * MAX_JITTER_RANGE_Y
 
     df_with_jitter["custom_y_jitter"] = y_offsets
 
@@ -0,0 +1,420 @@
+"""
+Query backends computing the dashboard's aggregates.
+
+Charts never group rows themselves: they ask the backend selected by the
+QUERY_BACKEND environment variable for small aggregate frames.
+
+- ``pandas`` (default) groups the snapshot's in-memory tracks.
+- ``duckdb`` runs SQL straight on the dataset's CSV file, plus any rows
+  appended since it was loaded. DuckDB scans the file on all cores and
+  spills to disk past DUCKDB_MEMORY_LIMIT, so aggregates stay within a
+  bounded amount of memory whatever the catalog size.
+- ``streaming`` answers from aggregates folded chunk by chunk while the CSV
+  is streamed in, so loading needs one pass and no full copy of the rows.
+
+Only the pandas backend needs every row in memory; with the others the
+dataset may keep a sample of rows for point-level charts (SAMPLE_ROWS).
+The duckdb backend also reads its columns from the file, so the dataset
+keeps only the columns of the point-level charts (dataset.TRACK_COLUMNS).
+
+Every method takes the dataset snapshot and returns plain pandas objects.
+"""
+
+import os
+
+import pandas as pd
+
+from preprocess import RELEASE_DATE_FORMAT
+
+AUDIO_FEATURES = [
+    "danceability",
+    "energy",
+    "valence",
+    "acousticness",
+    "speechiness",
+    "instrumentalness",
+]
+SUM_COLUMNS = ["track_popularity"] + AUDIO_FEATURES
+# Cleaned columns the aggregates need, shared by both backends
+QUERY_COLUMNS = [
+    "year",
+    "playlist_genre",
+    "playlist_subgenre",
+    "track_artist",
+    "duration_min",
+] + SUM_COLUMNS
+
+QUERY_BACKEND = os.environ.get("QUERY_BACKEND", "pandas")
+DUCKDB_MEMORY_LIMIT = os.environ.get("DUCKDB_MEMORY_LIMIT", "1GB")
+DUCKDB_THREADS = int(os.environ.get("DUCKDB_THREADS", os.cpu_count() or 1))
+
+# (column, min popularity) pairs whose yearly stats the streaming backend folds
+STREAMED_YEARLY_STATS = [("duration_min", 60), ("speechiness", 61)]
+
+_backend = None
+
+
+def compute_year_genre_aggregates(df):
+    """Track count and column sums for every (year, playlist_genre) pair"""
+    grouped = df.groupby(["year", "playlist_genre"])
+    aggregates = grouped[SUM_COLUMNS].sum()
+    aggregates.insert(0, "count", grouped.size())
+    return aggregates
+
+
+def compute_year_subgenre_aggregates(df):
+    """Track count and popularity sum for every (year, playlist_subgenre) pair"""
+    grouped = df.groupby(["year", "playlist_subgenre"])
+    return pd.DataFrame(
+        {
+            "count": grouped.size(),
+            "track_popularity": grouped["track_popularity"].sum(),
+        }
+    )
+
+
+def compute_popularity_counts(df):
+    """Track count for every (year, playlist_genre, track_popularity)"""
+    grouped = df.groupby(["year", "playlist_genre", "track_popularity"])
+    return grouped.size().rename("count")
+
+
+def fold_aggregates(df, full=True):
+    """Additive aggregates of a chunk of cleaned tracks.
+
+    Folds of consecutive chunks combine with merge_folds. Without ``full``
+    only the (year, genre) aggregates every snapshot needs are computed.
+    """
+    folded = {"year_genre": compute_year_genre_aggregates(df)}
+    if not full:
+        return folded
+
+    folded["year_subgenre"] = compute_year_subgenre_aggregates(df)
+    folded["popularity_counts"] = compute_popularity_counts(df)
+    # Value counts per year give exact medians and stay bounded by the
+    # number of distinct values rather than the number of rows
+    folded["yearly_values"] = {
+        (column, min_popularity): df[df["track_popularity"] >= min_popularity]
+        .groupby(["year", column])
+        .size()
+        for column, min_popularity in STREAMED_YEARLY_STATS
+    }
+    folded["artist_last_year"] = df.groupby("track_artist")["year"].max()
+    return folded
+
+
+def merge_folds(left, right):
+    """Combine the folds of two disjoint sets of tracks"""
+    merged = {
+        key: left[key].add(right[key], fill_value=0)
+        for key in ("year_genre", "year_subgenre", "popularity_counts")
+        if key in left
+    }
+    if "yearly_values" in left:
+        merged["yearly_values"] = {
+            pair: counts.add(right["yearly_values"][pair], fill_value=0)
+            for pair, counts in left["yearly_values"].items()
+        }
+        artists = pd.concat([left["artist_last_year"], right["artist_last_year"]])
+        merged["artist_last_year"] = artists.groupby(level=0).max()
+    return merged
+
+
+def _median_from_counts(counts):
+    """Median of a sorted value -> count series, averaging the middle pair"""
+    cumulative = counts.to_numpy().cumsum()
+    total = cumulative[-1]
+    values = counts.index.to_numpy()
+    lower = values[cumulative.searchsorted((total - 1) // 2 + 1)]
+    upper = values[cumulative.searchsorted(total // 2 + 1)]
+    return (lower + upper) / 2
+
+
+class PandasBackend:
+    """Aggregates grouped from the snapshot's in-memory tracks"""
+
+    name = "pandas"
+    needs_all_rows = True
+    needs_all_columns = True
+    folds_at_load = False
+
+    def year_genre_aggregates(self, snapshot):
+        """Track count and column sums per (year, playlist_genre)"""
+        return compute_year_genre_aggregates(snapshot.tracks)
+
+    def year_subgenre_aggregates(self, snapshot):
+        """Track count and popularity sum per (year, playlist_subgenre)"""
+        return compute_year_subgenre_aggregates(snapshot.tracks)
+
+    def popularity_counts(self, snapshot):
+        """Track count per (year, playlist_genre, track_popularity)"""
+        return compute_popularity_counts(snapshot.tracks)
+
+    def popular_yearly_stats(self, snapshot, column, min_popularity):
+        """Yearly mean and median of column over tracks with enough popularity"""
+        tracks = snapshot.tracks
+        popular = tracks[tracks["track_popularity"] >= min_popularity]
+        return (
+            popular.groupby("year")[column].agg(["mean", "median"]).reset_index()
+        )
+
+    def catalog_summary(self, snapshot, min_year):
+        """Row and distinct counts behind the KPI cards"""
+        tracks = snapshot.tracks
+        tracks = tracks[tracks["year"] >= min_year]
+        return {
+            "total_songs": len(tracks),
+            "total_artists": tracks["track_artist"].nunique(),
+            "total_genres": tracks["playlist_genre"].nunique(),
+            "total_subgenres": tracks["playlist_subgenre"].nunique(),
+            "min_year": tracks["year"].min(),
+            "max_year": tracks["year"].max(),
+            "avg_popularity": tracks["track_popularity"].mean(),
+        }
+
+
+class DuckDBBackend:
+    """Aggregates computed by an embedded DuckDB on the dataset file.
+
+    The SQL mirrors preprocess.clean_tracks: rows without energy,
+    popularity, genre, speechiness or a full RELEASE_DATE_FORMAT release
+    date are dropped, so year-only dates are left out as they are there.
+    """
+
+    name = "duckdb"
+    needs_all_rows = False
+    needs_all_columns = False
+    folds_at_load = False
+
+    def __init__(self, memory_limit=DUCKDB_MEMORY_LIMIT, threads=DUCKDB_THREADS):
+        try:
+            import duckdb  # pylint: disable=import-outside-toplevel
+        except ImportError as error:
+            raise ImportError(
+                "QUERY_BACKEND=duckdb needs the duckdb package: pip install duckdb"
+            ) from error
+        self._duckdb = duckdb
+        self.memory_limit = memory_limit
+        self.threads = threads
+
+    def _query(self, snapshot, sql):
+        """Run sql against a `tracks` relation of the snapshot's cleaned rows"""
+        # Connections are cheap and not shareable across threads
+        con = self._duckdb.connect()
+        try:
+            con.execute(f"SET memory_limit = '{self.memory_limit}'")
+            con.execute(f"SET threads = {int(self.threads)}")
+
+            path = snapshot.path.replace("'", "''")
+            columns = ", ".join(QUERY_COLUMNS)
+            release_date = (
+                f"TRY_STRPTIME(track_album_release_date, '{RELEASE_DATE_FORMAT}')"
+            )
+            relation = f"""
+                SELECT {columns} FROM (
+                    SELECT
+                        *,
+                        CAST(year({release_date}) AS DOUBLE) AS year,
+                        duration_ms / 60000.0 AS duration_min
+                    FROM read_csv_auto(
+                        '{path}',
+                        header = true,
+                        types = {{'track_album_release_date': 'VARCHAR'}}
+                    )
+                )
+                WHERE year IS NOT NULL
+                    AND energy IS NOT NULL
+                    AND track_popularity IS NOT NULL
+                    AND playlist_genre IS NOT NULL
+                    AND speechiness IS NOT NULL
+            """
+            if snapshot.appended is not None and len(snapshot.appended):
+                con.register("appended_tracks", snapshot.appended[QUERY_COLUMNS])
+                relation += f" UNION ALL SELECT {columns} FROM appended_tracks"
+
+            return con.execute(f"WITH tracks AS ({relation}) {sql}").df()
+        finally:
+            con.close()
+
+    def year_genre_aggregates(self, snapshot):
+        """Track count and column sums per (year, playlist_genre)"""
+        sums = ", ".join(f"SUM({column}) AS {column}" for column in SUM_COLUMNS)
+        result = self._query(
+            snapshot,
+            f"""
+            SELECT year, playlist_genre, CAST(COUNT(*) AS BIGINT) AS count, {sums}
+            FROM tracks
+            GROUP BY year, playlist_genre
+            ORDER BY year, playlist_genre
+            """,
+        )
+        return result.set_index(["year", "playlist_genre"])
+
+    def year_subgenre_aggregates(self, snapshot):
+        """Track count and popularity sum per (year, playlist_subgenre)"""
+        result = self._query(
+            snapshot,
+            """
+            SELECT
+                year,
+                playlist_subgenre,
+                CAST(COUNT(*) AS BIGINT) AS count,
+                SUM(track_popularity) AS track_popularity
+            FROM tracks
+            WHERE playlist_subgenre IS NOT NULL
+            GROUP BY year, playlist_subgenre
+            ORDER BY year, playlist_subgenre
+            """,
+        )
+        return result.set_index(["year", "playlist_subgenre"])
+
+    def popularity_counts(self, snapshot):
+        """Track count per (year, playlist_genre, track_popularity)"""
+        result = self._query(
+            snapshot,
+            """
+            SELECT
+                year,
+                playlist_genre,
+                track_popularity,
+                CAST(COUNT(*) AS BIGINT) AS count
+            FROM tracks
+            GROUP BY year, playlist_genre, track_popularity
+            ORDER BY year, playlist_genre, track_popularity
+            """,
+        )
+        return result.set_index(["year", "playlist_genre", "track_popularity"])[
+            "count"
+        ]
+
+    def popular_yearly_stats(self, snapshot, column, min_popularity):
+        """Yearly mean and median of column over tracks with enough popularity"""
+        if column not in QUERY_COLUMNS:
+            raise ValueError(f"Unknown column {column!r}")
+        return self._query(
+            snapshot,
+            f"""
+            SELECT year, AVG({column}) AS mean, MEDIAN({column}) AS median
+            FROM tracks
+            WHERE track_popularity >= {int(min_popularity)} AND {column} IS NOT NULL
+            GROUP BY year
+            ORDER BY year
+            """,
+        )
+
+    def catalog_summary(self, snapshot, min_year):
+        """Row and distinct counts behind the KPI cards"""
+        result = self._query(
+            snapshot,
+            f"""
+            SELECT
+                CAST(COUNT(*) AS BIGINT) AS total_songs,
+                CAST(COUNT(DISTINCT track_artist) AS BIGINT) AS total_artists,
+                CAST(COUNT(DISTINCT playlist_genre) AS BIGINT) AS total_genres,
+                CAST(COUNT(DISTINCT playlist_subgenre) AS BIGINT) AS total_subgenres,
+                MIN(year) AS min_year,
+                MAX(year) AS max_year,
+                AVG(track_popularity) AS avg_popularity
+            FROM tracks
+            WHERE year >= {float(min_year)}
+            """,
+        )
+        # Per column, so the counts are not upcast to the averages' floats
+        return {column: values[0] for column, values in result.to_dict("list").items()}
+
+
+class StreamingBackend:
+    """Aggregates folded while the dataset was streamed in.
+
+    Appended rows are folded the same way, so the answers cover the file and
+    every append without touching rows again.
+    """
+
+    name = "streaming"
+    needs_all_rows = False
+    needs_all_columns = True
+    folds_at_load = True
+
+    def year_genre_aggregates(self, snapshot):
+        """Track count and column sums per (year, playlist_genre)"""
+        return snapshot.folded["year_genre"]
+
+    def year_subgenre_aggregates(self, snapshot):
+        """Track count and popularity sum per (year, playlist_subgenre)"""
+        return snapshot.folded["year_subgenre"]
+
+    def popularity_counts(self, snapshot):
+        """Track count per (year, playlist_genre, track_popularity)"""
+        return snapshot.folded["popularity_counts"]
+
+    def popular_yearly_stats(self, snapshot, column, min_popularity):
+        """Yearly mean and median of column over tracks with enough popularity"""
+        pair = (column, min_popularity)
+        if pair not in snapshot.folded["yearly_values"]:
+            raise ValueError(f"{pair} is not in STREAMED_YEARLY_STATS")
+
+        rows = []
+        for year, counts in snapshot.folded["yearly_values"][pair].groupby(
+            level="year"
+        ):
+            counts = counts.droplevel("year").sort_index()
+            counts = counts[counts > 0]
+            values = counts.index.to_numpy(dtype=float)
+            rows.append(
+                {
+                    "year": year,
+                    "mean": (values * counts.to_numpy()).sum() / counts.sum(),
+                    "median": _median_from_counts(counts),
+                }
+            )
+        return pd.DataFrame(rows, columns=["year", "mean", "median"])
+
+    def catalog_summary(self, snapshot, min_year):
+        """Row and distinct counts behind the KPI cards"""
+        year_genre = snapshot.folded["year_genre"]
+        year_genre = year_genre[year_genre["count"] > 0]
+        year_genre = year_genre[
+            year_genre.index.get_level_values("year") >= min_year
+        ]
+        year_subgenre = snapshot.folded["year_subgenre"]
+        year_subgenre = year_subgenre[
+            (year_subgenre["count"] > 0)
+            & (year_subgenre.index.get_level_values("year") >= min_year)
+        ]
+        years = year_genre.index.get_level_values("year")
+        artists = snapshot.folded["artist_last_year"]
+
+        return {
+            "total_songs": int(year_genre["count"].sum()),
+            "total_artists": int((artists >= min_year).sum()),
+            "total_genres": year_genre.index.get_level_values(
+                "playlist_genre"
+            ).nunique(),
+            "total_subgenres": year_subgenre.index.get_level_values(
+                "playlist_subgenre"
+            ).nunique(),
+            "min_year": years.min(),
+            "max_year": years.max(),
+            "avg_popularity": year_genre["track_popularity"].sum()
+            / year_genre["count"].sum(),
+        }
+
+
+BACKENDS = {
+    PandasBackend.name: PandasBackend,
+    DuckDBBackend.name: DuckDBBackend,
+    StreamingBackend.name: StreamingBackend,
+}
+
+
+def get_backend():
+    """The backend selected by QUERY_BACKEND, created on first use"""
+    global _backend
+    if _backend is None:
+        if QUERY_BACKEND not in BACKENDS:
+            raise ValueError(
+                f"Unknown QUERY_BACKEND {QUERY_BACKEND!r}, "
+                f"expected one of {sorted(BACKENDS)}"
+            )
+        _backend = BACKENDS[QUERY_BACKEND]()
+    return _backend
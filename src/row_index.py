@@ -0,0 +1,150 @@
+"""
+Inverted row index of the tracks, per filter dimension.
+
+For every dimension, each value maps to the sorted positions of its rows
+in the snapshot's tracks, built once per snapshot by a single stable
+argsort. A filter on one value is then a slice of k positions instead of a
+scan of every row, several values are a merge of their position arrays
+and several dimensions an intersection of sorted arrays.
+
+For selections that combine many values, build_bitsets gives each value a
+packed bitset of its rows, in the tracks or in any other frame such as the
+catalog's aggregate cells: the values selected in a dimension are OR-ed and
+the dimensions AND-ed, a fixed number of byte operations per value whatever
+the number of matching rows.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Registers the derived columns read through build_column
+import derived_columns  # noqa: F401  pylint: disable=unused-import
+from dataset import build_column, get_derived, get_tracks, register_derived
+
+# Filter name -> function of the tracks giving each row's value
+DIMENSIONS = {
+    "genre": lambda tracks: tracks["playlist_genre"].to_numpy(),
+    "subgenre": lambda tracks: tracks["playlist_subgenre"].to_numpy(),
+    "decade": lambda tracks: build_column("decade", tracks).to_numpy().astype(int),
+    "year": lambda tracks: tracks["year"].to_numpy().astype(int),
+    "season": lambda tracks: build_column("season", tracks).to_numpy(),
+}
+EMPTY_POSITIONS = np.empty(0, dtype=np.int64)
+
+
+def index_dimension(values, offset=0):
+    """{value: sorted row positions} of one column, via one stable argsort"""
+    codes, keys = pd.factorize(values, sort=True)
+    # Missing values (code -1) sort first and are left out of the index
+    order = np.argsort(codes, kind="stable").astype(np.int64) + offset
+    counts = np.bincount(codes + 1, minlength=len(keys) + 1)
+    bounds = np.cumsum(counts)[:-1]
+    return dict(zip(keys.tolist(), np.split(order, bounds)[1:]))
+
+
+def build_row_index(tracks, offset=0):
+    return {
+        "rows": offset + len(tracks),
+        "dimensions": {
+            name: index_dimension(values(tracks), offset)
+            for name, values in DIMENSIONS.items()
+        },
+    }
+
+
+def merge_row_index(index, tracks):
+    """Index of appended rows, which follow the previous ones in the tracks"""
+    new_index = build_row_index(tracks, offset=index["rows"])
+    dimensions = {}
+    for name, positions in index["dimensions"].items():
+        merged = dict(positions)
+        for value, new_positions in new_index["dimensions"][name].items():
+            previous = merged.get(value, EMPTY_POSITIONS)
+            merged[value] = np.concatenate([previous, new_positions])
+        dimensions[name] = merged
+    return {"rows": new_index["rows"], "dimensions": dimensions}
+
+
+register_derived("row_index", build_row_index, merge_row_index)
+
+
+def row_positions(**filters):
+    """Sorted positions of the tracks matching every filter.
+
+    Each filter is a dimension name with one value or a list of values,
+    e.g. row_positions(genre="rock", decade=[1990, 2000]); an empty list
+    matches no track.
+    """
+    dimensions = get_derived("row_index")["dimensions"]
+    result = None
+    for name, wanted in filters.items():
+        values = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+        parts = [dimensions[name].get(value, EMPTY_POSITIONS) for value in values]
+        if not parts:
+            return EMPTY_POSITIONS
+        positions = parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+        if result is None:
+            result = positions
+        else:
+            result = np.intersect1d(result, positions, assume_unique=True)
+    if result is None:
+        return np.arange(len(get_tracks()), dtype=np.int64)
+    return result
+
+
+def filter_tracks(df=None, columns=None, **filters):
+    """Copy of the rows of df (the snapshot's tracks by default) matching the filters.
+
+    Taking rows by position copies them, so columns, when given, limits the
+    copy to the columns the caller reads. df must have the tracks' rows in
+    the same order, e.g. the tracks with columns added.
+    """
+    if df is None:
+        df = get_tracks()
+    if columns is not None:
+        df = df[columns]
+    return df.iloc[row_positions(**filters)]
+
+
+def column_values(column, **filters):
+    """Values of one column for the matching rows, without a frame copy"""
+    return get_tracks()[column].to_numpy()[row_positions(**filters)]
+
+
+def build_bitsets(dimensions):
+    """Packed bitset of the rows of each value, per dimension.
+
+    dimensions maps each name to the values of every row, all of the same
+    length; missing values are in no bitset.
+    """
+    bitsets = {}
+    rows = 0
+    for name, values in dimensions.items():
+        codes, keys = pd.factorize(np.asarray(values), sort=True)
+        rows = len(codes)
+        bitsets[name] = {
+            key: np.packbits(codes == code) for code, key in enumerate(keys.tolist())
+        }
+    return {"rows": rows, "dimensions": bitsets}
+
+
+def selection_mask(bitsets, **selections):
+    """Boolean row mask of a multi-value selection over build_bitsets' rows.
+
+    Each selection is a dimension name with a list of values, OR-ed within
+    the dimension; the dimensions are AND-ed and an empty list selects
+    nothing, e.g. selection_mask(bitsets, genre=["rock", "pop"],
+    decade=[1990, 2000]). Without selections every row is selected.
+    """
+    rows = bitsets["rows"]
+    combined = None
+    for name, values in selections.items():
+        by_value = bitsets["dimensions"][name]
+        union = np.zeros((rows + 7) // 8, dtype=np.uint8)
+        for value in values:
+            if value in by_value:
+                np.bitwise_or(union, by_value[value], out=union)
+        combined = union if combined is None else np.bitwise_and(combined, union)
+    if combined is None:
+        return np.ones(rows, dtype=bool)
+    return np.unpackbits(combined, count=rows).view(bool)
@@ -0,0 +1,129 @@
+"""
+Single-flight coalescing of identical concurrent computations.
+
+When many users open the same tab at once, every request would otherwise
+build the same figure. A key (for HTTP responses, their ETag: the dataset
+version, the callback and its inputs) gets one leader; concurrent callers
+with the same key wait for the leader to finish and then read its result
+from a cache instead of computing it again.
+
+Within a worker, followers wait on a threading.Event. When
+SINGLE_FLIGHT_DIR is set, workers of the host also coalesce: the leader
+holds an flock on one of SINGLE_FLIGHT_LOCK_STRIPES lock files in that
+directory while it computes, and publishes its result in a disk cache in
+the same directory for the other workers. Unrelated keys that share a
+stripe only wait for each other, they never share results.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalescing stays within the worker
+    fcntl = None
+
+# Empty keeps coalescing within each worker
+SINGLE_FLIGHT_DIR = os.environ.get("SINGLE_FLIGHT_DIR", "")
+# Seconds a follower waits for the leader before computing on its own
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get("SINGLE_FLIGHT_TIMEOUT", "60"))
+SINGLE_FLIGHT_LOCK_STRIPES = int(os.environ.get("SINGLE_FLIGHT_LOCK_STRIPES", "256"))
+# Seconds a result published for other workers is kept
+SINGLE_FLIGHT_SHARE_SECONDS = int(os.environ.get("SINGLE_FLIGHT_SHARE_SECONDS", "60"))
+
+LOCK_POLL_SECONDS = 0.01
+
+
+class SingleFlight:
+    """Leader election per key, within the process and optionally across processes"""
+
+    def __init__(self, lock_dir="", timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self.lock_dir = lock_dir if fcntl is not None else ""
+        self.shared = None
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        if self.lock_dir:
+            import diskcache  # pylint: disable=import-outside-toplevel
+
+            os.makedirs(self.lock_dir, exist_ok=True)
+            self.shared = diskcache.Cache(os.path.join(self.lock_dir, "results"))
+
+    def join(self, key):
+        """Wait for any leader of key; returns (is leader, waited for a leader).
+
+        A leader must call done(key) once its result is cached. A follower
+        that waited should look the result up again, and computes it itself
+        if it is missing (the leader failed or timed out).
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = {"event": threading.Event(), "fd": None}
+                leader = True
+            else:
+                leader = False
+                self.coalesced += 1
+        if not leader:
+            flight["event"].wait(self.timeout)
+            return False, True
+        if not self.lock_dir:
+            return True, False
+
+        flight["fd"], waited = self._lock_stripe(key)
+        return True, waited
+
+    def done(self, key):
+        with self._lock:
+            flight = self._flights.pop(key, None)
+        if flight is None:
+            return
+        if flight["fd"] is not None:
+            fcntl.flock(flight["fd"], fcntl.LOCK_UN)
+            os.close(flight["fd"])
+        flight["event"].set()
+
+    def publish(self, key, value):
+        """Make a leader's result visible to the other workers"""
+        if self.shared is not None:
+            self.shared.set(key, value, expire=SINGLE_FLIGHT_SHARE_SECONDS)
+
+    def lookup(self, key):
+        """A result another worker published, or None"""
+        if self.shared is None:
+            return None
+        return self.shared.get(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "coalesced": self.coalesced,
+                "shared": self.shared is not None,
+            }
+
+    def _lock_stripe(self, key):
+        """flock the key's stripe; returns (fd, whether another worker held it)"""
+        stripe = int(hashlib.sha1(str(key).encode()).hexdigest(), 16)
+        stripe %= SINGLE_FLIGHT_LOCK_STRIPES
+        path = os.path.join(self.lock_dir, f"stripe-{stripe:03d}.lock")
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd, waited
+            except BlockingIOError:
+                waited = True
+                if time.monotonic() >= deadline:
+                    # Go ahead unlocked rather than fail the request
+                    os.close(fd)
+                    return None, waited
+                time.sleep(LOCK_POLL_SECONDS)
+
+
+flights = SingleFlight(SINGLE_FLIGHT_DIR)
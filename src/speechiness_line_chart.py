@@ -1,28 +1,26 @@
-import pandas as pd
 import plotly.graph_objs as go
 
 import dash_html_components as html
 import dash_core_components as dcc
 
+from dataset import run_query
+from derived_columns import tier_min_score
+from figure_payload import compact_figure
 
-def get_speechiness_line_chart_content(df):
-    fig = generate_speechiness_line_chart(df)
-    return html.Div([dcc.Graph(figure=fig)])
+# Popular songs are the high popularity tier, scores 61 and up
+POPULAR_MIN_SCORE = tier_min_score("High")
 
 
-def generate_speechiness_line_chart(df):
+def get_speechiness_line_chart_content():
+    agg = run_query("popular_yearly_stats", "speechiness", POPULAR_MIN_SCORE)
+    fig = generate_speechiness_line_chart(agg)
+    return html.Div([dcc.Graph(figure=compact_figure(fig))])
+
+
+def generate_speechiness_line_chart(agg):
     """
     Generates a Plotly line chart showing the median and average speechiness of popular songs on Spotify over the years.
     """
-    df["track_album_release_date"] = pd.to_datetime(
-        df["track_album_release_date"], errors="coerce"
-    )
-    df["year"] = df["track_album_release_date"].dt.year
-
-    df_filtered = df[df["track_popularity"] > 60].copy()
-    agg = (
-        df_filtered.groupby("year")["speechiness"].agg(["mean", "median"]).reset_index()
-    )
 
     fig = go.Figure()
     fig.add_trace(
@@ -0,0 +1,313 @@
+"""
+Export the dashboard as a static bundle served by any plain file server.
+
+Usage (from src/):
+
+    python static_export.py OUTPUT_DIR [--dataset NAME]
+
+The bundle holds the page, Dash's scripts, the assets, the layout and the
+callback outputs for every value of the inputs with a finite domain:
+
+- each tab of ``theme-tabs`` and the dataset timeline,
+- each ``genre-selector`` genre,
+- every subset of genres in ``genre-dropdown``,
+- each single genre, decade and genre and decade pair selected on the
+  overview (crossfilter_and_highlight).
+
+A small script in the exported page answers Dash's layout, dependency and
+callback requests from those JSON files, so no Python runs when the bundle
+is served. Other interactions (the waffle sliders, the danceability and tempo
+view toggle and zoom, wider overview selections, year ranges selected on the
+genre evolution chart, the track search) are left unchanged. The
+bundle must be served at the root of its host.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from urllib.parse import urlparse
+
+from dataset import DEFAULT_DATASET, load_dataset
+
+STATIC_DIR = "_dash-static"
+TAB_VALUES = ["tab-1", "tab-2", "tab-3", "tab-4"]
+OVERVIEW_OUTPUT = "..main-overview-charts.figure...overview-loaded.data.."
+# How the exported page turns each callback's input values into a lookup key
+INPUT_KEYS = {
+    "tab-content.children": ["value", "value"],
+    "timeline-overview.figure": ["value"],
+    "temporal-pattern-graph.figure": ["value"],
+    "audio-features-radar.figure": ["value", "value"],
+    "energy-distribution-graph.figure": ["set"],
+    OVERVIEW_OUTPUT: ["selection"],
+}
+BACKGROUND_POLL_SECONDS = 0.2
+
+STATIC_FETCH_JS = """
+(function () {
+  var prefix = "%(prefix)s";
+  var staticDir = prefix + "%(static_dir)s/";
+  var realFetch = window.fetch.bind(window);
+  var inputKeys = %(input_keys)s;
+
+  function fnv1a(text) {
+    var bytes = new TextEncoder().encode(text);
+    var hash = 0x811c9dc5;
+    for (var i = 0; i < bytes.length; i++) {
+      hash ^= bytes[i];
+      hash = Math.imul(hash, 0x01000193) >>> 0;
+    }
+    return ("0000000" + hash.toString(16)).slice(-8);
+  }
+
+  function inputKey(kind, value) {
+    if (kind === "selection") {
+      var genres = [], decades = [];
+      ((value && value.points) || []).forEach(function (point) {
+        if (point.curveNumber === 0 && genres.indexOf(point.y) < 0) {
+          genres.push(point.y);
+        }
+        if (point.curveNumber === 1 && decades.indexOf(point.x) < 0) {
+          decades.push(point.x);
+        }
+      });
+      return [genres.sort(), decades.sort()];
+    }
+    if (value === undefined) {
+      return null;
+    }
+    if (kind === "set") {
+      return (value || []).slice().sort();
+    }
+    return value;
+  }
+
+  function noUpdate() {
+    return new Response(null, {status: 204});
+  }
+
+  window.fetch = function (url, options) {
+    var path = new URL(url, window.location.href).pathname;
+    if (path === prefix + "_dash-layout") {
+      return realFetch(staticDir + "layout.json");
+    }
+    if (path === prefix + "_dash-dependencies") {
+      return realFetch(staticDir + "dependencies.json");
+    }
+    if (path !== prefix + "_dash-update-component") {
+      return realFetch(url, options);
+    }
+
+    var body = JSON.parse(options.body);
+    var kinds = inputKeys[body.output];
+    if (!kinds) {
+      return Promise.resolve(noUpdate());
+    }
+    var values = body.inputs.map(function (input, i) {
+      return inputKey(kinds[i], input.value);
+    });
+    var name = fnv1a(body.output + "\\n" + JSON.stringify(values));
+    return realFetch(staticDir + "callbacks/" + name + ".json").then(
+      function (response) {
+        return response.ok ? response : noUpdate();
+      }
+    );
+  };
+})();
+"""
+
+
+def fnv1a(text):
+    """32-bit FNV-1a of the UTF-8 text, as the exported page computes it"""
+    digest = 0x811C9DC5
+    for byte in text.encode("utf-8"):
+        digest = ((digest ^ byte) * 0x01000193) & 0xFFFFFFFF
+    return f"{digest:08x}"
+
+
+def callback_file_name(output, key_values):
+    canonical = json.dumps(key_values, separators=(",", ":"), ensure_ascii=False)
+    return fnv1a(f"{output}\n{canonical}") + ".json"
+
+
+def callback_inputs(snapshot):
+    """(output, [(component id, property, value)], key values, initial) per export.
+
+    initial marks the call the renderer makes on page load, with no changed
+    input. The overview's sets overview-loaded, so the tab content and the
+    timeline are only ever called with it True.
+    """
+    # pylint: disable=import-outside-toplevel
+    from derived_columns import decade_of
+    from main_visualization import MIN_YEAR
+
+    genre_levels = snapshot.year_genre.index.get_level_values("playlist_genre")
+    genres = sorted(genre_levels.unique())
+    years = snapshot.year_genre.index.get_level_values("year")
+    decades = sorted({int(decade_of(year)) for year in years if year >= MIN_YEAR})
+
+    for tab in TAB_VALUES:
+        yield "tab-content.children", [
+            ("theme-tabs", "value", tab),
+            ("overview-loaded", "data", True),
+        ], [tab, True], False
+    yield "timeline-overview.figure", [
+        ("overview-loaded", "data", True)
+    ], [True], False
+
+    graph_id = "temporal-pattern-graph"
+    yield f"{graph_id}.figure", [(graph_id, "id", graph_id)], [graph_id], True
+
+    for genre in genres:
+        yield "audio-features-radar.figure", [
+            ("genre-selector", "value", genre),
+            ("genre-evolution-chart", "selectedData", None),
+        ], [genre, None], False
+
+    for size in range(len(genres) + 1):
+        for subset in itertools.combinations(genres, size):
+            yield "energy-distribution-graph.figure", [
+                ("genre-dropdown", "value", list(subset))
+            ], [list(subset)], False
+
+    genre_choices = [[]] + [[genre] for genre in genres]
+    decade_choices = [[]] + [[decade] for decade in decades]
+    for genre_choice, decade_choice in itertools.product(genre_choices, decade_choices):
+        points = [{"curveNumber": 0, "y": genre} for genre in genre_choice]
+        points += [{"curveNumber": 1, "x": f"{decade}s"} for decade in decade_choice]
+        selected_data = {"points": points} if points else None
+        inputs = [("main-overview-charts", "selectedData", selected_data)]
+        key_values = [[genre_choice, [f"{decade}s" for decade in decade_choice]]]
+        # No selection is also how the page loads the overview
+        yield OVERVIEW_OUTPUT, inputs, key_values, selected_data is None
+
+
+def callback_body(output, inputs, initial=False):
+    """_dash-update-component payload as the renderer posts it.
+
+    The initial call has no changed input; other calls are taken as
+    triggered by their last input.
+    """
+    if output.startswith(".."):
+        outputs = [
+            dict(zip(("id", "property"), part.rsplit(".", 1)))
+            for part in output.strip(".").split("...")
+        ]
+    else:
+        outputs = dict(zip(("id", "property"), output.rsplit(".", 1)))
+    return {
+        "output": output,
+        "outputs": outputs,
+        "inputs": [
+            {"id": component, "property": prop, "value": value}
+            for component, prop, value in inputs
+        ],
+        "changedPropIds": [] if initial else [f"{inputs[-1][0]}.{inputs[-1][1]}"],
+        "state": [],
+    }
+
+
+def run_callback(client, headers, output, inputs, initial=False):
+    """POST a callback like the renderer does, polling background jobs"""
+    body = callback_body(output, inputs, initial)
+    url = "/_dash-update-component"
+    while True:
+        response = client.post(url, json=body, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"{output} failed with {response.status_code}")
+        data = response.get_json()
+        if "response" in data:
+            return {"multi": True, "response": data["response"]}
+        if "cacheKey" not in data:
+            return data
+        url = f"/_dash-update-component?cacheKey={data['cacheKey']}&job={data['job']}"
+        time.sleep(BACKGROUND_POLL_SECONDS)
+
+
+def write_file(out_dir, path, data):
+    target = os.path.join(out_dir, path.lstrip("/"))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    mode = "wb" if isinstance(data, bytes) else "w"
+    with open(target, mode) as file:
+        file.write(data)
+
+
+def export_static(out_dir, dataset=DEFAULT_DATASET):
+    """Write the static bundle of one dataset to out_dir"""
+    # pylint: disable=import-outside-toplevel
+    from app import app
+
+    client = app.server.test_client()
+    # Dash requests pick their dataset from the page URL in the Referer
+    headers = {"Referer": f"http://localhost/?dataset={dataset}"}
+    prefix = app.config.requests_pathname_prefix
+
+    index = client.get("/").get_data(as_text=True)
+    script = f'<script src="{prefix}{STATIC_DIR}/static-fetch.js"></script>'
+    write_file(out_dir, "index.html", index.replace("</head>", f"{script}\n</head>", 1))
+    write_file(
+        out_dir,
+        f"{STATIC_DIR}/static-fetch.js",
+        STATIC_FETCH_JS
+        % {
+            "prefix": prefix,
+            "static_dir": STATIC_DIR,
+            "input_keys": json.dumps(INPUT_KEYS),
+        },
+    )
+
+    # Scripts named in the page, plus the chunks Dash loads on demand
+    urls = set(re.findall(r'<script src="([^"]+)"', index))
+    for package, paths in app.registered_paths.items():
+        urls.update(
+            f"/_dash-component-suites/{package}/{path}"
+            for path in paths
+            if not path.endswith(".map")
+        )
+    for url in sorted(urls):
+        write_file(out_dir, urlparse(url).path, client.get(url).get_data())
+
+    assets = app.config.assets_folder
+    shutil.copytree(
+        assets,
+        os.path.join(out_dir, "assets"),
+        ignore=shutil.ignore_patterns("data"),
+        dirs_exist_ok=True,
+    )
+
+    for name, route in [("layout", "_dash-layout"), ("dependencies", "_dash-dependencies")]:
+        response = client.get(f"/{route}", headers=headers)
+        write_file(out_dir, f"{STATIC_DIR}/{name}.json", response.get_data())
+
+    written = {}
+    for output, inputs, key_values, initial in callback_inputs(load_dataset(dataset)):
+        file_name = callback_file_name(output, key_values)
+        if written.setdefault(file_name, (output, key_values)) != (output, key_values):
+            raise RuntimeError(f"Hash collision between {written[file_name]} and {output}")
+        result = run_callback(client, headers, output, inputs, initial)
+        write_file(
+            out_dir,
+            f"{STATIC_DIR}/callbacks/{file_name}",
+            json.dumps(result, separators=(",", ":")),
+        )
+
+    return len(written)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("out_dir", help="directory the bundle is written to")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET)
+    args = parser.parse_args(argv)
+
+    count = export_static(args.out_dir, args.dataset)
+    print(f"Exported {args.dataset} with {count} callback outputs to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,11 @@
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
-import numpy as np
+
+from preprocess import JITTER_HASH_KEY_X, hash_uniform
+from dataset import get_tracks
+from row_index import filter_tracks
+from track_search import highlight_trace
 
 SEASON_ORDER = ["Winter", "Spring", "Summer", "Fall"]
 
@@ -9,30 +13,34 @@ BIN_SIZE = 1
 JITTER_STEP_Y = 0.005
 MAX_JITTER_RANGE_Y = 0.45
 X_JITTER_MAGNITUDE = 0.95
-NP_RANDOM_SEED = 42
 
 SEASON_TO_INDEX = {season: i for i, season in enumerate(SEASON_ORDER)}
-
-np.random.seed(NP_RANDOM_SEED)
+# Shown on hover, in the order the hovertemplate's customdata indices use
+HOVER_COLUMNS = [
+    "track_name",
+    "track_artist",
+    "track_album_release_date",
+    "track_popularity",
+    "season",
+]
 
 
 def compute_plot_positions(df_with_jitter: pd.DataFrame) -> pd.DataFrame:
-    df_with_jitter["custom_x_jitter"] = (
-        np.random.rand(len(df_with_jitter)) - 0.5
+    """New frame with the plot positions added; df_with_jitter is left as is"""
+    custom_x_jitter = (
+        hash_uniform(df_with_jitter, JITTER_HASH_KEY_X) - 0.5
     ) * X_JITTER_MAGNITUDE
 
-    df_with_jitter["x_plot"] = (
-        df_with_jitter["track_popularity"] + df_with_jitter["custom_x_jitter"]
+    return df_with_jitter.assign(
+        custom_x_jitter=custom_x_jitter,
+        x_plot=df_with_jitter["track_popularity"] + custom_x_jitter,
+        y_plot=df_with_jitter["season"].map(SEASON_TO_INDEX)
+        + df_with_jitter["custom_y_jitter"],
     )
-    df_with_jitter["y_plot"] = (
-        df_with_jitter["season"].map(SEASON_TO_INDEX)
-        + df_with_jitter["custom_y_jitter"]
-    )
-
-    return df_with_jitter
 
 
-def get_temporal_pattern_content(df: pd.DataFrame):
+def get_temporal_pattern_content(df: pd.DataFrame, on_progress=None):
+    """Scatter of the snapshot's tracks, calling on_progress(done, total) per genre"""
     df_plot_ready = compute_plot_positions(df)
 
     fig = go.Figure()
@@ -45,10 +53,10 @@ def get_temporal_pattern_content(df: pd.DataFrame):
     }
     legend_title = "Genre"
 
-    for category_name in unique_color_categories:
-        df_filtered = df_plot_ready[
-            df_plot_ready[color_by_column] == category_name
-        ].copy()
+    for done, category_name in enumerate(unique_color_categories, start=1):
+        df_filtered = filter_tracks(
+            df_plot_ready, ["x_plot", "y_plot"] + HOVER_COLUMNS, genre=category_name
+        )
 
         if not df_filtered.empty:
             fig.add_trace(
@@ -71,18 +79,14 @@ def get_temporal_pattern_content(df: pd.DataFrame):
                         + "<b>Artist</b>: %{customdata[1]}<br>"
                         + "<b>Release Date</b>: %{customdata[2]|%Y-%m-%d}<extra></extra>"
                     ),
-                    customdata=df_filtered[
-                        [
-                            "track_name",
-                            "track_artist",
-                            "track_album_release_date",
-                            "track_popularity",
-                            "season",
-                        ]
-                    ].values,
+                    customdata=df_filtered[HOVER_COLUMNS].values,
                     showlegend=True,
                 )
             )
+        if on_progress is not None:
+            on_progress(done, len(unique_color_categories))
+
+    fig.add_trace(highlight_trace())
 
     fig.update_layout(
         title="Song Popularity by Release Season & Genre",
@@ -113,3 +117,9 @@ def get_temporal_pattern_content(df: pd.DataFrame):
     )
 
     return fig
+
+
+def highlight_positions(rows):
+    """Plot positions of the tracks at some row positions, for the search"""
+    positions = compute_plot_positions(get_tracks().iloc[rows])
+    return positions["x_plot"], positions["y_plot"]
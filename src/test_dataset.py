@@ -0,0 +1,104 @@
+"""
+Appends publish a snapshot at the cost of the new rows, and the tracks
+keep only what the query backend needs.
+
+Run from src/ with ``python -m pytest test_dataset.py``.
+"""
+
+import io
+
+import pandas as pd
+import pytest
+
+import dataset
+import persistent_cache
+import query_backend
+from conftest import track_rows
+from dataset import TRACK_COLUMNS, DatasetPool, append_tracks
+from query_backend import DuckDBBackend, StreamingBackend
+
+SAMPLE_ROWS = 40
+
+
+def publish(data_dir, monkeypatch, backend, sample_rows=0):
+    """Load and publish a snapshot of 400 rows with a backend"""
+    pd.DataFrame(track_rows(400)).to_csv(data_dir / "tracks.csv", index=False)
+    monkeypatch.setattr(dataset, "DATA_DIR", str(data_dir))
+    monkeypatch.setattr(dataset, "SAMPLE_ROWS", sample_rows)
+    monkeypatch.setattr(persistent_cache, "PERSISTENT_CACHE_DIR", "")
+    monkeypatch.setattr(query_backend, "_backend", backend)
+    monkeypatch.setattr(dataset, "pool", DatasetPool(2**30))
+    snapshot = dataset._build_snapshot("tracks")  # pylint: disable=protected-access
+    dataset.pool.publish(snapshot)
+    return snapshot
+
+
+@pytest.fixture
+def sampled(tmp_path, monkeypatch):
+    """Published snapshot of which SAMPLE_ROWS rows are kept"""
+    return publish(tmp_path, monkeypatch, StreamingBackend(), SAMPLE_ROWS)
+
+
+def batch_csv(count):
+    rows = pd.DataFrame(track_rows(count))
+    rows["track_id"] = "new " + rows["track_id"]
+    return io.StringIO(rows.to_csv(index=False))
+
+
+def test_batch_is_sampled_at_the_rate_of_the_tracks(sampled):
+    total_rows = sampled.year_genre["count"].sum()
+    appended = append_tracks(batch_csv(400), name="tracks")
+
+    updated = dataset.pool.peek("tracks")
+    kept = len(updated.tracks) - len(sampled.tracks)
+    assert 0 < kept < appended
+    assert abs(kept - appended * SAMPLE_ROWS / total_rows) < 15
+    # The aggregates and the appended rows still cover the whole batch
+    assert len(updated.appended) == appended
+    assert updated.year_genre["count"].sum() == total_rows + appended
+    assert updated.tracks.index.is_unique
+    assert set(updated.tracks.index[len(sampled.tracks) :]) <= set(
+        updated.appended.index
+    )
+
+
+def test_second_batch_gets_new_labels(sampled):
+    append_tracks(batch_csv(100), name="tracks")
+    append_tracks(batch_csv(100), name="tracks")
+
+    updated = dataset.pool.peek("tracks")
+    assert updated.appended.index.is_unique
+    assert updated.tracks.index.is_unique
+
+
+def test_append_leaves_figures_to_first_use(sampled, monkeypatch):
+    calls = []
+    builders = {
+        "merged": (len, lambda previous, rows: previous + len(rows)),
+        "rebuilt": (len, None),
+    }
+    monkeypatch.setattr(dataset, "_derived_builders", builders)
+    monkeypatch.setattr(dataset, "_snapshot_warmers", [lambda: calls.append(1)])
+    dataset._warm(sampled)  # pylint: disable=protected-access
+    assert calls == [1]
+
+    append_tracks(batch_csv(50), name="tracks")
+    updated = dataset.pool.peek("tracks")
+    assert calls == [1]
+    # Structures with a merge are carried over, the others built on first use
+    assert updated.caches[("derived", "merged")] == len(updated.tracks)
+    assert ("derived", "rebuilt") not in updated.caches
+
+
+def test_file_backend_keeps_the_track_columns_only(tmp_path, monkeypatch):
+    pytest.importorskip("duckdb")
+    snapshot = publish(tmp_path, monkeypatch, DuckDBBackend(threads=1))
+    assert set(snapshot.tracks.columns) <= {*TRACK_COLUMNS, "custom_y_jitter"}
+    assert "acousticness" not in snapshot.tracks.columns
+
+    appended = append_tracks(batch_csv(50), name="tracks")
+    updated = dataset.pool.peek("tracks")
+    assert list(updated.tracks.columns) == list(snapshot.tracks.columns)
+    assert len(updated.tracks) == len(snapshot.tracks) + appended
+    # DuckDB queries the appended rows, with every cleaned column
+    assert "acousticness" in updated.appended.columns
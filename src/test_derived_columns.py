@@ -0,0 +1,91 @@
+"""
+Derived columns are built on first use, once per snapshot, and extended by
+appends.
+
+Run from src/ with ``python -m pytest test_derived_columns.py``.
+"""
+
+import io
+
+import numpy as np
+import pandas as pd
+
+import dataset
+from conftest import track_rows
+from dataset import DatasetPool, append_tracks, get_column, get_tracks_with
+from derived_columns import (
+    decade_of,
+    period_of,
+    popularity_tier_of,
+    speechiness_band_of,
+    tier_min_score,
+)
+from waffle_content import (
+    DEFAULT_HIGH_THRESHOLD,
+    DEFAULT_LOW_THRESHOLD,
+    DEFAULT_POPULARITY_SPLIT,
+    count_declared_bands,
+    count_speechiness_bands,
+    get_speechiness_index,
+)
+
+
+def test_column_is_built_on_first_use_and_kept(pinned):
+    key = ("column", "period")
+    assert key not in pinned.caches
+    period = get_column("period")
+    assert pinned.caches[key] is period
+    assert get_column("period") is period
+    pd.testing.assert_series_equal(
+        period,
+        pd.Series(period_of(pinned.tracks["year"]), index=pinned.tracks.index),
+        check_names=False,
+    )
+    assert not period.cat.codes.to_numpy().flags.writeable
+
+
+def test_columns_of_the_cleaning_are_served_from_the_tracks(pinned):
+    assert get_column("season") is not None
+    assert ("column", "season") not in pinned.caches
+
+
+def test_tracks_with_leaves_the_snapshot_as_is(pinned):
+    tracks = get_tracks_with("decade", "speechiness_band")
+    assert "decade" not in pinned.tracks.columns
+    assert tracks["decade"].tolist() == decade_of(pinned.tracks["year"]).tolist()
+    assert tracks["speechiness_band"].tolist() == (
+        speechiness_band_of(pinned.tracks["speechiness"]).tolist()
+    )
+
+
+def test_popularity_tiers():
+    tiers = popularity_tier_of(pd.Series([0, 40, 41, 60, 61, 100]))
+    assert tiers.tolist() == ["Low", "Low", "Medium", "Medium", "High", "High"]
+    assert tier_min_score("High") == 61
+
+
+def test_declared_bands_match_the_speechiness_index(pinned):
+    expected = count_speechiness_bands(
+        get_speechiness_index(),
+        DEFAULT_LOW_THRESHOLD,
+        DEFAULT_HIGH_THRESHOLD,
+        DEFAULT_POPULARITY_SPLIT,
+    )
+    assert count_declared_bands() == expected
+
+
+def test_append_extends_built_columns(snapshot, pinned, monkeypatch):
+    monkeypatch.setattr(dataset, "pool", DatasetPool(2**30))
+    dataset.pool.publish(snapshot)
+    get_column("popularity_tier")
+
+    rows = pd.DataFrame(track_rows(20)).assign(track_id=lambda f: "new " + f.track_id)
+    appended = append_tracks(io.StringIO(rows.to_csv(index=False)), name="tracks")
+
+    updated = dataset.pool.peek("tracks")
+    tiers = updated.caches[("column", "popularity_tier")]
+    assert len(tiers) == len(snapshot.tracks) + appended
+    assert tiers.index.equals(updated.tracks.index)
+    assert np.array_equal(
+        tiers.to_numpy(), popularity_tier_of(updated.tracks["track_popularity"])
+    )
@@ -0,0 +1,81 @@
+"""
+ETags, 304s and cached bodies of the Dash responses.
+
+Run from src/ with ``python -m pytest test_http_cache.py``.
+"""
+
+import dash
+import dash_html_components as html
+import pytest
+from dash.dependencies import Input, Output
+
+import http_cache
+from http_cache import ResponseCache, register_http_cache
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Test client of a one-callback app, with its calls counted"""
+    version = {"value": "tracks@1"}
+    monkeypatch.setattr(http_cache, "get_version", lambda: version["value"])
+    monkeypatch.setattr(http_cache, "response_cache", ResponseCache(2**20))
+
+    app = dash.Dash(__name__)
+    app.layout = html.Div([html.Div(id="source"), html.Div(id="target")])
+    calls = []
+
+    @app.callback(Output("target", "children"), [Input("source", "children")])
+    def echo(value):
+        calls.append(value)
+        return f"echo {value}"
+
+    register_http_cache(app)
+    test_client = app.server.test_client()
+    test_client.version = version
+    test_client.calls = calls
+    return test_client
+
+
+def update_body(value):
+    return {
+        "output": "target.children",
+        "outputs": {"id": "target", "property": "children"},
+        "inputs": [{"id": "source", "property": "children", "value": value}],
+        "state": [],
+        "changedPropIds": ["source.children"],
+    }
+
+
+def test_matching_etag_gets_304(client):
+    first = client.get("/_dash-layout")
+    assert first.status_code == 200
+    etag = first.headers["ETag"].strip('"')
+
+    again = client.get("/_dash-layout", headers={"If-None-Match": f'"{etag}"'})
+    assert again.status_code == 304
+    assert again.data == b""
+    assert again.headers["ETag"].strip('"') == etag
+
+
+def test_new_version_changes_the_etag(client):
+    etag = client.get("/_dash-layout").headers["ETag"]
+    client.version["value"] = "tracks@2"
+
+    response = client.get("/_dash-layout", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_repeated_callback_is_answered_from_the_cache(client):
+    first = client.post("/_dash-update-component", json=update_body("a"))
+    second = client.post("/_dash-update-component", json=update_body("a"))
+    other = client.post("/_dash-update-component", json=update_body("b"))
+
+    assert first.status_code == second.status_code == other.status_code == 200
+    assert second.get_json() == first.get_json()
+    assert first.headers["ETag"] != other.headers["ETag"]
+    assert client.calls == ["a", "b"]
+
+    client.version["value"] = "tracks@2"
+    client.post("/_dash-update-component", json=update_body("a"))
+    assert client.calls == ["a", "b", "a"]
@@ -0,0 +1,55 @@
+"""
+The overview's crossfilter aggregates match a plain filter of the tracks.
+
+Run from src/ with ``python -m pytest test_main_visualization.py``.
+"""
+
+import numpy as np
+import pytest
+
+from main_visualization import (
+    AUDIO_FEATURES,
+    MIN_YEAR,
+    POPULARITY_BIN_COUNT,
+    popularity_bins,
+    selection_aggregates,
+)
+
+
+def expected_aggregates(tracks, genres, decades):
+    mask = tracks["year"].to_numpy() >= MIN_YEAR
+    if genres:
+        mask &= tracks["playlist_genre"].isin(genres).to_numpy()
+    if decades:
+        mask &= np.isin(tracks["year"].to_numpy() // 10 * 10, decades)
+    selected = tracks[mask]
+    histogram = np.bincount(
+        popularity_bins(selected["track_popularity"].to_numpy()),
+        minlength=POPULARITY_BIN_COUNT,
+    )
+    return selected[AUDIO_FEATURES].mean().to_numpy(), histogram
+
+
+@pytest.mark.parametrize(
+    "genres, decades",
+    [
+        (["pop", "rap"], [1990, 2010]),
+        (["rock"], []),
+        ([], [1960, 2000]),
+        ([], []),
+    ],
+)
+def test_selection_matches_a_boolean_mask(pinned, genres, decades):
+    means, histogram = selection_aggregates(genres, decades)
+    expected_means, expected_histogram = expected_aggregates(
+        pinned.tracks, genres, decades
+    )
+    assert histogram.sum() > 0
+    np.testing.assert_allclose(means, expected_means)
+    np.testing.assert_array_equal(histogram, expected_histogram)
+
+
+def test_selection_without_tracks_is_empty(pinned):
+    means, histogram = selection_aggregates(["pop"], [1970])
+    assert not means.any()
+    assert not histogram.any()
@@ -0,0 +1,62 @@
+"""
+Keys of the persistent cache: an entry is only read back for the same
+dataset content and code.
+
+Run from src/ with ``python -m pytest test_persistent_cache.py``.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import persistent_cache
+from persistent_cache import MISSING
+
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(persistent_cache, "PERSISTENT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(persistent_cache, "_store", None)
+    yield tmp_path
+    if persistent_cache._store is not None:  # pylint: disable=protected-access
+        persistent_cache._store.close()  # pylint: disable=protected-access
+
+
+def snapshot(content_hash="abc", version="tracks@1"):
+    return SimpleNamespace(name="tracks", content_hash=content_hash, version=version)
+
+
+def test_entry_is_read_back_for_the_same_content(store_dir):
+    persistent_cache.save(snapshot(version="tracks@1"), ("query", "tracks@1", "x"), 1)
+    # Versions differ between processes; the key stores a placeholder
+    key = ("query", "tracks@2", "x")
+    assert persistent_cache.load(snapshot(version="tracks@2"), key) == 1
+
+
+def test_other_content_misses(store_dir):
+    persistent_cache.save(snapshot(), ("derived", "index"), 1)
+    assert persistent_cache.load(snapshot("def"), ("derived", "index")) is MISSING
+    assert persistent_cache.load(snapshot(), ("derived", "other")) is MISSING
+
+
+def test_snapshot_without_content_hash_is_not_persisted(store_dir):
+    persistent_cache.save(snapshot(None), ("derived", "index"), 1)
+    assert persistent_cache.load(snapshot(None), ("derived", "index")) is MISSING
+    assert len(persistent_cache.get_store()) == 0
+
+
+def test_loading_other_content_drops_entries(store_dir):
+    persistent_cache.save(snapshot("old"), ("derived", "index"), 1)
+    persistent_cache.save(snapshot("new"), ("derived", "index"), 2)
+    persistent_cache.drop_other_contents("tracks", "new")
+    assert persistent_cache.load(snapshot("old"), ("derived", "index")) is MISSING
+    assert persistent_cache.load(snapshot("new"), ("derived", "index")) == 2
+
+
+def test_other_code_version_is_dropped_on_open(store_dir, monkeypatch):
+    persistent_cache.save(snapshot(), ("derived", "index"), 1)
+    persistent_cache._store.close()  # pylint: disable=protected-access
+    monkeypatch.setattr(persistent_cache, "_store", None)
+    monkeypatch.setattr(persistent_cache, "CODE_VERSION", "other")
+    assert persistent_cache.load(snapshot(), ("derived", "index")) is MISSING
+    assert len(persistent_cache.get_store()) == 0
@@ -0,0 +1,77 @@
+"""
+The query backends must give the same answers on the same CSV.
+
+Run from src/ with ``python -m pytest test_query_backend.py``; the DuckDB
+comparisons are skipped when duckdb is not installed.
+"""
+
+import pandas as pd
+import pytest
+
+from conftest import track_rows
+from query_backend import (
+    STREAMED_YEARLY_STATS,
+    DuckDBBackend,
+    PandasBackend,
+    StreamingBackend,
+)
+
+
+def backends():
+    yield PandasBackend()
+    yield StreamingBackend()
+    try:
+        yield DuckDBBackend(threads=1)
+    except ImportError:
+        pass
+
+
+def comparable(aggregates):
+    """Frame of aggregates sorted by their index, the year as a float column"""
+    levels = aggregates.index.nlevels
+    frame = aggregates.reset_index()
+    frame["year"] = frame["year"].astype(float)
+    frame = frame[frame["count"] > 0]
+    return frame.sort_values(list(frame.columns[:levels])).reset_index(drop=True)
+
+
+@pytest.mark.parametrize(
+    "query",
+    ["year_genre_aggregates", "year_subgenre_aggregates", "popularity_counts"],
+)
+def test_aggregates_agree(snapshot, query):
+    expected = comparable(getattr(PandasBackend(), query)(snapshot))
+    for backend in backends():
+        result = comparable(getattr(backend, query)(snapshot))
+        pd.testing.assert_frame_equal(
+            result, expected, check_dtype=False, obj=backend.name
+        )
+
+
+@pytest.mark.parametrize("column, min_popularity", STREAMED_YEARLY_STATS)
+def test_popular_yearly_stats_agree(snapshot, column, min_popularity):
+    expected = PandasBackend().popular_yearly_stats(snapshot, column, min_popularity)
+    for backend in backends():
+        result = backend.popular_yearly_stats(snapshot, column, min_popularity)
+        pd.testing.assert_frame_equal(
+            result.astype(float),
+            expected.astype(float),
+            check_dtype=False,
+            obj=backend.name,
+        )
+
+
+@pytest.mark.parametrize("min_year", [1960, 2000])
+def test_catalog_summary_agrees(snapshot, min_year):
+    expected = PandasBackend().catalog_summary(snapshot, min_year)
+    # Year-only release dates are dropped by the cleaning
+    assert expected["total_songs"] < sum(
+        1 for row in track_rows() if row["energy"] is not None
+    )
+    for backend in backends():
+        result = backend.catalog_summary(snapshot, min_year)
+        assert result.keys() == expected.keys()
+        for key, value in expected.items():
+            assert result[key] == pytest.approx(value), (backend.name, key)
+        for key in ("total_songs", "total_artists", "total_genres"):
+            assert isinstance(result[key], int), (backend.name, key)
@@ -0,0 +1,86 @@
+"""
+Filters through the inverted row index match plain boolean masks.
+
+Run from src/ with ``python -m pytest test_row_index.py``.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import row_index
+from row_index import (
+    build_bitsets,
+    build_row_index,
+    filter_tracks,
+    row_positions,
+    selection_mask,
+)
+
+GENRES = ["pop", "rock", "rap", "edm"]
+SEASONS = ["Winter", "Spring", "Summer", "Fall"]
+
+
+def make_tracks(count=200):
+    rows = np.arange(count)
+    return pd.DataFrame(
+        {
+            "playlist_genre": [GENRES[i % len(GENRES)] for i in rows],
+            "playlist_subgenre": [f"sub {i % 7}" for i in rows],
+            "year": 1960 + (rows * 7) % 61,
+            "season": [SEASONS[i % 5 % len(SEASONS)] for i in rows],
+            "track_popularity": rows % 101,
+        }
+    )
+
+
+@pytest.fixture(autouse=True)
+def tracks(monkeypatch):
+    frame = make_tracks()
+    index = build_row_index(frame)
+    monkeypatch.setattr(row_index, "get_derived", lambda name: index)
+    monkeypatch.setattr(row_index, "get_tracks", lambda: frame)
+    return frame
+
+
+def test_filters_match_a_boolean_mask(tracks):
+    mask = tracks["playlist_genre"].isin(["rock", "edm"]) & (
+        tracks["year"] // 10 * 10
+    ).isin([1970, 2010])
+    positions = row_positions(genre=["rock", "edm"], decade=[1970, 2010])
+    assert positions.tolist() == np.flatnonzero(mask).tolist()
+
+
+def test_empty_value_list_matches_nothing():
+    positions = row_positions(genre=[], decade=[1990])
+    assert positions.dtype == np.int64
+    assert len(positions) == 0
+
+
+def test_no_filter_matches_every_track(tracks):
+    assert row_positions().tolist() == list(range(len(tracks)))
+
+
+def test_filter_tracks_keeps_the_columns_asked_for(tracks):
+    rows = filter_tracks(columns=["year"], genre="pop")
+    assert list(rows.columns) == ["year"]
+    pd.testing.assert_frame_equal(
+        rows, tracks.loc[tracks["playlist_genre"] == "pop", ["year"]]
+    )
+
+
+def test_bitset_selection_matches_a_boolean_mask(tracks):
+    bitsets = build_bitsets(
+        {
+            "genre": tracks["playlist_genre"].to_numpy(),
+            "decade": (tracks["year"] // 10 * 10).to_numpy(),
+        }
+    )
+    genres, decades = ["pop", "rap", "jazz"], [1960, 2000]
+    mask = tracks["playlist_genre"].isin(genres) & (tracks["year"] // 10 * 10).isin(
+        decades
+    )
+    selected = selection_mask(bitsets, genre=genres, decade=decades)
+    assert selected.tolist() == mask.tolist()
+    assert selection_mask(bitsets, genre=[]).sum() == 0
+    assert selection_mask(bitsets).all()
@@ -0,0 +1,55 @@
+"""
+Ranking and deduplication of the track search.
+
+Run from src/ with ``python -m pytest test_track_search.py``.
+"""
+
+import pandas as pd
+import pytest
+
+import track_search
+from track_search import build_search_index, search_tracks, track_rows
+
+# (track_id, name, artist); a track listed in two playlists has two rows
+ROWS = [
+    ("a", "Love Song", "Zed"),
+    ("b", "Glove", "Lovers"),
+    ("c", "Beloved", "Xu"),
+    ("a", "Love Song", "Zed"),
+    ("d", "Lovely", "Yan"),
+    ("e", "Other", "Nobody"),
+]
+
+
+@pytest.fixture(autouse=True)
+def search_index(monkeypatch):
+    tracks = pd.DataFrame(ROWS, columns=["track_id", "track_name", "track_artist"])
+    index = build_search_index(tracks)
+    monkeypatch.setattr(track_search, "get_derived", lambda name: index)
+
+
+def test_name_prefixes_then_artist_prefixes_then_substrings():
+    # "love song" sorts before "lovely"; row 3 repeats track a
+    assert search_tracks("love") == [0, 4, 1, 2]
+
+
+def test_query_is_case_and_space_insensitive():
+    assert search_tracks("  LOVE   song ") == [0]
+
+
+def test_short_query_matches_prefixes_only():
+    assert search_tracks("lo") == [0, 4, 1]
+    assert search_tracks("ov") == []
+
+
+def test_limit_keeps_the_best_matches():
+    assert search_tracks("love", limit=2) == [0, 4]
+
+
+def test_blank_query_finds_nothing():
+    assert search_tracks("   ") == []
+
+
+def test_track_rows_lists_every_row_of_a_track():
+    assert track_rows("a").tolist() == [0, 3]
+    assert track_rows("z").tolist() == []
@@ -0,0 +1,315 @@
+"""
+Track and artist search, and the highlight of the track picked.
+
+Each searched column (track name and artist) is indexed once per snapshot:
+its distinct normalized values in a sorted array, the rows of each value
+and, for every trigram, the sorted ids of the values containing it. A
+prefix is then a binary search of the sorted array, and a substring the
+intersection of the postings of its trigrams, checked against the few
+values left. Queries shorter than a trigram are prefix searches only.
+
+The track picked in the search box is highlighted in the charts that
+registered a highlight, through their graph's extendData: the server sends
+the track's points only and the figures are not rebuilt.
+"""
+
+from collections import defaultdict
+
+import dash_core_components as dcc
+import dash_html_components as html
+import numpy as np
+import pandas as pd
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+
+from dataset import get_derived, get_tracks, register_derived
+from fast_figure import trace
+
+SEARCH_COLUMNS = ["track_name", "track_artist"]
+NGRAM = 3
+SEARCH_LIMIT = 20
+# Substring candidates checked at once
+CANDIDATE_CHUNK = 1024
+HIGHLIGHT_UID = "track-highlight"
+HIGHLIGHT_COLOR = "#191414"
+
+# Graph id -> function of row positions giving the (x, y) of their points
+_highlights = {}
+
+# Replaces the points of a graph's highlight trace, or hides it with a
+# single empty point; figures without a highlight trace are left alone
+HIGHLIGHT_JS = """
+function (highlight, figure, graphId) {
+  var traces = (figure && figure.data) || [];
+  var index = -1;
+  for (var i = 0; i < traces.length; i++) {
+    if (traces[i].uid === "{uid}") {
+      index = i;
+    }
+  }
+  if (index < 0) {
+    return window.dash_clientside.no_update;
+  }
+  var points = (highlight || {})[graphId];
+  if (!points || !points.x.length) {
+    points = {x: [null], y: [null], text: [""]};
+  }
+  return [
+    {x: [points.x], y: [points.y], text: [points.text]},
+    [index],
+    points.x.length
+  ];
+}
+""".replace("{uid}", HIGHLIGHT_UID)
+
+
+def normalize(values):
+    """Case-folded text with runs of spaces collapsed, of a string series"""
+    return (
+        values.fillna("")
+        .astype(str)
+        .str.casefold()
+        .str.replace(r"\s+", " ", regex=True)
+        .str.strip()
+    )
+
+
+def normalize_query(text):
+    return " ".join((text or "").casefold().split())
+
+
+def ngrams(text):
+    return {text[i : i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+def build_sorted_index(values):
+    """Sorted distinct values, with the row positions of each.
+
+    The rows of keys[i] are rows[starts[i]:starts[i + 1]], in row order,
+    and codes[row] is the id of a row's key.
+    """
+    codes, keys = pd.factorize(values, sort=True)
+    order = np.argsort(codes, kind="stable").astype(np.int64)
+    counts = np.bincount(codes[codes >= 0], minlength=len(keys))
+    missing = np.count_nonzero(codes < 0)
+    return {
+        "keys": np.asarray(keys, dtype=object),
+        "starts": np.concatenate([[0], np.cumsum(counts)]) + missing,
+        "rows": order,
+        "codes": codes,
+    }
+
+
+def build_column_index(values):
+    index = build_sorted_index(normalize(values))
+    postings = defaultdict(list)
+    # Keys are visited in sorted order, so each posting list comes out sorted
+    for key_id, key in enumerate(index["keys"]):
+        for gram in ngrams(key):
+            postings[gram].append(key_id)
+    index["grams"] = {
+        gram: np.array(key_ids, dtype=np.int32) for gram, key_ids in postings.items()
+    }
+    return index
+
+
+def build_search_index(tracks):
+    return {
+        "columns": {
+            column: build_column_index(tracks[column]) for column in SEARCH_COLUMNS
+        },
+        "track_ids": build_sorted_index(tracks["track_id"].astype(str)),
+    }
+
+
+register_derived("track_search", build_search_index)
+
+
+def prefix_keys(index, text):
+    """Ids of the keys starting with text, in sorted order"""
+    keys = index["keys"]
+    low = np.searchsorted(keys, text, side="left")
+    # No character sorts after U+10FFFF, so this bounds every extension
+    high = np.searchsorted(keys, text + "\U0010ffff", side="left")
+    return range(low, high)
+
+
+def substring_keys(index, text):
+    """Ids of the keys containing text, in sorted order.
+
+    Candidates are taken from the rarest trigram's postings a chunk at a
+    time, so a query only reads as much of the postings as its first
+    matches need.
+    """
+    postings = sorted(
+        (index["grams"].get(gram) for gram in ngrams(text)),
+        key=lambda key_ids: -1 if key_ids is None else len(key_ids),
+    )
+    if not postings or postings[0] is None:
+        return
+    rarest, others = postings[0], postings[1:]
+    keys = index["keys"]
+    for start in range(0, len(rarest), CANDIDATE_CHUNK):
+        candidates = rarest[start : start + CANDIDATE_CHUNK]
+        for key_ids in others:
+            positions = np.minimum(
+                np.searchsorted(key_ids, candidates), len(key_ids) - 1
+            )
+            candidates = candidates[key_ids[positions] == candidates]
+        # Trigrams can match out of order, so the candidates are checked
+        for key_id in candidates.tolist():
+            if text in keys[key_id]:
+                yield key_id
+
+
+def search_tracks(query, limit=SEARCH_LIMIT):
+    """Row positions of up to limit tracks matching a query, best first.
+
+    Name prefixes come first, then artist prefixes, then names and artists
+    containing the query; each group is in alphabetical order. Rows of the
+    same track id are returned once.
+    """
+    text = normalize_query(query)
+    if not text:
+        return []
+    search_index = get_derived("track_search")
+    track_codes = search_index["track_ids"]["codes"]
+    columns = [search_index["columns"][column] for column in SEARCH_COLUMNS]
+    groups = [(index, prefix_keys(index, text)) for index in columns]
+    if len(text) >= NGRAM:
+        groups += [(index, substring_keys(index, text)) for index in columns]
+
+    found = []
+    seen = set()
+    for index, key_ids in groups:
+        for key_id in key_ids:
+            start, end = index["starts"][key_id], index["starts"][key_id + 1]
+            for row in index["rows"][start:end].tolist():
+                if track_codes[row] not in seen:
+                    seen.add(track_codes[row])
+                    found.append(row)
+                    if len(found) == limit:
+                        return found
+    return found
+
+
+def track_rows(track_id):
+    """Row positions of a track id, from the sorted track ids"""
+    index = get_derived("track_search")["track_ids"]
+    position = np.searchsorted(index["keys"], str(track_id))
+    if position == len(index["keys"]) or index["keys"][position] != str(track_id):
+        return index["rows"][:0]
+    return index["rows"][index["starts"][position] : index["starts"][position + 1]]
+
+
+def track_labels(rows):
+    # Only the rows are taken: converting whole string columns costs more
+    tracks = get_tracks().iloc[rows]
+    return [
+        f"{name} – {artist}"
+        for name, artist in zip(tracks["track_name"], tracks["track_artist"])
+    ]
+
+
+def track_options(rows):
+    track_ids = get_tracks()["track_id"].iloc[rows]
+    return [
+        {"label": label, "value": track_id}
+        for label, track_id in zip(track_labels(rows), track_ids)
+    ]
+
+
+def register_highlight(graph_id, points):
+    """Highlight the track picked in a graph.
+
+    points(rows) gives the x and y of the tracks at those row positions.
+    The graph's figures must hold an empty highlight_trace(), whose points
+    the search replaces.
+    """
+    _highlights[graph_id] = points
+
+
+def highlight_trace():
+    """Empty trace the picked track's points are drawn in"""
+    return trace(
+        "scatter",
+        uid=HIGHLIGHT_UID,
+        x=[],
+        y=[],
+        text=[],
+        mode="markers",
+        name="Selected track",
+        marker={
+            "size": 16,
+            "symbol": "circle-open",
+            "color": HIGHLIGHT_COLOR,
+            "line": {"width": 3, "color": HIGHLIGHT_COLOR},
+        },
+        hovertemplate="<b>%{text}</b><extra></extra>",
+        showlegend=False,
+    )
+
+
+def highlight_points(track_id):
+    """{graph id: x, y and labels of the track's points}, JSON ready"""
+    rows = track_rows(track_id)
+    labels = track_labels(rows)
+    highlights = {}
+    for graph_id, points in _highlights.items():
+        x, y = points(rows)
+        highlights[graph_id] = {
+            "x": np.asarray(x).tolist(),
+            "y": np.asarray(y).tolist(),
+            "text": labels,
+        }
+    return highlights
+
+
+def get_track_search_content():
+    return html.Div(
+        [
+            dcc.Dropdown(
+                id="track-search",
+                placeholder="Find a song by title or artist…",
+                searchable=True,
+                clearable=True,
+                style={"width": "60%", "margin": "auto"},
+            ),
+            dcc.Store(id="track-highlight"),
+        ],
+        style={"marginTop": "20px"},
+    )
+
+
+def register_track_search_callbacks(app):
+    @app.callback(
+        Output("track-search", "options"),
+        [Input("track-search", "search_value")],
+        [State("track-search", "value")],
+        prevent_initial_call=True,
+    )
+    def update_search_options(search_value, value):
+        if not search_value:
+            if value is None:
+                raise PreventUpdate
+            # Keep the picked track's option so its label stays shown
+            return track_options(track_rows(value)[:1])
+        return track_options(search_tracks(search_value))
+
+    @app.callback(
+        Output("track-highlight", "data"),
+        [Input("track-search", "value")],
+        prevent_initial_call=True,
+    )
+    def update_highlight(track_id):
+        if track_id is None:
+            return {}
+        return highlight_points(track_id)
+
+    for graph_id in _highlights:
+        app.clientside_callback(
+            HIGHLIGHT_JS,
+            Output(graph_id, "extendData"),
+            [Input("track-highlight", "data"), Input(graph_id, "figure")],
+            [State(graph_id, "id")],
+        )
@@ -1,41 +1,42 @@
+import numpy as np
 import plotly.graph_objects as go
 
+TOTAL_SQUARES = 100
+N_ROWS = 10
+N_COLS = 10
 
-def generate_waffle_figure(counts, title):
-    total_squares = 100
-    n_rows = 10
-    n_cols = 10
-
-    color_map = {
-        "Low (0.0–0.2)": "#A6CEE3",
-        "Medium (0.2–0.5)": "#1F78B4",
-        "High (0.5–1.0)": "#33A02C",
-    }
+BAND_COLORS = ["#A6CEE3", "#1F78B4", "#33A02C"]
+EMPTY_COLOR = "#FFFFFF"
 
-    category_blocks = []
-    hover_texts = []
-    for category, value in counts.items():
-        proportion = int(round(value / sum(counts.values()) * total_squares))
-        category_blocks.extend([category] * proportion)
-        hover_texts.extend(
-            [f"{category}<br>{(value / sum(counts.values()) * 100):.1f}%"] * proportion
-        )
 
-    while len(category_blocks) < total_squares:
-        category_blocks.append("")
-        hover_texts.append("")
+def generate_waffle_figure(counts, title):
+    """Build a 10x10 waffle from ordered {band label: count} counts"""
+    labels = list(counts.keys())
+    values = np.array(list(counts.values()), dtype=float)
+    total = values.sum()
+    shares = values / total if total > 0 else np.zeros_like(values)
 
-    x_vals, y_vals, colors = [], [], []
+    squares = np.rint(shares * TOTAL_SQUARES).astype(int)
+    category_idx = np.repeat(np.arange(len(labels)), squares)[:TOTAL_SQUARES]
+    # Rounding may leave a few squares unassigned; -1 points at the empty slot
+    category_idx = np.pad(
+        category_idx,
+        (0, TOTAL_SQUARES - len(category_idx)),
+        constant_values=-1,
+    )
 
-    for i in range(total_squares):
-        row = i // n_cols
-        col = i % n_cols
-        category = category_blocks[i]
-        color = color_map.get(category, "#FFFFFF")
+    palette = np.array(
+        [BAND_COLORS[i % len(BAND_COLORS)] for i in range(len(labels))]
+        + [EMPTY_COLOR]
+    )
+    hover_palette = np.array(
+        [f"{label}<br>{share * 100:.1f}%" for label, share in zip(labels, shares)]
+        + [""]
+    )
 
-        x_vals.append(col)
-        y_vals.append(n_rows - 1 - row)
-        colors.append(color)
+    positions = np.arange(TOTAL_SQUARES)
+    x_vals = positions % N_COLS
+    y_vals = N_ROWS - 1 - positions // N_COLS
 
     fig = go.Figure(
         data=go.Scatter(
@@ -44,23 +45,38 @@ def generate_waffle_figure(counts, title):
             mode="markers",
             marker=dict(
                 size=38,
-                color=colors,
+                color=palette[category_idx],
                 symbol="square",
                 line=dict(color="#DDDDDD", width=1),
             ),
-            text=hover_texts,
+            text=hover_palette[category_idx],
             hoverinfo="text",
+            showlegend=False,
         )
     )
+    # Legend entries only: the band labels carry the current thresholds
+    for i, label in enumerate(labels):
+        fig.add_trace(
+            go.Scatter(
+                x=[None],
+                y=[None],
+                mode="markers",
+                marker=dict(
+                    size=12, color=BAND_COLORS[i % len(BAND_COLORS)], symbol="square"
+                ),
+                name=label,
+            )
+        )
 
     fig.update_layout(
         title=dict(text=title, font=dict(size=18, family="Arial Black")),
         xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
         yaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
-        margin=dict(l=20, r=20, t=50, b=20),
-        height=420,
+        margin=dict(l=20, r=20, t=50, b=50),
+        height=450,
         plot_bgcolor="white",
-        showlegend=False,
+        showlegend=True,
+        legend=dict(orientation="h", yanchor="top", y=0, xanchor="center", x=0.5),
     )
 
     return fig
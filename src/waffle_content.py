@@ -1,43 +1,195 @@
+import numpy as np
+
 import dash_html_components as html
 import dash_core_components as dcc
+from dash.dependencies import Input, Output
+
 from waffle import generate_waffle_figure
-from preprocess import load_and_clean_data
+from dataset import get_column, get_derived, register_derived
+from derived_columns import (
+    SPEECHINESS_BANDS,
+    SPEECHINESS_HIGH,
+    SPEECHINESS_LOW,
+    tier_min_score,
+)
+from figure_payload import compact_figure
 
+DEFAULT_LOW_THRESHOLD = SPEECHINESS_LOW
+DEFAULT_HIGH_THRESHOLD = SPEECHINESS_HIGH
+# Popular songs are the high popularity tier
+POPULAR_TIER = "High"
+DEFAULT_POPULARITY_SPLIT = tier_min_score(POPULAR_TIER) - 1
+MAX_POPULARITY = 100
+# Speechiness lives in [0, 1], so a stride of 2 keeps popularity buckets disjoint
+BUCKET_STRIDE = 2.0
 
-def classify_speechiness(val):
-    if val < 0.2:
-        return "Low (0.0–0.2)"
-    elif val < 0.5:
-        return "Medium (0.2–0.5)"
-    else:
-        return "High (0.5–1.0)"
 
+def build_speechiness_index(df):
+    """Sort speechiness values within each popularity score.
+
+    Every track becomes the key ``popularity * BUCKET_STRIDE + speechiness``;
+    once sorted, each popularity score owns a contiguous, speechiness-ordered
+    slice of the key array, starting at ``bucket_starts[score]``.
+    """
+    popularity = (
+        df["track_popularity"].clip(0, MAX_POPULARITY).to_numpy().astype(np.int64)
+    )
+    speechiness = df["speechiness"].to_numpy(dtype=float)
+
+    keys = np.sort(popularity * BUCKET_STRIDE + speechiness)
+    bucket_starts = np.searchsorted(
+        keys, np.arange(MAX_POPULARITY + 2) * BUCKET_STRIDE
+    )
+
+    return {"keys": keys, "bucket_starts": bucket_starts}
+
+
+def merge_speechiness_index(index, df):
+    """Insert new tracks into an existing index without re-sorting it"""
+    new_index = build_speechiness_index(df)
+    keys = index["keys"]
+    positions = np.searchsorted(keys, new_index["keys"])
+    keys = np.insert(keys, positions, new_index["keys"])
+
+    return {
+        "keys": keys,
+        "bucket_starts": index["bucket_starts"] + new_index["bucket_starts"],
+    }
+
+
+register_derived(
+    "speechiness_index", build_speechiness_index, merge_speechiness_index
+)
 
-def get_waffle_content():
-    df = load_and_clean_data()
 
-    df["speechiness_level"] = df["speechiness"].apply(classify_speechiness)
+def get_speechiness_index():
+    """Return the speechiness index of the snapshot in use"""
+    return get_derived("speechiness_index")
 
-    popular_counts = (
-        df[df["track_popularity"] > 60]["speechiness_level"].value_counts().to_dict()
+
+def speechiness_band_labels(low, high):
+    return [
+        f"Low (0.0–{low:g})",
+        f"Medium ({low:g}–{high:g})",
+        f"High ({high:g}–1.0)",
+    ]
+
+
+def count_speechiness_bands(index, low, high, popularity_split):
+    """Count low/medium/high speechiness tracks above and at-or-below the split.
+
+    Each popularity bucket needs two binary searches, so the cost is
+    O(buckets * log n) whatever the thresholds are.
+    """
+    keys = index["keys"]
+    bucket_starts = index["bucket_starts"]
+    bucket_base = np.arange(MAX_POPULARITY + 1) * BUCKET_STRIDE
+
+    below_low = np.searchsorted(keys, bucket_base + low) - bucket_starts[:-1]
+    below_high = np.searchsorted(keys, bucket_base + high) - bucket_starts[:-1]
+    bucket_sizes = np.diff(bucket_starts)
+
+    band_counts = np.stack(
+        [below_low, below_high - below_low, bucket_sizes - below_high]
     )
-    less_popular_counts = (
-        df[df["track_popularity"] <= 60]["speechiness_level"].value_counts().to_dict()
+    is_popular = np.arange(MAX_POPULARITY + 1) > popularity_split
+
+    labels = speechiness_band_labels(low, high)
+    popular_counts = dict(zip(labels, band_counts[:, is_popular].sum(axis=1)))
+    less_popular_counts = dict(zip(labels, band_counts[:, ~is_popular].sum(axis=1)))
+
+    return popular_counts, less_popular_counts
+
+
+def count_declared_bands():
+    """Band counts of popular and other tracks from the declared columns.
+
+    These are the counts at the default thresholds and split; other
+    settings go through the speechiness index.
+    """
+    bands = get_column("speechiness_band")
+    popular = (get_column("popularity_tier") == POPULAR_TIER).to_numpy()
+    codes = bands.cat.codes.to_numpy().astype(np.int64)
+    band_counts = np.bincount(
+        codes * 2 + popular, minlength=2 * len(SPEECHINESS_BANDS)
+    ).reshape(-1, 2)
+
+    labels = speechiness_band_labels(DEFAULT_LOW_THRESHOLD, DEFAULT_HIGH_THRESHOLD)
+    return dict(zip(labels, band_counts[:, 1])), dict(zip(labels, band_counts[:, 0]))
+
+
+def generate_waffle_figures(low, high, popularity_split):
+    defaults = (DEFAULT_LOW_THRESHOLD, DEFAULT_HIGH_THRESHOLD, DEFAULT_POPULARITY_SPLIT)
+    if (low, high, popularity_split) == defaults:
+        popular_counts, less_popular_counts = count_declared_bands()
+    else:
+        popular_counts, less_popular_counts = count_speechiness_bands(
+            get_speechiness_index(), low, high, popularity_split
+        )
+
+    fig_popular = generate_waffle_figure(
+        popular_counts, f"Popular Songs (popularity > {popularity_split})"
+    )
+    fig_less = generate_waffle_figure(
+        less_popular_counts, f"Less Popular Songs (popularity ≤ {popularity_split})"
     )
 
-    fig_popular = generate_waffle_figure(popular_counts, "Popular Songs")
-    fig_less = generate_waffle_figure(less_popular_counts, "Less Popular Songs")
+    return compact_figure(fig_popular), compact_figure(fig_less)
+
+
+def get_waffle_content():
+    fig_popular, fig_less = generate_waffle_figures(
+        DEFAULT_LOW_THRESHOLD, DEFAULT_HIGH_THRESHOLD, DEFAULT_POPULARITY_SPLIT
+    )
 
     return html.Div(
         [
             html.Div(
                 [
                     html.Div(
-                        [dcc.Graph(figure=fig_popular)],
+                        [
+                            html.Label("Speechiness band thresholds:"),
+                            dcc.RangeSlider(
+                                id="speechiness-threshold-slider",
+                                min=0,
+                                max=1,
+                                step=0.05,
+                                value=[DEFAULT_LOW_THRESHOLD, DEFAULT_HIGH_THRESHOLD],
+                                marks={v / 10: f"{v / 10:g}" for v in range(11)},
+                                allowCross=False,
+                            ),
+                        ],
+                        style={"width": "48%", "display": "inline-block"},
+                    ),
+                    html.Div(
+                        [
+                            html.Label("Popularity split:"),
+                            dcc.Slider(
+                                id="popularity-split-slider",
+                                min=0,
+                                max=MAX_POPULARITY - 1,
+                                step=1,
+                                value=DEFAULT_POPULARITY_SPLIT,
+                                marks={v: str(v) for v in range(0, 100, 10)},
+                            ),
+                        ],
+                        style={
+                            "width": "48%",
+                            "display": "inline-block",
+                            "marginLeft": "4%",
+                        },
+                    ),
+                ],
+                style={"marginTop": "20px"},
+            ),
+            html.Div(
+                [
+                    html.Div(
+                        [dcc.Graph(id="waffle-popular", figure=fig_popular)],
                         style={"width": "48%", "display": "inline-block"},
                     ),
                     html.Div(
-                        [dcc.Graph(figure=fig_less)],
+                        [dcc.Graph(id="waffle-less-popular", figure=fig_less)],
                         style={
                             "width": "48%",
                             "display": "inline-block",
@@ -46,6 +198,23 @@ def get_waffle_content():
                     ),
                 ],
                 style={"marginTop": "30px"},
-            )
+            ),
         ]
     )
+
+
+def register_waffle_callbacks(app):
+    @app.callback(
+        [
+            Output("waffle-popular", "figure"),
+            Output("waffle-less-popular", "figure"),
+        ],
+        [
+            Input("speechiness-threshold-slider", "value"),
+            Input("popularity-split-slider", "value"),
+        ],
+        prevent_initial_call=True,
+    )
+    def update_waffles(thresholds, popularity_split):
+        low, high = (round(t, 2) for t in thresholds)
+        return generate_waffle_figures(low, high, int(popularity_split))